@@ -10,6 +10,7 @@ REMOVE_PATHS = (
     '{% if cookiecutter.use_pre_commit != "y" %} .pre-commit-config.yaml, {% endif %}'
     '{% if cookiecutter.use_pytest != "y" %} tests, {% endif %}'
     '{% if cookiecutter.use_github_actions != "y" %} .github, CHANGELOG.md, CONTRIBUTING.md, {% endif %}'
+    '{% if cookiecutter.command_line_interface != "hydra" %} src/hydra_plugins, {% endif %}'
     '{% if cookiecutter.use_docs != "y" %} docs, doc_requirements.txt {% endif %}'
 )
 
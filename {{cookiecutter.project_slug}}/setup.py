@@ -1,5 +1,5 @@
 from typing import List
-from setuptools import setup, find_packages
+from setuptools import setup, find_namespace_packages
 import os
 
 # References:
@@ -65,8 +65,14 @@ setup(
         {%- if cookiecutter.use_docs == "y"-%}"Documentation": "{{cookiecutter.project_docs_url}},"{%- endif -%}
         "Source Code": "{{ cookiecutter.project_source_url }}",
     },
-    packages=find_packages(
+    # hydra_plugins is a namespace package shared with the installed hydra plugins
+    packages=find_namespace_packages(
         where="src",
+        include=[
+            "{{ cookiecutter.project_slug }}",
+            "{{ cookiecutter.project_slug }}.*",
+            "hydra_plugins.*",
+        ],
         exclude=[
             "*.tests",
             "*.tests.*",
@@ -0,0 +1 @@
+"""Hydra launchers of {{cookiecutter.project_slug}}, discovered by hydra through the `hydra_plugins` namespace package."""
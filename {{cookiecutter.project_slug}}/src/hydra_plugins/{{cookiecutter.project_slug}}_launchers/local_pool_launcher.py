@@ -0,0 +1,288 @@
+"""Hydra launcher running multirun jobs in parallel local processes.
+
+Select it with `hydra/launcher=local_pool` (or `cluster=local`):
+
+    python -m {{cookiecutter.project_slug}} <command> -m cluster=local lr=1e-4,1e-5 seed=1,2
+
+Every job runs in its own process, forked from the launcher process, so
+jobs do not share memory or CUDA state. The CPUs available to the launcher
+are split into one disjoint slot per concurrent job; the process of a job is
+pinned to its slot and torch uses as many threads as `OMP_NUM_THREADS` in
+`hydra.job.env_set` (the number of CPUs of the slot by default).
+
+When the sweep is done, the wall time of every job (and its throughput if
+the task returns a mapping with `samples_key`) is logged and written to
+`<sweep dir>/launcher_report.json`.
+"""
+import json
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from hydra.core.config_store import ConfigStore
+from hydra.core.utils import (
+    JobReturn,
+    JobStatus,
+    configure_log,
+    filter_overrides,
+    run_job,
+    setup_globals,
+)
+from hydra.plugins.launcher import Launcher
+from hydra.types import HydraContext, TaskFunction
+from omegaconf import DictConfig, open_dict
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class LocalPoolLauncherConf:
+    _target_: str = (
+        "hydra_plugins.{{cookiecutter.project_slug}}_launchers.local_pool_launcher.LocalPoolLauncher"
+    )
+    # number of concurrent jobs. Defaults to the number of CPUs divided by cpus_per_job
+    n_jobs: Optional[int] = None
+    # size of the CPU slot of a job. Defaults to the number of CPUs divided by n_jobs
+    cpus_per_job: Optional[int] = None
+    # pin the process of each job to its CPU slot (Linux only)
+    pin_cpus: bool = True
+    # call torch.set_num_threads in each job, see the module documentation
+    set_num_threads: bool = True
+    # key of the number of processed samples in the mappings returned by the task
+    samples_key: str = "num_samples"
+
+
+ConfigStore.instance().store(
+    group="hydra/launcher", name="local_pool", node=LocalPoolLauncherConf
+)
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_slots(
+    cpus: Sequence[int], n_jobs: Optional[int], cpus_per_job: Optional[int]
+) -> List[List[int]]:
+    """Split `cpus` into disjoint slots, one per concurrent job."""
+    if cpus_per_job is None:
+        cpus_per_job = max(1, len(cpus) // (n_jobs or len(cpus)))
+    if n_jobs is None:
+        n_jobs = max(1, len(cpus) // cpus_per_job)
+    # slots wrap around (and overlap) if more CPUs are requested than available
+    return [
+        [cpus[(i * cpus_per_job + j) % len(cpus)] for j in range(cpus_per_job)]
+        for i in range(n_jobs)
+    ]
+
+
+# State of the launcher process, inherited by the forked job processes: the task
+# function is usually not picklable, as hydra.main rebinds its module-level name.
+_HYDRA_CONTEXT: Optional[HydraContext] = None
+_TASK_FUNCTION: Optional[TaskFunction] = None
+
+
+def _run_job_in_child(
+    conn: Connection, sweep_config: DictConfig, cpus: List[int], set_num_threads: bool
+) -> None:
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    env_set = sweep_config.hydra.job.env_set
+    num_threads = int(env_set.get("OMP_NUM_THREADS", len(cpus) or 1))
+    if "OMP_NUM_THREADS" not in env_set:
+        os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    # torch reads OMP_NUM_THREADS when it is imported, which may have happened before the fork
+    if set_num_threads and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(num_threads)
+
+    setup_globals()
+    start = time.perf_counter()
+    ret = run_job(
+        hydra_context=_HYDRA_CONTEXT,
+        task_function=_TASK_FUNCTION,
+        config=sweep_config,
+        job_dir_key="hydra.sweep.dir",
+        job_subdir_key="hydra.sweep.subdir",
+    )
+    wall_time = time.perf_counter() - start
+    try:
+        payload = pickle.dumps((ret, wall_time))
+    except Exception as e:
+        ret.return_value = RuntimeError(
+            f"Return value of the job could not be pickled: {e!r}"
+        )
+        ret.status = JobStatus.FAILED
+        payload = pickle.dumps((ret, wall_time))
+    conn.send_bytes(payload)
+    conn.close()
+    _flush_job_logging()
+    # skip the exit hooks and finalizers inherited from the launcher process
+    os._exit(0)
+
+
+def _flush_job_logging() -> None:
+    # the log listener of utils.pylogger, if the job started one, is stopped by an exit hook
+    pylogger = sys.modules.get("{{cookiecutter.project_slug}}.utils.pylogger")
+    if pylogger is not None:
+        pylogger.stop_queue_logging()
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+class LocalPoolLauncher(Launcher):
+    def __init__(
+        self,
+        n_jobs: Optional[int] = None,
+        cpus_per_job: Optional[int] = None,
+        pin_cpus: bool = True,
+        set_num_threads: bool = True,
+        samples_key: str = "num_samples",
+    ) -> None:
+        super().__init__()
+        self.n_jobs = n_jobs
+        self.cpus_per_job = cpus_per_job
+        self.pin_cpus = pin_cpus
+        self.set_num_threads = set_num_threads
+        self.samples_key = samples_key
+        self.config: Optional[DictConfig] = None
+        self.task_function: Optional[TaskFunction] = None
+        self.hydra_context: Optional[HydraContext] = None
+
+    def setup(
+        self,
+        *,
+        hydra_context: HydraContext,
+        task_function: TaskFunction,
+        config: DictConfig,
+    ) -> None:
+        self.config = config
+        self.hydra_context = hydra_context
+        self.task_function = task_function
+
+    def launch(
+        self, job_overrides: Sequence[Sequence[str]], initial_job_idx: int
+    ) -> Sequence[JobReturn]:
+        global _HYDRA_CONTEXT, _TASK_FUNCTION
+        setup_globals()
+        assert self.hydra_context is not None
+        assert self.config is not None
+        assert self.task_function is not None
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("The local_pool launcher requires the 'fork' start method")
+        ctx = multiprocessing.get_context("fork")
+
+        configure_log(self.config.hydra.hydra_logging, self.config.hydra.verbose)
+        sweep_dir = Path(str(self.config.hydra.sweep.dir))
+        sweep_dir.mkdir(parents=True, exist_ok=True)
+        slots = cpu_slots(available_cpus(), self.n_jobs, self.cpus_per_job)
+        log.info(
+            f"Launching {len(job_overrides)} jobs locally, {len(slots)} at a time on "
+            f"{len(slots[0])} CPU(s) each"
+        )
+        _HYDRA_CONTEXT, _TASK_FUNCTION = self.hydra_context, self.task_function
+
+        pending = deque(enumerate(job_overrides, start=initial_job_idx))
+        free_slots = deque(range(len(slots)))
+        # connection -> (job index, slot, process, overrides)
+        running: Dict[Connection, Tuple[int, int, Any, List[str]]] = {}
+        results: Dict[int, Tuple[JobReturn, float]] = {}
+        start = time.perf_counter()
+        while pending or running:
+            while pending and free_slots:
+                idx, overrides = pending.popleft()
+                slot = free_slots.popleft()
+                log.info(f"\t#{idx} : {' '.join(filter_overrides(overrides))}")
+                sweep_config = self.hydra_context.config_loader.load_sweep_config(
+                    self.config, list(overrides)
+                )
+                with open_dict(sweep_config):
+                    sweep_config.hydra.job.id = idx
+                    sweep_config.hydra.job.num = idx
+                parent_conn, child_conn = ctx.Pipe(duplex=False)
+                process = ctx.Process(
+                    target=_run_job_in_child,
+                    args=(
+                        child_conn,
+                        sweep_config,
+                        slots[slot] if self.pin_cpus else [],
+                        self.set_num_threads,
+                    ),
+                    name=f"hydra-job-{idx}",
+                )
+                process.start()
+                child_conn.close()
+                running[parent_conn] = (idx, slot, process, list(overrides))
+
+            # read the results as they come, so that large ones do not block the children
+            for conn in wait(list(running)):
+                idx, slot, process, overrides = running.pop(conn)
+                try:
+                    ret, wall_time = pickle.loads(conn.recv_bytes())
+                except EOFError:
+                    wall_time = float("nan")
+                    process.join()
+                    ret = JobReturn(overrides=overrides, status=JobStatus.FAILED)
+                    ret.return_value = RuntimeError(
+                        f"Job #{idx} exited with code {process.exitcode}"
+                    )
+                process.join()
+                conn.close()
+                free_slots.append(slot)
+                results[idx] = (ret, wall_time)
+
+        self._report(results, time.perf_counter() - start, sweep_dir)
+        configure_log(self.config.hydra.hydra_logging, self.config.hydra.verbose)
+        return [results[idx][0] for idx in sorted(results)]
+
+    def _report(
+        self,
+        results: Dict[int, Tuple[JobReturn, float]],
+        elapsed: float,
+        sweep_dir: Path,
+    ) -> None:
+        jobs = []
+        for idx in sorted(results):
+            ret, wall_time = results[idx]
+            job = {
+                "idx": idx,
+                "overrides": list(ret.overrides or []),
+                "status": ret.status.name,
+                "wall_time": wall_time,
+            }
+            # return_value raises the error of a failed job, which hydra reports afterwards
+            if ret.status == JobStatus.COMPLETED:
+                value = ret.return_value
+                if isinstance(value, Mapping) and self.samples_key in value:
+                    job["throughput"] = float(value[self.samples_key]) / wall_time
+            jobs.append(job)
+            message = f"#{idx} {job['status']} in {wall_time:.1f}s"
+            if "throughput" in job:
+                message += f", {job['throughput']:.1f} samples/s"
+            level = logging.ERROR if ret.status == JobStatus.FAILED else logging.INFO
+            log.log(level, f"{message} : {' '.join(filter_overrides(job['overrides']))}")
+        total = sum(job["wall_time"] for job in jobs if not math.isnan(job["wall_time"]))
+        report = {
+            "elapsed": elapsed,
+            "jobs_per_hour": 3600 * len(jobs) / elapsed if elapsed > 0 else None,
+            "parallel_speedup": total / elapsed if elapsed > 0 else None,
+            "jobs": jobs,
+        }
+        log.info(
+            f"{len(jobs)} jobs in {elapsed:.1f}s "
+            f"(sum of wall times {total:.1f}s, speedup {report['parallel_speedup'] or 0:.2f}x)"
+        )
+        with open(sweep_dir / "launcher_report.json", "w") as f:
+            json.dump(report, f, indent=2)
@@ -9,18 +9,34 @@ import click
 import argparse
 {%- endif %}
 
-if os.environ.get("{{ cookiecutter.project_slug | upper}}_DEBUG"):
-    LEVEL = logging.DEBUG
-else:
-    level_name = os.environ.get("{{ cookiecutter.project_slug | upper }}_LOG_LEVEL", "INFO")
-    LEVEL = logging._nameToLevel.get(level_name, logging.INFO)
+{%- if cookiecutter.command_line_interface == 'hydra' %}
+import importlib
+import importlib.util
+import pkgutil
+from typing import List, Optional
+{%- endif %}
+
+
+def _configure_logging() -> None:
+    # Done on call instead of at import time so that importing this module
+    # has no side effects.
+    if os.environ.get("{{ cookiecutter.project_slug | upper}}_DEBUG"):
+        level = logging.DEBUG
+    else:
+        level_name = os.environ.get("{{ cookiecutter.project_slug | upper }}_LOG_LEVEL", "INFO")
+        level = logging._nameToLevel.get(level_name, logging.INFO)
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s - %(message)s", level=level)
+    from {{cookiecutter.project_slug}}.utils.pylogger import setup_queue_logging
 
-logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s - %(message)s", level=LEVEL)
+    # log I/O happens in a listener thread
+    setup_queue_logging()
 
 {% if cookiecutter.command_line_interface|lower == 'click' %}
 @click.command()
 def main(args=None):
     """Console script for {{cookiecutter.project_slug}}."""
+    _configure_logging()
     click.echo("Replace this message by putting your code into "
                "{{cookiecutter.project_slug}}.__main__.main")
     click.echo("See click documentation at https://click.palletsprojects.com/")
@@ -32,16 +48,76 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('_', nargs='*')
     args = parser.parse_args()
+    _configure_logging()
 
     print("Arguments: " + str(args._))
     print("Replace this message by putting your code into "
           "{{cookiecutter.project_slug}}.__main__.main")
 
     return 0
+{%- elif cookiecutter.command_line_interface == 'hydra' %}
+COMMANDS_PACKAGE = "{{cookiecutter.project_slug}}.commands"
+
+
+def available_commands() -> List[str]:
+    """Names of the modules in `COMMANDS_PACKAGE`, found without importing them."""
+    spec = importlib.util.find_spec(COMMANDS_PACKAGE)
+    if spec is None or spec.submodule_search_locations is None:
+        return []
+    return sorted(
+        module.name
+        for module in pkgutil.iter_modules(spec.submodule_search_locations)
+        if not module.name.startswith("_")
+    )
+
+
+def _usage(commands: List[str]) -> str:
+    lines = [
+        "usage: {{cookiecutter.project_slug}} <command> [args ...]",
+        "",
+        "commands:",
+    ]
+    lines += [f"  {command}" for command in commands]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Console script for {{cookiecutter.project_slug}}.
+
+    The command is resolved before anything heavy is imported: the command
+    module (and with it torch, hydra, ...) is only imported once we know it
+    exists, so `--help` and typos return immediately. The remaining
+    arguments are handed to the `main` of the command through `sys.argv`,
+    which suits `hydra.main` entry points as well as argparse ones.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    commands = available_commands()
+    if not argv or argv[0] in ("-h", "--help"):
+        print(_usage(commands))
+        return 0
+    command, *rest = argv
+    if command not in commands:
+        print(f"Unknown command {command!r}\n\n{_usage(commands)}", file=sys.stderr)
+        return 2
+    # before importing the command, so that its import-time logs are handled too; hydra
+    # commands reconfigure the handlers
+    _configure_logging()
+    # hydra.main parses sys.argv
+    sys.argv = [f"{sys.argv[0]} {command}", *rest]
+    module = importlib.import_module(f"{COMMANDS_PACKAGE}.{command}")
+    ret = module.main()
+    # an argparse command may return its exit status; anything else is not one
+    return ret if isinstance(ret, int) else 0
 {%- else %}
 def main():
+    _configure_logging()
     print("do nothing")
 {%- endif %}
 
+
 if __name__ == "__main__":
+{%- if cookiecutter.command_line_interface|lower == 'click' %}
     main(prog_name="{{cookiecutter.project_name}}")
+{%- else %}
+    sys.exit(main())
+{%- endif %}
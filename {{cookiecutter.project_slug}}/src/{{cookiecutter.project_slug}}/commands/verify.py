@@ -0,0 +1,60 @@
+"""Verify the checkpoint files in a directory against their checksums.
+
+    python -m {{cookiecutter.project_slug}}.commands.verify <serialization_dir>
+
+Exits with status 1 if any file is corrupted, and 2 if the directory does not
+exist or has no files matching `--pattern`. Files saved without checksums
+(`Checkpointer(checksums=False)`) are reported but not checked.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from {{cookiecutter.project_slug}}.utils.integrity import MANIFEST_SUFFIX, ChecksummedIO
+from {{cookiecutter.project_slug}}.utils.storage import LocalStorage
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Verify checkpoint files against their checksums."
+    )
+    parser.add_argument("directory", help="Directory containing the checkpoints.")
+    parser.add_argument(
+        "--pattern", default="*.pt", help="Glob of the files to verify."
+    )
+    parser.add_argument(
+        "--num-threads", type=int, default=4, help="Number of hashing threads."
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"{args.directory} is not a directory", file=sys.stderr)
+        return 2
+    storage = LocalStorage(args.directory)
+    names = [
+        name for name in storage.list(args.pattern) if not name.endswith(MANIFEST_SUFFIX)
+    ]
+    if not names:
+        print(f"No files match {args.pattern} in {args.directory}", file=sys.stderr)
+        return 2
+    checksummed = ChecksummedIO(storage, num_threads=args.num_threads)
+    num_corrupted = 0
+    try:
+        for name in names:
+            ok = checksummed.verify(name)
+            if ok is None:
+                status = "no checksums"
+            elif ok:
+                status = "ok"
+            else:
+                status = "CORRUPTED"
+                num_corrupted += 1
+            print(f"{status:>12}  {storage.location(name)}")
+    finally:
+        checksummed.close()
+    return 1 if num_corrupted else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,22 @@
+"""Utilities.
+
+The submodules are imported lazily on first attribute access (PEP 562), so that
+``import {{cookiecutter.project_slug}}.utils`` does not pull in torch, numpy, rich or hydra.
+"""
+import importlib
+import pkgutil
+from typing import Any, List
+
+_SUBMODULES = frozenset(module.name for module in pkgutil.iter_modules(__path__))
+
+
+def __getattr__(name: str) -> Any:
+    if name in _SUBMODULES:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | _SUBMODULES)
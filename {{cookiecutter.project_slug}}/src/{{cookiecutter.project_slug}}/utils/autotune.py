@@ -0,0 +1,200 @@
+"""Pick the number of torch threads and DataLoader workers by benchmarking.
+
+The cluster configs pin the math libraries to one thread, which is right
+when a node is shared by many processes but leaves cores idle otherwise.
+`autotune_threads_and_workers` runs a few training steps for each
+combination of intra-op threads and `num_workers`, keeps the fastest, and
+writes the measurements to `<output_dir>/autotune.json`. A resumed run finds
+that file and reuses the decision instead of benchmarking again, unless it
+runs on a different number of CPUs.
+
+The benchmarked steps must not change the training: pass a step without the
+optimizer update (forward and backward), or pass the `model` and `optimizer`
+so that their state is restored after tuning.
+
+Example:
+
+    tuned = autotune_threads_and_workers(
+        lambda num_workers: DataLoader(dataset, batch_size=32, num_workers=num_workers),
+        lambda batch: train_step(model, optimizer, batch),
+        output_dir=HydraConfig.get().runtime.output_dir,
+        model=model,
+        optimizer=optimizer,
+    )
+    train_loader = DataLoader(dataset, batch_size=32, num_workers=tuned["num_workers"])
+"""
+import copy
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+RESULT_FILE = "autotune.json"
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _powers_of_two_up_to(n: int, start: int = 1) -> List[int]:
+    values = []
+    value = start
+    while value < n:
+        values.append(value)
+        value *= 2
+    values.append(n)
+    return sorted(set(values))
+
+
+def default_candidates(num_cpus: Optional[int] = None) -> Dict[str, List[int]]:
+    """Powers of two up to the number of CPUs, for both the threads and the workers."""
+    num_cpus = num_cpus or available_cpus()
+    return {
+        "num_threads": _powers_of_two_up_to(num_cpus),
+        "num_workers": [0] + _powers_of_two_up_to(max(1, num_cpus // 2), start=2),
+    }
+
+
+def _benchmark(
+    loader: Iterable,
+    step_fn: Callable[[Any], Any],
+    warmup_steps: int,
+    measure_steps: int,
+) -> Optional[float]:
+    """Steps per second after `warmup_steps` steps, `None` if the loader is too short."""
+    iterator = iter(loader)
+    try:
+        for _ in range(warmup_steps):
+            step_fn(next(iterator))
+        start = time.perf_counter()
+        for _ in range(measure_steps):
+            step_fn(next(iterator))
+        return measure_steps / (time.perf_counter() - start)
+    except StopIteration:
+        return None
+    finally:
+        # shuts down the workers
+        del iterator
+
+
+def autotune_threads_and_workers(
+    make_loader: Callable[[int], Iterable],
+    step_fn: Callable[[Any], Any],
+    thread_candidates: Optional[Sequence[int]] = None,
+    worker_candidates: Optional[Sequence[int]] = None,
+    warmup_steps: int = 3,
+    measure_steps: int = 10,
+    output_dir: Optional[Union[str, os.PathLike]] = None,
+    apply: bool = True,
+    model: Optional[torch.nn.Module] = None,
+    optimizer: Optional[torch.optim.Optimizer] = None,
+) -> Dict[str, Any]:
+    """
+    Benchmark the combinations of torch intra-op threads and `num_workers` and return the fastest.
+
+    Combinations using more threads and workers than there are CPUs are skipped.
+
+    Args:
+        make_loader: Builds the data loader for a number of workers.
+        step_fn: Runs one step on a batch. If it updates the model (a training step), pass
+            `model` and `optimizer` to undo the updates.
+        thread_candidates: Numbers of intra-op threads to try. See `default_candidates`.
+        worker_candidates: Numbers of workers to try. See `default_candidates`.
+        warmup_steps: Steps run before measuring, including the start of the workers.
+        measure_steps: Steps measured for each combination.
+        output_dir: Where the measurements and the decision are written. If it already contains
+            them for the same number of CPUs, they are reused.
+        apply: Set the number of torch threads to the chosen one.
+        model: Model whose parameters and buffers are restored after tuning, and whose
+            gradients are cleared.
+        optimizer: Optimizer whose state is restored after tuning.
+
+    Returns:
+        `{"num_threads": ..., "num_workers": ..., "steps_per_second": ..., "results": [...]}`
+    """
+    path = os.path.join(output_dir, RESULT_FILE) if output_dir is not None else None
+    num_cpus = available_cpus()
+    tuned = None
+    if path is not None and os.path.isfile(path):
+        with open(path) as f:
+            tuned = json.load(f)
+        if tuned.get("num_cpus") != num_cpus:
+            logger.info(
+                f"Tuning again: {path} was tuned for {tuned.get('num_cpus')} CPU(s), "
+                f"{num_cpus} are available"
+            )
+            tuned = None
+        else:
+            logger.info(
+                f"Reusing the tuning in {path}: {tuned['num_threads']} thread(s), "
+                f"{tuned['num_workers']} worker(s)"
+            )
+    if tuned is None:
+        defaults = default_candidates(num_cpus)
+        thread_candidates = thread_candidates or defaults["num_threads"]
+        worker_candidates = (
+            worker_candidates
+            if worker_candidates is not None
+            else defaults["num_workers"]
+        )
+        initial_threads = torch.get_num_threads()
+        model_state = copy.deepcopy(model.state_dict()) if model is not None else None
+        optimizer_state = (
+            copy.deepcopy(optimizer.state_dict()) if optimizer is not None else None
+        )
+        results = []
+        try:
+            for num_threads, num_workers in itertools.product(
+                thread_candidates, worker_candidates
+            ):
+                if num_threads + num_workers > max(num_cpus, num_threads):
+                    continue
+                torch.set_num_threads(num_threads)
+                steps_per_second = _benchmark(
+                    make_loader(num_workers), step_fn, warmup_steps, measure_steps
+                )
+                results.append(
+                    {
+                        "num_threads": num_threads,
+                        "num_workers": num_workers,
+                        "steps_per_second": steps_per_second,
+                    }
+                )
+                logger.debug(
+                    f"{num_threads} thread(s), {num_workers} worker(s): "
+                    f"{steps_per_second} steps/s"
+                )
+        finally:
+            torch.set_num_threads(initial_threads)
+            if model is not None:
+                model.load_state_dict(model_state)
+                model.zero_grad(set_to_none=True)
+            if optimizer is not None:
+                optimizer.load_state_dict(optimizer_state)
+        measured = [r for r in results if r["steps_per_second"] is not None]
+        if not measured:
+            raise ValueError(
+                f"The loader is too short to measure {warmup_steps} + {measure_steps} steps"
+            )
+        best = max(measured, key=lambda r: r["steps_per_second"])
+        tuned = dict(best, num_cpus=num_cpus, results=results)
+        logger.info(
+            f"Tuned for {num_cpus} CPU(s): {best['num_threads']} thread(s), "
+            f"{best['num_workers']} worker(s) at {best['steps_per_second']:.2f} steps/s "
+            f"({len(measured)} combinations measured)"
+        )
+        if path is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(tuned, f, indent=2)
+    if apply:
+        torch.set_num_threads(tuned["num_threads"])
+    return tuned
@@ -0,0 +1,311 @@
+"""Largest micro-batch that fits in memory, and the matching gradient accumulation.
+
+`find_max_batch_size` runs a training step (`trial_fn(batch_size)`, which
+should use the longest sequences) for growing batch sizes, doubling until a
+step fails and then bisecting. A step fails when it raises an out of memory
+error on GPU or, on CPU, when the resident set size of the process exceeds
+`rss_limit` during the step.
+
+`auto_batch_size` turns the result into a micro-batch size and a number of
+accumulation steps reaching a target effective batch size, and caches it
+in a JSON file keyed by model, maximum length and device, so that later
+runs skip the search. In distributed training only the first process
+searches (and writes the cache), and the others use its result, so that all
+the processes run the same micro-batches:
+
+    sizes = auto_batch_size(
+        trial_fn,
+        target_batch_size=256,
+        key={"model": "google/mt5-base", "max_length": 512},
+        cache_path=Path(cfg.paths.cache_dir) / "batch_size.json",
+    )
+    training_args.per_device_train_batch_size = sizes["micro_batch_size"]
+    training_args.gradient_accumulation_steps = sizes["accumulation_steps"]
+"""
+import gc
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import torch
+import torch.distributed as dist
+
+from .memory import rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryLimitExceeded(MemoryError):
+    pass
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    if isinstance(error, (torch.cuda.OutOfMemoryError, MemoryError)):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+def physical_memory() -> int:
+    """Physical memory of the machine, or of the cgroup the process is limited to."""
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            total = min(total, int(limit))
+    return total
+
+
+class PeakRSS:
+    """Context manager sampling the resident set size in a thread, to catch its peak."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self) -> "PeakRSS":
+        self.peak = rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def _free_memory(device: torch.device) -> None:
+    gc.collect()
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+
+
+def fits(
+    trial_fn: Callable[[int], Any],
+    batch_size: int,
+    device: Union[str, torch.device] = "cpu",
+    rss_limit: Optional[int] = None,
+) -> bool:
+    """Whether `trial_fn(batch_size)` runs without running out of memory."""
+    device = torch.device(device)
+    try:
+        if device.type == "cuda":
+            trial_fn(batch_size)
+        else:
+            with PeakRSS() as rss:
+                trial_fn(batch_size)
+            if rss_limit is not None and rss.peak > rss_limit:
+                raise MemoryLimitExceeded(
+                    f"RSS peaked at {rss.peak / 2**30:.2f} GiB > {rss_limit / 2**30:.2f} GiB"
+                )
+        return True
+    except Exception as e:
+        if not is_out_of_memory(e):
+            raise
+        logger.debug(f"Batch size {batch_size} does not fit: {e}")
+        return False
+    finally:
+        _free_memory(device)
+
+
+def find_max_batch_size(
+    trial_fn: Callable[[int], Any],
+    max_batch_size: int,
+    start: int = 1,
+    device: Union[str, torch.device] = "cpu",
+    rss_limit: Optional[int] = None,
+) -> int:
+    """
+    Largest batch size up to `max_batch_size` for which `trial_fn` fits in memory, found by
+    doubling from `start` and bisecting. Raises a `MemoryError` if even a batch of 1 does not
+    fit.
+
+    `rss_limit` defaults to 90% of the physical memory on CPU.
+    """
+    device = torch.device(device)
+    if device.type != "cuda" and rss_limit is None:
+        rss_limit = int(0.9 * physical_memory())
+    largest_fit, smallest_failure = 0, max_batch_size + 1
+    batch_size = min(max(1, start), max_batch_size)
+    # doubling
+    while batch_size < smallest_failure:
+        if fits(trial_fn, batch_size, device, rss_limit):
+            largest_fit = batch_size
+            if batch_size == max_batch_size:
+                break
+            batch_size = min(2 * batch_size, max_batch_size)
+        else:
+            smallest_failure = batch_size
+    # bisection
+    while smallest_failure - largest_fit > 1:
+        batch_size = (largest_fit + smallest_failure) // 2
+        if fits(trial_fn, batch_size, device, rss_limit):
+            largest_fit = batch_size
+        else:
+            smallest_failure = batch_size
+    if largest_fit == 0:
+        raise MemoryError("Not even a batch of 1 fits in memory")
+    return largest_fit
+
+
+def accumulation_plan(
+    target_batch_size: int,
+    max_micro_batch_size: int,
+    world_size: int = 1,
+    tolerance: float = 0.0,
+) -> Dict[str, int]:
+    """
+    Micro-batch size and accumulation steps reaching `target_batch_size` across `world_size`
+    processes, within `tolerance` (a fraction of the target): the largest micro-batch that
+    fits and does. With no tolerance, it is the largest divisor of the per-process batch size
+    that fits, which can be much smaller than `max_micro_batch_size` (e.g. 1 for a prime
+    target); a warning suggests a tolerance then.
+    """
+    if target_batch_size % world_size:
+        raise ValueError(
+            f"The target batch size {target_batch_size} is not divisible by the "
+            f"world size {world_size}"
+        )
+    per_process = target_batch_size // world_size
+    for micro_batch_size in range(min(per_process, max_micro_batch_size), 0, -1):
+        accumulation_steps = max(1, round(per_process / micro_batch_size))
+        if (
+            abs(micro_batch_size * accumulation_steps - per_process)
+            <= tolerance * per_process
+        ):
+            break
+    if 2 * micro_batch_size <= min(per_process, max_micro_batch_size):
+        logger.warning(
+            f"Micro-batches of {micro_batch_size}, much smaller than the "
+            f"{max_micro_batch_size} that fit, to reach a batch size of exactly "
+            f"{target_batch_size}: allow a tolerance to use larger ones"
+        )
+    return {
+        "micro_batch_size": micro_batch_size,
+        "accumulation_steps": accumulation_steps,
+    }
+
+
+def device_key(device: Union[str, torch.device]) -> str:
+    device = torch.device(device)
+    if device.type == "cuda":
+        properties = torch.cuda.get_device_properties(device)
+        return f"{properties.name} ({properties.total_memory // 2**20} MiB)"
+    return f"{device.type} ({physical_memory() // 2**20} MiB)"
+
+
+def auto_batch_size(
+    trial_fn: Callable[[int], Any],
+    target_batch_size: int,
+    key: Dict[str, Any],
+    cache_path: Optional[Union[str, os.PathLike]] = None,
+    device: Union[str, torch.device] = "cpu",
+    world_size: int = 1,
+    rss_limit: Optional[int] = None,
+    tolerance: float = 0.0,
+) -> Dict[str, int]:
+    """
+    Micro-batch size and accumulation steps for `target_batch_size`.
+
+    Args:
+        trial_fn: Runs a training step (forward, backward and optimizer step, so that the
+            optimizer states are allocated) on a batch of the given size of the longest
+            sequences. Only called on the first process.
+        target_batch_size: Effective batch size, across all the processes.
+        key: Identifies what the memory depends on besides the device, e.g. the model and the
+            maximum length.
+        cache_path: JSON file caching the largest micro-batch of each key and device.
+        device: Device the trial runs on.
+        world_size: Number of data-parallel processes.
+        rss_limit: See `find_max_batch_size`.
+        tolerance: See `accumulation_plan`.
+
+    Returns:
+        `{"micro_batch_size": ..., "accumulation_steps": ..., "max_micro_batch_size": ...}`
+    """
+    per_process = max(1, target_batch_size // world_size)
+    if dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1:
+        result: List[Any] = [None]
+        if dist.get_rank() == 0:
+            try:
+                result[0] = _cached_max_micro_batch_size(
+                    trial_fn, per_process, key, cache_path, device, rss_limit
+                )
+            except Exception as e:
+                # sent to the other processes, which would wait forever otherwise
+                result[0] = e
+        dist.broadcast_object_list(result, src=0)
+        if isinstance(result[0], Exception):
+            raise result[0]
+        max_micro_batch_size = result[0]
+    else:
+        max_micro_batch_size = _cached_max_micro_batch_size(
+            trial_fn, per_process, key, cache_path, device, rss_limit
+        )
+    plan = accumulation_plan(target_batch_size, max_micro_batch_size, world_size, tolerance)
+    effective_batch_size = plan["micro_batch_size"] * plan["accumulation_steps"] * world_size
+    logger.info(
+        f"Effective batch size {effective_batch_size} (target {target_batch_size}): "
+        f"micro-batches of "
+        f"{plan['micro_batch_size']} x {plan['accumulation_steps']} accumulation step(s)"
+        + (f" x {world_size} processes" if world_size > 1 else "")
+    )
+    return dict(plan, max_micro_batch_size=max_micro_batch_size)
+
+
+def _cached_max_micro_batch_size(
+    trial_fn: Callable[[int], Any],
+    per_process: int,
+    key: Dict[str, Any],
+    cache_path: Optional[Union[str, os.PathLike]],
+    device: Union[str, torch.device],
+    rss_limit: Optional[int],
+) -> int:
+    entry = json.dumps({**key, "device": device_key(device)}, sort_keys=True)
+    cache: Dict[str, Dict[str, Any]] = {}
+    if cache_path is not None and os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    cached = cache.get(entry)
+    # a search capped below this target does not tell whether a larger batch fits
+    if cached is not None and (
+        not cached["capped"] or cached["max_micro_batch_size"] >= per_process
+    ):
+        max_micro_batch_size = cached["max_micro_batch_size"]
+        logger.info(f"Reusing the micro-batch size {max_micro_batch_size} of {cache_path}")
+    else:
+        max_micro_batch_size = find_max_batch_size(
+            trial_fn, per_process, device=device, rss_limit=rss_limit
+        )
+        logger.info(f"Largest micro-batch that fits: {max_micro_batch_size}")
+        if cache_path is not None:
+            cache[entry] = {
+                "max_micro_batch_size": max_micro_batch_size,
+                "capped": max_micro_batch_size == per_process,
+            }
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            # unique, for concurrent runs sharing the cache
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp_path, cache_path)
+    return max_micro_batch_size
@@ -0,0 +1,230 @@
+"""Selective activation checkpointing.
+
+`apply_activation_checkpointing` runs the forward of the submodules whose
+name or class name fully matches one of the given regexes under
+`torch.utils.checkpoint.checkpoint` (non-reentrant): only their inputs are
+kept for the backward pass, and their forward is recomputed then. Forwards
+without gradients (evaluation, `torch.no_grad`) are not affected. The
+forward is replaced on the instances, so the names of the parameters, the
+state dicts and the hooks are unchanged.
+
+The recomputed forward must do what the first one did: blocks that append
+to a cache (HF decoders with `config.use_cache`, e.g. `T5Block`) would
+append twice. Like HF's `gradient_checkpointing_enable`, checkpointing sets
+`use_cache = False` on the configs of the model and its submodules.
+
+Which blocks are worth it depends on the model and the batch:
+`profile_checkpointing` runs a training step with `ActivationProfiler` and
+reports, for every candidate block, the activation memory checkpointing
+would save and the forward time it would recompute. The step runs without
+checkpointing, so run it on a small batch (the one that needs checkpointing
+would not fit) and scale the bytes to the training batch with `scale`. `choose_blocks` picks
+the blocks saving the most memory per second of recomputation, and
+`auto_activation_checkpointing` does all three:
+
+    report = auto_activation_checkpointing(
+        model,
+        [r"(encoder|decoder)\\.block\\.\\d+"],
+        run_step=lambda: model(**small_batch).loss.backward(),
+        scale=batch_size / small_batch_size,
+        max_recompute_fraction=0.2,
+    )
+"""
+import logging
+import re
+import time
+import types
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+from .memory import ActivationProfiler
+
+logger = logging.getLogger(__name__)
+
+
+def matching_modules(model: nn.Module, patterns: Sequence[str]) -> Dict[str, nn.Module]:
+    """
+    Submodules whose name or class name fully matches one of `patterns`, excluding those inside
+    another match.
+    """
+    regexes = [re.compile(pattern) for pattern in patterns]
+    matches: Dict[str, nn.Module] = {}
+    for name, module in model.named_modules():
+        if any(name.startswith(prefix + ".") or not prefix for prefix in matches):
+            continue
+        if any(
+            regex.fullmatch(name) or regex.fullmatch(type(module).__name__)
+            for regex in regexes
+        ):
+            matches[name] = module
+    return matches
+
+
+def _checkpointed_forward(self: nn.Module, *args, **kwargs) -> Any:
+    forward = type(self).forward.__get__(self)
+    if self.training and torch.is_grad_enabled():
+        return checkpoint(forward, *args, use_reentrant=False, **kwargs)
+    return forward(*args, **kwargs)
+
+
+def is_checkpointed(module: nn.Module) -> bool:
+    forward = module.__dict__.get("forward")
+    return getattr(forward, "__func__", None) is _checkpointed_forward
+
+
+def checkpoint_module(module: nn.Module) -> None:
+    # a bound method (not a closure), so that deep copies call their own forward
+    module.forward = types.MethodType(_checkpointed_forward, module)
+
+
+def uncheckpoint_module(module: nn.Module) -> None:
+    if is_checkpointed(module):
+        del module.forward
+
+
+def _disable_cache(model: nn.Module) -> None:
+    # submodules may have their own copy of the config (e.g. the encoder and decoder of T5)
+    configs = {
+        id(config): config
+        for config in (getattr(module, "config", None) for module in model.modules())
+        if getattr(config, "use_cache", False)
+    }
+    if configs:
+        logger.warning(
+            "Activation checkpointing is incompatible with use_cache: setting "
+            "config.use_cache = False"
+        )
+    for config in configs.values():
+        config.use_cache = False
+
+
+def apply_activation_checkpointing(
+    model: nn.Module, patterns: Sequence[str]
+) -> List[str]:
+    """Checkpoint the submodules matching `patterns`. Returns their names."""
+    modules = matching_modules(model, patterns)
+    if modules:
+        _disable_cache(model)
+    for module in modules.values():
+        checkpoint_module(module)
+    logger.info(f"Activation checkpointing of {len(modules)} module(s)")
+    return list(modules)
+
+
+def remove_activation_checkpointing(model: nn.Module) -> None:
+    for module in model.modules():
+        uncheckpoint_module(module)
+
+
+def profile_checkpointing(
+    model: nn.Module,
+    patterns: Sequence[str],
+    run_step: Callable[[], Any],
+    scale: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Run `run_step` (a forward and backward pass, without optimizer step) without
+    checkpointing and measure, for every block matching `patterns`:
+
+    - `saved_bytes`: activations it saves for the backward pass;
+    - `input_bytes`: what checkpointing keeps instead;
+    - `forward_seconds`: what checkpointing recomputes;
+
+    and `step_seconds`, the duration of the whole step (with the profiling overhead).
+
+    The bytes are multiplied by `scale`, e.g. the training batch size over the batch size of
+    `run_step`: activations grow linearly with the batch. The durations are not scaled, only
+    their ratios are used.
+    """
+    modules = matching_modules(model, patterns)
+    for module in modules.values():
+        uncheckpoint_module(module)
+    profiler = ActivationProfiler(model, modules=modules)
+    start = time.perf_counter()
+    with profiler:
+        run_step()
+    step_seconds = time.perf_counter() - start
+    model.zero_grad(set_to_none=True)
+    blocks = {}
+    for name in modules:
+        stat = profiler.stats.get(name)
+        if stat is None:  # not called
+            continue
+        saved_bytes = int(stat["saved_bytes"] * scale)
+        input_bytes = int(stat["input_bytes"] * scale)
+        blocks[name] = {
+            "saved_bytes": saved_bytes,
+            "input_bytes": input_bytes,
+            "saved_by_checkpointing": max(0, saved_bytes - input_bytes),
+            "forward_seconds": stat["forward_seconds"],
+        }
+    return {"step_seconds": step_seconds, "blocks": blocks}
+
+
+def choose_blocks(
+    profile: Dict[str, Any],
+    bytes_to_save: Optional[int] = None,
+    max_recompute_fraction: float = 0.3,
+) -> List[str]:
+    """
+    Blocks to checkpoint, by decreasing memory saved per second of recomputation, until
+    `bytes_to_save` are saved, or the recomputation would exceed `max_recompute_fraction` of
+    the step time.
+    """
+    budget = max_recompute_fraction * profile["step_seconds"]
+    ranked = sorted(
+        (
+            (name, block)
+            for name, block in profile["blocks"].items()
+            if block["saved_by_checkpointing"] > 0
+        ),
+        key=lambda item: item[1]["saved_by_checkpointing"]
+        / max(item[1]["forward_seconds"], 1e-9),
+        reverse=True,
+    )
+    chosen: List[str] = []
+    saved, recompute = 0, 0.0
+    for name, block in ranked:
+        if bytes_to_save is not None and saved >= bytes_to_save:
+            break
+        if recompute + block["forward_seconds"] > budget:
+            continue
+        chosen.append(name)
+        saved += block["saved_by_checkpointing"]
+        recompute += block["forward_seconds"]
+    return chosen
+
+
+def auto_activation_checkpointing(
+    model: nn.Module,
+    patterns: Sequence[str],
+    run_step: Callable[[], Any],
+    bytes_to_save: Optional[int] = None,
+    max_recompute_fraction: float = 0.3,
+    scale: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Profile the blocks matching `patterns` (see `profile_checkpointing`), checkpoint those
+    chosen by `choose_blocks`, and return the profile with the `chosen` blocks and their
+    `saved_bytes` and `recompute_seconds`.
+    """
+    profile = profile_checkpointing(model, patterns, run_step, scale)
+    chosen = choose_blocks(profile, bytes_to_save, max_recompute_fraction)
+    modules = dict(model.named_modules())
+    if chosen:
+        _disable_cache(model)
+    for name in chosen:
+        checkpoint_module(modules[name])
+    blocks = profile["blocks"]
+    profile["chosen"] = chosen
+    profile["saved_bytes"] = sum(blocks[name]["saved_by_checkpointing"] for name in chosen)
+    profile["recompute_seconds"] = sum(blocks[name]["forward_seconds"] for name in chosen)
+    logger.info(
+        f"Activation checkpointing of {len(chosen)}/{len(blocks)} block(s): saves "
+        f"{profile['saved_bytes'] / 2**20:.1f} MiB for {profile['recompute_seconds']:.3f} s "
+        f"of recomputation per step ({profile['step_seconds']:.3f} s)"
+    )
+    return profile
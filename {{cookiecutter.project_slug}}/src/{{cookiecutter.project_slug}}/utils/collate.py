@@ -0,0 +1,210 @@
+"""Padding collation into reused shared-memory buffers, and batch prefetching.
+
+`SharedMemoryPadCollator` pads variable length sequences (e.g. the
+`input_ids`, `attention_mask` and `labels` lists of a tokenized HF dataset)
+directly into buffers that are allocated once per worker, in shared memory,
+and reused round-robin. Sending a batch to the main process then only
+passes the handles of the buffers instead of pickling their content, and no
+tensor is allocated per batch.
+
+A buffer is reused `num_slots` batches later, so the main process must be
+done with a batch by then. A worker has at most `prefetch_factor` batches in
+the DataLoader queue, one more is being consumed and `Prefetcher` holds one:
+keep `num_slots >= prefetch_factor + 2`, or use `pin_memory=True` in the
+DataLoader, which copies the batches out of the shared buffers as soon as
+they arrive.
+
+`Prefetcher` pins the next batch and copies it to the device on a side CUDA
+stream while the current step runs.
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import default_collate, get_worker_info
+
+logger = logging.getLogger(__name__)
+
+
+def map_tensors(obj: Any, fn: Callable[[torch.Tensor], Any]) -> Any:
+    """Apply `fn` to the tensors of nested dicts, lists and tuples."""
+    if isinstance(obj, torch.Tensor):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return type(obj)((k, map_tensors(v, fn)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, "_fields"):
+        return type(obj)(map_tensors(v, fn) for v in obj)
+    return obj
+
+
+class SharedMemoryPadCollator:
+    """
+    Pads the sequences of a list of examples into reused (shared-memory) buffers.
+
+    Parameters:
+    - pad_values: Padding value of each sequence field, e.g.
+        `{"input_ids": tokenizer.pad_token_id, "attention_mask": 0, "labels": -100}`.
+        Other fields are collated with `default_collate`.
+    - max_batch_size: Largest batch size.
+    - max_length: Longest sequence. Longer sequences raise a `ValueError`.
+    - num_slots: Number of buffers of each field, used round-robin. See the module documentation.
+    - pad_to_multiple_of: Round the padded length up to a multiple of it (e.g. 8 for tensor cores).
+    - dtype: Type of the padded tensors.
+    - attention_mask_of: Also return an `attention_mask` computed from the lengths of this field,
+        for examples that do not have one (e.g. those of a `MemmapTokenDataset`). An
+        `attention_mask` field of the examples is then ignored.
+    - postprocess: Called on the collated batch, e.g.
+        `lambda batch: {**batch, "decoder_input_ids": model.prepare_decoder_input_ids_from_labels(batch["labels"])}`.
+    """
+
+    def __init__(
+        self,
+        pad_values: Dict[str, int],
+        max_batch_size: int,
+        max_length: int,
+        num_slots: int = 4,
+        pad_to_multiple_of: Optional[int] = None,
+        dtype: torch.dtype = torch.long,
+        attention_mask_of: Optional[str] = None,
+        postprocess: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> None:
+        self.pad_values = dict(pad_values)
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.num_slots = num_slots
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.dtype = dtype
+        self.attention_mask_of = attention_mask_of
+        self.postprocess = postprocess
+        # allocated lazily, in the process that collates (each worker has its own)
+        self._buffers: Optional[Dict[str, List[torch.Tensor]]] = None
+        self._next_slot = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # workers allocate their own buffers
+        state = self.__dict__.copy()
+        state["_buffers"] = None
+        return state
+
+    def _allocate(self) -> Dict[str, List[torch.Tensor]]:
+        share = get_worker_info() is not None
+        buffers = {}
+        keys = list(self.pad_values)
+        if self.attention_mask_of is not None:
+            keys.append("attention_mask")
+        for key in keys:
+            slots = []
+            for _ in range(self.num_slots):
+                # flat, so that the batch views are contiguous whatever their length
+                buffer = torch.empty(
+                    self.max_batch_size * self.max_length, dtype=self.dtype
+                )
+                slots.append(buffer.share_memory_() if share else buffer)
+            buffers[key] = slots
+        return buffers
+
+    def _padded_length(self, length: int) -> int:
+        if self.pad_to_multiple_of:
+            multiple = self.pad_to_multiple_of
+            length = (length + multiple - 1) // multiple * multiple
+        return min(length, self.max_length)
+
+    def __call__(self, examples: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        if len(examples) > self.max_batch_size:
+            raise ValueError(
+                f"Batch of {len(examples)} examples is larger than max_batch_size={self.max_batch_size}"
+            )
+        if self._buffers is None:
+            self._buffers = self._allocate()
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.num_slots
+
+        batch: Dict[str, Any] = {}
+        for key, pad_value in self.pad_values.items():
+            sequences = [np.asarray(example[key]) for example in examples]
+            lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64)
+            longest = int(lengths.max()) if len(lengths) else 0
+            if longest > self.max_length:
+                raise ValueError(
+                    f"'{key}' has a sequence of length {longest} > max_length={self.max_length}"
+                )
+            length = self._padded_length(longest)
+            out = self._buffers[key][slot][: len(examples) * length].view(
+                len(examples), length
+            )
+            out.fill_(pad_value)
+            # scatter all the tokens at once instead of one row at a time
+            mask = torch.from_numpy(np.arange(length) < lengths[:, None])
+            if longest > 0:
+                out[mask] = torch.from_numpy(np.concatenate(sequences)).to(self.dtype)
+            batch[key] = out
+            if key == self.attention_mask_of:
+                attention_mask = self._buffers["attention_mask"][slot]
+                attention_mask = attention_mask[: mask.numel()].view(mask.shape)
+                attention_mask.copy_(mask)
+                batch["attention_mask"] = attention_mask
+        for key in examples[0]:
+            if key not in batch:
+                batch[key] = default_collate([example[key] for example in examples])
+        if self.postprocess is not None:
+            batch = self.postprocess(batch)
+        return batch
+
+
+class Prefetcher:
+    """
+    Iterates over `loader`, moving the next batch to `device` while the current one is used.
+
+    With CUDA, the next batch is pinned (unless the DataLoader already did it) and copied on a
+    side stream; the current stream waits for that copy when the batch is yielded. On other
+    devices the batches are moved synchronously.
+
+    Parameters:
+    - loader: Yields batches (nested dicts, lists and tuples of tensors).
+    - device: Where the batches are moved.
+    """
+
+    def __init__(self, loader: Iterable, device: Any) -> None:
+        self.loader = loader
+        self.device = torch.device(device)
+        self._stream = (
+            torch.cuda.Stream(device=self.device)
+            if self.device.type == "cuda"
+            else None
+        )
+
+    def __len__(self) -> int:
+        return len(self.loader)  # type: ignore[arg-type]
+
+    def _move(self, batch: Any) -> Any:
+        if self._stream is None:
+            return map_tensors(batch, lambda t: t.to(self.device))
+
+        def move(tensor: torch.Tensor) -> torch.Tensor:
+            if not tensor.is_pinned():
+                tensor = tensor.pin_memory()
+            return tensor.to(self.device, non_blocking=True)
+
+        with torch.cuda.stream(self._stream):
+            return map_tensors(batch, move)
+
+    def __iter__(self) -> Iterator:
+        iterator = iter(self.loader)
+        try:
+            next_batch = self._move(next(iterator))
+        except StopIteration:
+            return
+        while True:
+            if self._stream is not None:
+                current = torch.cuda.current_stream(self.device)
+                current.wait_stream(self._stream)
+                # the memory was allocated on the side stream but is used on the current one
+                map_tensors(next_batch, lambda t: t.record_stream(current))
+            batch = next_batch
+            try:
+                next_batch = self._move(next(iterator))
+            except StopIteration:
+                yield batch
+                return
+            yield batch
@@ -0,0 +1,240 @@
+"""Opt-in `torch.compile`, with persistent caches and a report of what went wrong.
+
+`maybe_compile` compiles a module in place (`nn.Module.compile`, so the
+names in the state dict do not change) or a function, and returns it
+unchanged when compilation is disabled or the device cannot run the
+generated code: inductor needs a CUDA device of compute capability 7.0 or
+more (Triton), or a C++ compiler on CPU.
+
+`set_compile_cache_dir` points the inductor and Triton caches to a
+persistent directory (e.g. `${paths.cache_dir}/torch_compile`) and enables
+the FX graph and AOTAutograd caches, so that later runs load the compiled
+kernels instead of compiling them again. It has to be called before the
+first compilation.
+
+`CompileMonitor` collects the graph breaks and the recompilations (with the
+guard failures that triggered them) of the code run inside it:
+
+    set_compile_cache_dir(Path(cfg.paths.cache_dir) / "torch_compile")
+    model = maybe_compile(model, dynamic=True)
+    with CompileMonitor() as monitor:
+        train_step(batch)
+    monitor.log()
+"""
+import logging
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+import torch
+from torch import nn
+
+from . import nn as nn_utils
+
+logger = logging.getLogger(__name__)
+
+
+def compile_supported(device: Union[str, torch.device] = "cpu") -> Tuple[bool, str]:
+    """Whether inductor can compile for `device`, and why not."""
+    device = torch.device(device)
+    if not hasattr(torch, "compile"):
+        return False, "torch.compile requires torch >= 2.0"
+    if device.type == "cuda":
+        if not torch.cuda.is_available():
+            return False, "CUDA is not available"
+        major, minor = torch.cuda.get_device_capability(device)
+        if major < 7:
+            return False, f"compute capability {major}.{minor} < 7.0 is not supported by Triton"
+        return True, ""
+    compiler = os.environ.get("CXX") or next(
+        (c for c in ("g++", "clang++", "c++") if shutil.which(c)), None
+    )
+    if compiler is None:
+        return False, "no C++ compiler found (set CXX)"
+    return True, ""
+
+
+def set_compile_cache_dir(cache_dir: Union[str, os.PathLike]) -> None:
+    """Persistent inductor and Triton caches in `cache_dir`."""
+    cache_dir = os.fspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(cache_dir, "inductor")
+    os.environ["TRITON_CACHE_DIR"] = os.path.join(cache_dir, "triton")
+    try:
+        import torch._functorch.config as functorch_config
+        import torch._inductor.config as inductor_config
+    except ImportError:  # pragma: no cover
+        return
+    if hasattr(inductor_config, "fx_graph_cache"):
+        inductor_config.fx_graph_cache = True
+    if hasattr(functorch_config, "enable_autograd_cache"):
+        functorch_config.enable_autograd_cache = True
+    logger.info(f"torch.compile caches in {cache_dir}")
+
+
+def maybe_compile(
+    obj: Any,
+    enabled: bool = True,
+    device: Union[str, torch.device, None] = None,
+    **compile_kwargs: Any,
+) -> Any:
+    """
+    Compile a module (in place) or a function with `torch.compile(**compile_kwargs)`. Returns
+    `obj` as is when `enabled` is `False` or inductor cannot compile for `device` (the device
+    of the parameters of a module by default). Other backends are not checked.
+    """
+    if not enabled:
+        return obj
+    if compile_kwargs.get("backend", "inductor") == "inductor":
+        if device is None and isinstance(obj, nn.Module):
+            device = next((p.device for p in obj.parameters()), torch.device("cpu"))
+        supported, reason = compile_supported(device or "cpu")
+        if not supported:
+            logger.warning(f"Not compiling: {reason}")
+            return obj
+    if isinstance(obj, nn.Module):
+        obj.compile(**compile_kwargs)
+        return obj
+    return torch.compile(obj, **compile_kwargs)
+
+
+def compiled_masked_ops(**compile_kwargs: Any) -> Dict[str, Callable]:
+    """
+    Compiled versions of the masked ops of `utils.nn`. They are dynamic in the shapes by default,
+    so that variable sequence lengths do not recompile them.
+    """
+    compile_kwargs.setdefault("dynamic", True)
+    return {
+        name: maybe_compile(getattr(nn_utils, name), **compile_kwargs)
+        for name in ("masked_mean", "masked_sum", "get_mask_from_sequence_lengths")
+    }
+
+
+RECOMPILES_LOGGER = "torch._dynamo.guards.__recompiles"
+
+
+class _RecompileHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(record.getMessage())
+
+
+class CompileMonitor:
+    """
+    Context manager collecting the graph breaks and recompilations of the compiled code run
+    inside it. The recompilation messages of torch are captured instead of printed. Only the
+    "recompiles" log setting is changed, and it is restored on exit (the other settings, e.g.
+    from `TORCH_LOGS`, are left alone).
+    """
+
+    def __init__(self) -> None:
+        self.graph_breaks: Dict[str, int] = {}
+        self.recompiles: List[str] = []
+        self.frames = 0
+        self.unique_graphs = 0
+        self._before: Dict[str, Dict[str, int]] = {}
+        self._handler = _RecompileHandler()
+        self._level = logging.NOTSET
+        self._propagate = True
+        self._recompiles_enabled = False
+
+    @staticmethod
+    def _counters() -> Dict[str, Dict[str, int]]:
+        from torch._dynamo.utils import counters
+
+        return {key: dict(values) for key, values in counters.items()}
+
+    def __enter__(self) -> "CompileMonitor":
+        from torch._logging._internal import log_state
+
+        self._before = self._counters()
+        # not torch._logging.set_logs, which would reset all the other log settings
+        self._recompiles_enabled = log_state.is_artifact_enabled("recompiles")
+        log_state.enable_artifact("recompiles")
+        # captured here instead of printed by the handlers of torch
+        recompiles_logger = logging.getLogger(RECOMPILES_LOGGER)
+        self._level = recompiles_logger.level
+        self._propagate = recompiles_logger.propagate
+        recompiles_logger.setLevel(logging.DEBUG)
+        recompiles_logger.propagate = False
+        recompiles_logger.addHandler(self._handler)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        from torch._logging._internal import log_state
+
+        recompiles_logger = logging.getLogger(RECOMPILES_LOGGER)
+        recompiles_logger.removeHandler(self._handler)
+        recompiles_logger.setLevel(self._level)
+        recompiles_logger.propagate = self._propagate
+        if not self._recompiles_enabled:
+            log_state.artifact_names.discard("recompiles")
+        after = self._counters()
+
+        def delta(group: str, key: str) -> int:
+            return after.get(group, {}).get(key, 0) - self._before.get(group, {}).get(key, 0)
+
+        self.graph_breaks = {
+            reason: delta("graph_break", reason)
+            for reason in after.get("graph_break", {})
+            if delta("graph_break", reason) > 0
+        }
+        self.frames = delta("frames", "ok")
+        self.unique_graphs = delta("stats", "unique_graphs")
+        self.recompiles = list(self._handler.messages)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "compiled_frames": self.frames,
+            "unique_graphs": self.unique_graphs,
+            "graph_breaks": self.graph_breaks,
+            "recompiles": self.recompiles,
+        }
+
+    def log(self) -> None:
+        logger.info(
+            f"torch.compile: {self.frames} frame(s), {self.unique_graphs} graph(s), "
+            f"{sum(self.graph_breaks.values())} graph break(s), "
+            f"{len(self.recompiles)} recompilation(s)"
+        )
+        for reason, count in self.graph_breaks.items():
+            logger.warning(f"Graph break ({count}x): {reason.splitlines()[0]}")
+        for message in self.recompiles:
+            logger.warning(message)
+
+
+def benchmark_step(
+    step_fn: Callable[[], Any],
+    warmup_steps: int = 3,
+    measure_steps: int = 10,
+    device: Union[str, torch.device, None] = None,
+) -> Dict[str, float]:
+    """
+    Duration of the first call of `step_fn` (which includes the compilation of a compiled
+    function) and mean duration of `measure_steps` calls after `warmup_steps` ones.
+    """
+    device = torch.device(device) if device is not None else None
+
+    def synchronize() -> None:
+        if device is not None and device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    start = time.perf_counter()
+    step_fn()
+    synchronize()
+    first = time.perf_counter() - start
+    for _ in range(max(0, warmup_steps - 1)):
+        step_fn()
+    synchronize()
+    start = time.perf_counter()
+    for _ in range(measure_steps):
+        step_fn()
+    synchronize()
+    return {
+        "first_step_seconds": first,
+        "step_seconds": (time.perf_counter() - start) / measure_steps,
+    }
@@ -0,0 +1,278 @@
+{% if cookiecutter.command_line_interface == "hydra" %}
+"""Cache of composed Hydra configs.
+
+Composing a config (defaults list, search path, overrides) is repeated on
+every launch of a `hydra.main` entry point. `cached_hydra_main` stores the
+composed config, keyed by the config name, the overrides and the content of
+every YAML file that took part in the composition, and loads it directly on
+later launches with the same inputs. Editing, adding or removing any YAML
+file in the config directories invalidates the entry.
+
+Interpolations such as `${now:...}` or `${hydra:runtime.output_dir}` are
+kept unresolved in the cache, so every job still gets its own output
+directory.
+
+Only single runs go through the cache: `--multirun` sweeps are composed by
+the sweeper and the launcher of Hydra, job by job, and fall back to
+`hydra.main`. Running a job like `hydra.main` does relies on an internal
+module of Hydra (`hydra._internal.callbacks`), so the cache is only used
+with the Hydra versions it was tested with (`SUPPORTED_HYDRA_VERSIONS`),
+and falls back to `hydra.main` otherwise.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import hydra
+from hydra import compose, initialize_config_dir
+from hydra.core.utils import JobRuntime, run_job, setup_globals
+from hydra.types import HydraContext, RunMode
+from omegaconf import DictConfig
+
+# internal API, isolated here: without it the cache is disabled (see `_can_use_cache`)
+try:
+    from hydra._internal.callbacks import Callbacks
+except ImportError:  # pragma: no cover
+    Callbacks = None
+
+log = logging.getLogger(__name__)
+
+DISABLE_ENV_VAR = "{{ cookiecutter.project_slug | upper }}_NO_CONFIG_CACHE"
+CACHE_FORMAT_VERSION = 1
+# major.minor versions of Hydra whose internals `cached_hydra_main` was tested with
+SUPPORTED_HYDRA_VERSIONS = ("1.2", "1.3")
+
+
+def default_cache_dir() -> Path:
+    """Same location as `paths.cache_dir` in `configs/common/paths/default.yaml`.
+
+    It has to be known before the config is composed, so it cannot be read
+    from the config itself.
+    """
+    return Path(os.environ.get("PROJECT_ROOT", ".")) / "cache" / "hydra_configs"
+
+
+def config_files_digest(config_dirs: Iterable[str]) -> str:
+    """Hash of the relative path and the content of every YAML file in `config_dirs`."""
+    digest = hashlib.blake2b(digest_size=16)
+    for config_dir in sorted(set(config_dirs)):
+        root = Path(config_dir)
+        digest.update(str(root).encode())
+        if not root.is_dir():
+            continue
+        for path in sorted(root.rglob("*.yaml")):
+            digest.update(str(path.relative_to(root)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _file_config_sources(cfg: DictConfig) -> List[str]:
+    return [
+        source.path
+        for source in cfg.hydra.runtime.config_sources
+        if source.schema == "file"
+    ]
+
+
+class ComposedConfigCache:
+    """On-disk cache of composed configs (with their `hydra` node).
+
+    Each entry is a pickle of the composed `DictConfig` together with the
+    list of config directories used to compose it and their digest. Pickle
+    keeps the structured `hydra` node intact, which a YAML round trip does
+    not, and is also faster to load.
+    """
+
+    def __init__(self, cache_dir: os.PathLike) -> None:
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def key(
+        config_dir: str, config_name: str, overrides: Sequence[str]
+    ) -> str:
+        # The search path may depend on PROJECT_ROOT and the working directory.
+        payload = json.dumps(
+            [
+                CACHE_FORMAT_VERSION,
+                hydra.__version__,
+                config_dir,
+                config_name,
+                list(overrides),
+                os.getcwd(),
+                os.environ.get("PROJECT_ROOT"),
+            ]
+        )
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pkl"
+
+    def load(self, key: str) -> Optional[DictConfig]:
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except Exception as e:
+            log.warning(f"Ignoring unreadable config cache entry {path}: {e}")
+            return None
+        if config_files_digest(entry["config_dirs"]) != entry["digest"]:
+            log.info(f"Config files changed since {path} was written")
+            return None
+        return entry["cfg"]
+
+    def save(self, key: str, cfg: DictConfig) -> None:
+        config_dirs = _file_config_sources(cfg)
+        entry = {
+            "cfg": cfg,
+            "config_dirs": config_dirs,
+            "digest": config_files_digest(config_dirs),
+        }
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        # Write and rename so that concurrent jobs never read a partial entry.
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f)
+        os.replace(tmp_path, path)
+
+
+def compose_config(
+    config_dir: str,
+    config_name: str,
+    overrides: Sequence[str],
+    task_name: str,
+    cache_dir: Optional[os.PathLike] = None,
+    version_base: Optional[str] = None,
+) -> Tuple[DictConfig, bool]:
+    """Compose a config including its `hydra` node, going through the cache.
+
+    Args:
+        config_dir: Absolute path of the primary config directory.
+        config_name: Name of the primary config.
+        overrides: Command line overrides.
+        task_name: Name of the job (`hydra.job.name`).
+        cache_dir: Directory of the cache. Defaults to `default_cache_dir()`.
+        version_base: Passed to `hydra.initialize_config_dir`.
+
+    Returns:
+        The composed config and whether it was loaded from the cache.
+    """
+    cache = ComposedConfigCache(
+        cache_dir if cache_dir is not None else default_cache_dir()
+    )
+    key = cache.key(config_dir, config_name, overrides)
+    cfg = cache.load(key)
+    if cfg is not None:
+        return cfg, True
+    with initialize_config_dir(
+        config_dir=config_dir, job_name=task_name, version_base=version_base
+    ):
+        cfg = compose(
+            config_name=config_name,
+            overrides=list(overrides),
+            return_hydra_config=True,
+        )
+    try:
+        cache.save(key, cfg)
+    except OSError as e:
+        log.warning(f"Could not write the config cache: {e}")
+    return cfg, False
+
+
+def _hydra_is_supported() -> bool:
+    version = ".".join(hydra.__version__.split(".")[:2])
+    return Callbacks is not None and version in SUPPORTED_HYDRA_VERSIONS
+
+
+def _can_use_cache(args: List[str]) -> bool:
+    # Flags (--multirun, --cfg, --help, ...) are left to hydra.main.
+    return (
+        not os.environ.get(DISABLE_ENV_VAR)
+        and _hydra_is_supported()
+        and not any(arg.startswith("-") for arg in args)
+    )
+
+
+def cached_hydra_main(
+    config_path: str,
+    config_name: str,
+    version_base: Optional[str] = None,
+    cache_dir: Optional[os.PathLike] = None,
+) -> Callable[[Callable[[DictConfig], Any]], Callable[[], Any]]:
+    """Drop-in replacement for `hydra.main` that caches the composed config.
+
+    Single runs with plain overrides load the composed config from the cache
+    and are executed the same way as `hydra.main` does (output directory,
+    job logging, `hydra.job.env_set`, callbacks). Anything else, e.g.
+    `--multirun` or `--cfg job`, or an untested Hydra version, falls back to
+    `hydra.main`. Set
+    `{{ cookiecutter.project_slug | upper }}_NO_CONFIG_CACHE=1` to always fall back.
+
+    Args:
+        config_path: Config directory, relative to the file of the task
+            function (as for `hydra.main`) or absolute.
+        config_name: Name of the primary config.
+        version_base: Same as for `hydra.main`.
+        cache_dir: Directory of the cache. Defaults to `default_cache_dir()`.
+    """
+
+    def decorator(
+        task_function: Callable[[DictConfig], Any]
+    ) -> Callable[[], Any]:
+        hydra_main = hydra.main(
+            config_path=config_path,
+            config_name=config_name,
+            version_base=version_base,
+        )(task_function)
+
+        @functools.wraps(task_function)
+        def main() -> Any:
+            args = sys.argv[1:]
+            if not _can_use_cache(args):
+                return hydra_main()
+            task_file = Path(sys.modules[task_function.__module__].__file__)
+            config_dir = str((task_file.parent / config_path).resolve())
+            cfg, hit = compose_config(
+                config_dir,
+                config_name,
+                args,
+                task_name=task_file.stem,
+                cache_dir=cache_dir,
+                version_base=version_base,
+            )
+            # registers the `now` and `hydra` resolvers, as hydra.main does
+            setup_globals()
+            JobRuntime.instance().set("name", cfg.hydra.job.name)
+            if cfg.hydra.mode is None:
+                cfg.hydra.mode = RunMode.RUN
+            callbacks = Callbacks(cfg)
+            callbacks.on_run_start(config=cfg, config_name=config_name)
+            ret = run_job(
+                task_function=task_function,
+                config=cfg,
+                job_dir_key="hydra.run.dir",
+                job_subdir_key=None,
+                hydra_context=HydraContext(
+                    config_loader=None, callbacks=callbacks
+                ),
+            )
+            log.debug(f"Composed config {'loaded from' if hit else 'added to'} the cache")
+            callbacks.on_run_end(
+                config=cfg, config_name=config_name, job_return=ret
+            )
+            # access the result to raise the exception in case the job failed; like hydra.main,
+            # the task function's return value is not returned
+            ret.return_value
+
+        return main
+
+    return decorator
+{% endif %}
@@ -0,0 +1,198 @@
+"""Tells whether training waits on data.
+
+`MonitoredLoader` wraps the iteration over a data loader and measures, for
+every step, the time blocked in `next()` (waiting for data) and the time
+spent by the caller between two batches (compute). With a multi-process
+`DataLoader` it also samples the number of batches that are ready in the
+prefetch queue and the number of busy workers.
+
+When the share of the time spent waiting for data exceeds
+`starvation_threshold` over the last `window` steps, a rate-limited
+"data-starved" warning is logged. The statistics can be shown in a tqdm
+progress bar:
+
+    loader = MonitoredLoader(train_loader)
+    progress = tqdm(loader)
+    for batch in progress:
+        ...
+        progress.set_postfix(loader.postfix(), refresh=False)
+
+Typical reading: a high data share with an empty queue and all workers busy
+asks for more workers; a high data share with batches ready in the queue
+points at the transfer to the main process (collation, pinning, pickling).
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, Optional
+
+from .rate_limit import log_every_n_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch_state(iterator: Any) -> Optional[Dict[str, int]]:
+    """
+    Batches ready in the queue, busy workers and outstanding tasks of a multi-process
+    `DataLoader` iterator. `None` for other iterators.
+
+    Relies on the private state of `torch.utils.data.dataloader._MultiProcessingDataLoaderIter`.
+    """
+    num_workers = getattr(iterator, "_num_workers", 0)
+    outstanding = getattr(iterator, "_tasks_outstanding", None)
+    if not num_workers or outstanding is None:
+        return None
+    try:
+        queued = iterator._data_queue.qsize()
+    except (AttributeError, NotImplementedError):  # qsize is not implemented on macOS
+        queued = 0
+    # batches received out of order wait in _task_info as (worker_id, data)
+    buffered = sum(
+        1
+        for idx, info in list(iterator._task_info.items())
+        if idx >= iterator._rcvd_idx and len(info) == 2
+    )
+    ready = queued + buffered
+    return {
+        "ready": ready,
+        "busy_workers": max(0, min(num_workers, outstanding - ready)),
+        "outstanding": outstanding,
+    }
+
+
+class MonitoredLoader:
+    """
+    Iterable wrapper of a data loader measuring the time spent waiting for data.
+
+    Parameters:
+    - loader: The data loader, or any iterable.
+    - window: Number of steps the statistics are computed over.
+    - starvation_threshold: Share of the step time spent waiting for data above which a
+        warning is logged.
+    - warmup_steps: Steps ignored by the starvation warning, e.g. while workers start.
+    - warn_every_n_seconds: Minimum interval between two warnings.
+    - sample_every: Sample the prefetch queue every `sample_every` steps.
+    """
+
+    def __init__(
+        self,
+        loader: Iterable,
+        window: int = 100,
+        starvation_threshold: float = 0.2,
+        warmup_steps: int = 10,
+        warn_every_n_seconds: float = 300.0,
+        sample_every: int = 10,
+    ) -> None:
+        self.loader = loader
+        self.window = window
+        self.starvation_threshold = starvation_threshold
+        self.warmup_steps = warmup_steps
+        self.warn_every_n_seconds = warn_every_n_seconds
+        self.sample_every = sample_every
+        self.wait_times: Deque[float] = deque(maxlen=window)
+        self.compute_times: Deque[float] = deque(maxlen=window)
+        self.ready: Deque[int] = deque(maxlen=max(1, window // sample_every))
+        self.busy_workers: Deque[int] = deque(maxlen=max(1, window // sample_every))
+        self.num_steps = 0
+        self.total_wait_time = 0.0
+        self.total_compute_time = 0.0
+        self._num_workers = getattr(loader, "num_workers", 0)
+
+    def __len__(self) -> int:
+        return len(self.loader)  # type: ignore[arg-type]
+
+    def __iter__(self) -> Iterator:
+        iterator = iter(self.loader)
+        last_yield: Optional[float] = None
+        while True:
+            start = time.perf_counter()
+            if last_yield is not None:
+                self._record_compute(start - last_yield)
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            end = time.perf_counter()
+            self._record_wait(end - start, iterator)
+            last_yield = time.perf_counter()
+            yield batch
+
+    def _record_compute(self, seconds: float) -> None:
+        self.compute_times.append(seconds)
+        self.total_compute_time += seconds
+
+    def _record_wait(self, seconds: float, iterator: Any) -> None:
+        self.wait_times.append(seconds)
+        self.total_wait_time += seconds
+        self.num_steps += 1
+        if self.num_steps % self.sample_every == 0:
+            state = prefetch_state(iterator)
+            if state is not None:
+                self.ready.append(state["ready"])
+                self.busy_workers.append(state["busy_workers"])
+        if (
+            self.num_steps > self.warmup_steps
+            and len(self.compute_times) > 0
+            and self.data_fraction > self.starvation_threshold
+        ):
+            log_every_n_seconds(
+                logger,
+                logging.WARNING,
+                self.warn_every_n_seconds,
+                "Data-starved: %.0f%% of the last %d steps spent waiting for data "
+                "(%.1f ms/step waiting, %.1f ms/step computing%s)",
+                100 * self.data_fraction,
+                len(self.wait_times),
+                1000 * self.mean_wait_time,
+                1000 * self.mean_compute_time,
+                self._queue_description(),
+                key=("starved", id(self)),
+            )
+
+    def _queue_description(self) -> str:
+        if not self.ready:
+            return ""
+        return (
+            f", {self.mean_ready:.1f} batch(es) ready, "
+            f"{self.mean_busy_workers:.1f}/{self._num_workers} workers busy"
+        )
+
+    @property
+    def mean_wait_time(self) -> float:
+        return sum(self.wait_times) / max(1, len(self.wait_times))
+
+    @property
+    def mean_compute_time(self) -> float:
+        return sum(self.compute_times) / max(1, len(self.compute_times))
+
+    @property
+    def data_fraction(self) -> float:
+        """Share of the step time spent waiting for data, over the window."""
+        wait, compute = self.mean_wait_time, self.mean_compute_time
+        return wait / (wait + compute) if wait + compute > 0 else 0.0
+
+    @property
+    def mean_ready(self) -> float:
+        return sum(self.ready) / max(1, len(self.ready))
+
+    @property
+    def mean_busy_workers(self) -> float:
+        return sum(self.busy_workers) / max(1, len(self.busy_workers))
+
+    def postfix(self) -> Dict[str, str]:
+        """Short statistics for `tqdm.set_postfix`."""
+        postfix = {"data": f"{100 * self.data_fraction:.0f}%"}
+        if self.ready:
+            postfix["ready"] = f"{self.mean_ready:.1f}"
+            postfix["busy"] = f"{self.mean_busy_workers:.1f}/{self._num_workers}"
+        return postfix
+
+    def summary(self) -> Dict[str, float]:
+        """Statistics since the start, e.g. to log at the end of an epoch."""
+        total = self.total_wait_time + self.total_compute_time
+        return {
+            "steps": self.num_steps,
+            "wait_time": self.total_wait_time,
+            "compute_time": self.total_compute_time,
+            "data_fraction": self.total_wait_time / total if total > 0 else 0.0,
+        }
@@ -0,0 +1,371 @@
+"""Greedy decoding with continuous batching, for evaluation.
+
+Generating with fixed batches wastes most of the compute on padding: every
+batch is padded to its longest input and runs until its longest output is
+done, while the finished sequences keep being decoded. `BatchDecoder`
+instead
+
+- sorts the inputs by length, so that the sequences decoded together have
+  similar lengths;
+- evicts the finished sequences from the batch after every step, together
+  with their rows of the KV cache and of the encoder states;
+- refills the free slots with new inputs: they are encoded, run their first
+  decoding step, and their cache is left-padded to the length of the cache
+  of the batch and concatenated to it. The cache is never recomputed.
+
+The columns of the cache that only hold padding for every row are trimmed,
+so the cache does not grow with the number of refills.
+
+The model is called through a `DecodingAdapter`. `HFSeq2SeqAdapter` adapts
+HF encoder-decoder models with relative decoder positions (T5, mT5):
+
+    decoder = BatchDecoder(
+        HFSeq2SeqAdapter(model),
+        batch_size=64,
+        max_new_tokens=100,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    predictions = decoder.generate([example["input_ids"] for example in dataset])
+    logger.info(decoder.stats)
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from .collate import map_tensors
+
+logger = logging.getLogger(__name__)
+
+
+def pad_to(
+    tensor: torch.Tensor, length: int, dim: int, left: bool = False, value: Any = 0
+) -> torch.Tensor:
+    """Pad `tensor` to `length` along `dim`, on the left or the right."""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    padding = torch.full(shape, value, dtype=tensor.dtype, device=tensor.device)
+    return torch.cat([padding, tensor] if left else [tensor, padding], dim=dim)
+
+
+def cat_rows(first: Any, second: Any) -> Any:
+    """Concatenate the tensors of two nested structures of the same layout along dim 0."""
+    if isinstance(first, torch.Tensor):
+        return torch.cat([first, second])
+    if isinstance(first, dict):
+        return type(first)((k, cat_rows(v, second[k])) for k, v in first.items())
+    if isinstance(first, (list, tuple)):
+        return type(first)(cat_rows(a, b) for a, b in zip(first, second))
+    return first
+
+
+def select_rows(obj: Any, index: torch.Tensor) -> Any:
+    return map_tensors(obj, lambda t: t.index_select(0, index))
+
+
+class DecodingAdapter:
+    """
+    Interface between `BatchDecoder` and a model.
+
+    The encoder states and the cache are nested structures (dicts, lists, tuples) of tensors
+    whose first dimension is the batch. The default implementations of `pad_state`,
+    `pad_cache` and `trim_cache` suit states whose tensors all have the source positions on
+    dim 1 and caches whose tensors all have the target positions on dim -2 (self-attention
+    keys and values); override them otherwise.
+    """
+
+    start_token_id: int
+
+    def encode(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Any:
+        """Encoder states of a right-padded batch of inputs."""
+        raise NotImplementedError
+
+    def step(
+        self,
+        tokens: torch.Tensor,
+        state: Any,
+        cache: Optional[Any],
+        attention_mask: torch.Tensor,
+    ) -> Tuple[torch.Tensor, Any]:
+        """
+        Logits `(batch, vocab)` of the next tokens and updated cache.
+
+        `tokens` are the last tokens `(batch, 1)`, `attention_mask` marks the positions of
+        `cache` that are not padding, plus the position of `tokens`. `cache` is `None` at the
+        first step.
+        """
+        raise NotImplementedError
+
+    def pad_state(self, state: Any, source_length: int) -> Any:
+        return map_tensors(state, lambda t: pad_to(t, source_length, dim=1))
+
+    def pad_cache(self, cache: Any, target_length: int, source_length: int) -> Any:
+        return map_tensors(cache, lambda t: pad_to(t, target_length, dim=-2, left=True))
+
+    def trim_cache(self, cache: Any, start: int) -> Any:
+        return map_tensors(cache, lambda t: t[..., start:, :])
+
+
+class HFSeq2SeqAdapter(DecodingAdapter):
+    """
+    Adapter of HF encoder-decoder models (`model.get_encoder()`, `past_key_values`).
+
+    The refilled sequences have left-padded caches, so the decoder must not use absolute
+    positions: T5 and mT5 are fine, BART-like models are not.
+
+    The cache is kept as a tuple of (self-attention key, value, cross-attention key, value)
+    per layer, and handed to the model as an `EncoderDecoderCache` where transformers has it.
+
+    Parameters:
+    - model: The model, in eval mode.
+    """
+
+    def __init__(self, model: Any) -> None:
+        self.model = model
+        self.start_token_id = model.config.decoder_start_token_id
+        try:
+            from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+        except ImportError:  # pragma: no cover
+            DynamicCache = EncoderDecoderCache = None
+        self._dynamic_cache = DynamicCache
+        self._encoder_decoder_cache = EncoderDecoderCache
+
+    def encode(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Any:
+        encoder_outputs = self.model.get_encoder()(
+            input_ids=input_ids, attention_mask=attention_mask
+        )
+        return {"hidden": encoder_outputs.last_hidden_state, "mask": attention_mask}
+
+    def _to_model_cache(self, cache: Tuple[Tuple[torch.Tensor, ...], ...]) -> Any:
+        if self._encoder_decoder_cache is None:  # pragma: no cover
+            return cache
+        return self._encoder_decoder_cache(
+            self._dynamic_cache([layer[:2] for layer in cache]),
+            self._dynamic_cache([layer[2:] for layer in cache]),
+        )
+
+    @staticmethod
+    def _key_values(cache: Any) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        if hasattr(cache, "layers"):
+            return [(layer.keys, layer.values) for layer in cache.layers]
+        return list(zip(cache.key_cache, cache.value_cache))
+
+    def _from_model_cache(self, cache: Any) -> Tuple[Tuple[torch.Tensor, ...], ...]:
+        if isinstance(cache, tuple):  # pragma: no cover
+            return cache
+        return tuple(
+            self_attention + cross_attention
+            for self_attention, cross_attention in zip(
+                self._key_values(cache.self_attention_cache),
+                self._key_values(cache.cross_attention_cache),
+            )
+        )
+
+    def step(self, tokens, state, cache, attention_mask):
+        outputs = self.model(
+            encoder_outputs=(state["hidden"],),
+            attention_mask=state["mask"],
+            decoder_input_ids=tokens,
+            decoder_attention_mask=attention_mask,
+            past_key_values=None if cache is None else self._to_model_cache(cache),
+            use_cache=True,
+        )
+        return outputs.logits[:, -1], self._from_model_cache(outputs.past_key_values)
+
+    def pad_cache(self, cache, target_length, source_length):
+        # (self-attention key, value, cross-attention key, value) per layer
+        return tuple(
+            tuple(
+                pad_to(t, target_length, dim=-2, left=True)
+                if i < 2
+                else pad_to(t, source_length, dim=-2)
+                for i, t in enumerate(layer)
+            )
+            for layer in cache
+        )
+
+    def trim_cache(self, cache, start):
+        return tuple(
+            tuple(t[..., start:, :] if i < 2 else t for i, t in enumerate(layer))
+            for layer in cache
+        )
+
+
+class BatchDecoder:
+    """
+    Greedy decoder with length sorting and continuous batching.
+
+    Parameters:
+    - adapter: Calls the model.
+    - batch_size: Largest number of sequences decoded together.
+    - max_new_tokens: Largest number of generated tokens per sequence.
+    - eos_token_id: Token ending a sequence. `None` to always generate `max_new_tokens`.
+    - pad_token_id: Padding of the inputs.
+    - continuous: Evict the finished sequences and refill the batch. `False` decodes fixed
+        batches until all their sequences are done, like `generate` does.
+    - sort_by_length: Decode the inputs from the longest to the shortest.
+    - refill_fraction: Refill once this fraction of the batch is free. Refilling costs an
+        encoder pass and a decoding step of its own, so refilling a single slot at a time is
+        rarely worth it.
+    - device: Where the inputs are moved.
+    """
+
+    def __init__(
+        self,
+        adapter: DecodingAdapter,
+        batch_size: int,
+        max_new_tokens: int,
+        eos_token_id: Optional[int],
+        pad_token_id: int = 0,
+        continuous: bool = True,
+        sort_by_length: bool = True,
+        refill_fraction: float = 0.25,
+        device: Any = "cpu",
+    ) -> None:
+        self.adapter = adapter
+        self.batch_size = batch_size
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_id = eos_token_id
+        self.pad_token_id = pad_token_id
+        self.continuous = continuous
+        self.sort_by_length = sort_by_length
+        self.refill_size = max(1, int(refill_fraction * batch_size))
+        self.device = torch.device(device)
+        self.stats: Dict[str, float] = {}
+
+    def _order(self, inputs: Sequence[Sequence[int]]) -> List[int]:
+        if not self.sort_by_length:
+            return list(range(len(inputs)))
+        lengths = np.fromiter((len(x) for x in inputs), dtype=np.int64, count=len(inputs))
+        return np.argsort(-lengths, kind="stable").tolist()
+
+    def _encode(self, inputs: List[Sequence[int]]) -> Any:
+        length = max(1, max(len(x) for x in inputs))
+        input_ids = torch.full(
+            (len(inputs), length), self.pad_token_id, dtype=torch.long
+        )
+        attention_mask = torch.zeros((len(inputs), length), dtype=torch.bool)
+        for row, ids in enumerate(inputs):
+            input_ids[row, : len(ids)] = torch.as_tensor(ids, dtype=torch.long)
+            attention_mask[row, : len(ids)] = True
+        return self.adapter.encode(
+            input_ids.to(self.device), attention_mask.to(self.device)
+        )
+
+    @staticmethod
+    def _source_length(state: Any) -> int:
+        lengths: List[int] = []
+        map_tensors(state, lambda t: lengths.append(t.shape[1]) if t.dim() > 1 else None)
+        return max(lengths, default=0)
+
+    @torch.no_grad()
+    def generate(self, inputs: Sequence[Sequence[int]]) -> List[List[int]]:
+        """Generated tokens of every input (without the start token, with the EOS token)."""
+        outputs: List[List[int]] = [[] for _ in inputs]
+        queue: Deque[int] = deque(self._order(inputs))
+        rows: List[int] = []  # index of the input decoded by each row
+        done = torch.zeros(0, dtype=torch.bool, device=self.device)
+        state = cache = attention_mask = tokens = None
+        num_steps = num_row_steps = 0
+        start_time = time.perf_counter()
+        while queue or rows:
+            free = self.batch_size - len(rows)
+            if queue and (not rows or (self.continuous and free >= self.refill_size)):
+                new_rows = [queue.popleft() for _ in range(min(free, len(queue)))]
+                new_state = self._encode([inputs[i] for i in new_rows])
+                new_mask = torch.ones(
+                    (len(new_rows), 1), dtype=torch.bool, device=self.device
+                )
+                start = torch.full(
+                    (len(new_rows), 1),
+                    self.adapter.start_token_id,
+                    dtype=torch.long,
+                    device=self.device,
+                )
+                logits, new_cache = self.adapter.step(start, new_state, None, new_mask)
+                new_tokens = logits.argmax(-1)
+                num_row_steps += len(new_rows)
+                if rows:
+                    target_length = attention_mask.shape[1]
+                    source_length = max(
+                        self._source_length(state), self._source_length(new_state)
+                    )
+                    state = cat_rows(
+                        self.adapter.pad_state(state, source_length),
+                        self.adapter.pad_state(new_state, source_length),
+                    )
+                    cache = cat_rows(
+                        self.adapter.pad_cache(cache, target_length, source_length),
+                        self.adapter.pad_cache(new_cache, target_length, source_length),
+                    )
+                    attention_mask = torch.cat(
+                        [attention_mask, pad_to(new_mask, target_length, 1, left=True)]
+                    )
+                    step_tokens = torch.cat([tokens, new_tokens])
+                    done = torch.cat([done, torch.zeros_like(new_tokens, dtype=torch.bool)])
+                else:
+                    state, cache, attention_mask = new_state, new_cache, new_mask
+                    step_tokens = new_tokens
+                    done = torch.zeros_like(new_tokens, dtype=torch.bool)
+                new_done = torch.zeros_like(done)
+                new_done[len(rows) :] = True
+                rows = rows + new_rows
+            else:
+                attention_mask = torch.cat(
+                    [attention_mask, attention_mask.new_ones((len(rows), 1))], dim=1
+                )
+                logits, cache = self.adapter.step(
+                    tokens[:, None], state, cache, attention_mask
+                )
+                step_tokens = logits.argmax(-1)
+                num_row_steps += len(rows)
+                num_steps += 1
+                new_done = torch.ones_like(done)
+            # `new_done` marks the rows that produced a token at this step
+            step_tokens = step_tokens.masked_fill(done, self.pad_token_id)
+            produced = (new_done & ~done).nonzero().flatten().tolist()
+            values = step_tokens.tolist()
+            for row in produced:
+                output = outputs[rows[row]]
+                output.append(values[row])
+                if (
+                    self.eos_token_id is not None and values[row] == self.eos_token_id
+                ) or len(output) >= self.max_new_tokens:
+                    done[row] = True
+            tokens = step_tokens
+
+            if self.continuous or bool(done.all()):
+                keep = (~done).nonzero().flatten()
+                if len(keep) < len(rows):
+                    rows = [rows[i] for i in keep.tolist()]
+                    if rows:
+                        state = select_rows(state, keep)
+                        cache = select_rows(cache, keep)
+                        attention_mask = attention_mask[keep]
+                        tokens = tokens[keep]
+                        done = done[keep]
+            if rows:
+                # drop the cache columns that are padding for every row
+                first = int(attention_mask.any(0).int().argmax())
+                if first > 0:
+                    cache = self.adapter.trim_cache(cache, first)
+                    attention_mask = attention_mask[:, first:]
+        elapsed = time.perf_counter() - start_time
+        num_tokens = sum(len(output) for output in outputs)
+        self.stats = {
+            "tokens": num_tokens,
+            "steps": num_steps,
+            "row_steps": num_row_steps,
+            # share of the decoded rows that produced a token
+            "efficiency": num_tokens / max(1, num_row_steps),
+            "seconds": elapsed,
+            "tokens_per_second": num_tokens / elapsed if elapsed > 0 else 0.0,
+        }
+        return outputs
@@ -0,0 +1,271 @@
+"""Train part of a model without paying for the frozen part.
+
+Freezing parameters (`requires_grad=False`) only saves memory if nothing
+else holds on to them: the optimizer must not receive them (an optimizer
+given all the parameters skips the frozen ones at each step, but some
+allocate their states eagerly), and they must not have gradients. On top
+of that, frozen weights do not need full precision, nor to stay on the
+accelerator between two uses.
+
+    freeze(model, [r"^encoder\\.", r"^decoder\\.", r"^lm_head\\."])
+    cast_frozen_modules(model, torch.bfloat16)
+    optimizer = torch.optim.AdamW(trainable_param_groups(model, weight_decay=0.01), lr=1e-4)
+    check_frozen(model, optimizer)
+    logger.info(format_memory_report(frozen_memory_report(model, optimizer)))
+"""
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+NO_WEIGHT_DECAY = (r"bias$", r"norm\.weight$", r"LayerNorm\.weight$")
+
+
+def freeze(model: nn.Module, patterns: Sequence[str]) -> List[str]:
+    """
+    Set `requires_grad=False` on the parameters whose name matches one of the regexes
+    `patterns`. Tied parameters are frozen if any of their names matches. Returns the names of
+    the frozen parameters.
+    """
+    regexes = [re.compile(pattern) for pattern in patterns]
+    frozen = []
+    for name, param in model.named_parameters(remove_duplicate=False):
+        if any(regex.search(name) for regex in regexes):
+            param.requires_grad_(False)
+            frozen.append(name)
+    return frozen
+
+
+def trainable_param_groups(
+    model: nn.Module,
+    weight_decay: float = 0.0,
+    no_weight_decay: Sequence[str] = NO_WEIGHT_DECAY,
+) -> List[Dict[str, Any]]:
+    """
+    Optimizer param groups holding only the trainable parameters, with no weight decay for the
+    parameters matching `no_weight_decay` (biases and norms by default).
+    """
+    regexes = [re.compile(pattern) for pattern in no_weight_decay]
+    decay, no_decay = [], []
+    for name, param in model.named_parameters():
+        if not param.requires_grad:
+            continue
+        if any(regex.search(name) for regex in regexes):
+            no_decay.append(param)
+        else:
+            decay.append(param)
+    groups = [
+        {"params": decay, "weight_decay": weight_decay},
+        {"params": no_decay, "weight_decay": 0.0},
+    ]
+    return [group for group in groups if group["params"]]
+
+
+def check_frozen(model: nn.Module, optimizer: Optional[torch.optim.Optimizer] = None) -> None:
+    """Raise a `ValueError` if a frozen parameter has a gradient or is given to `optimizer`."""
+    names = {id(p): name for name, p in model.named_parameters()}
+    problems = [
+        f"{name} has a gradient"
+        for name, p in model.named_parameters()
+        if not p.requires_grad and p.grad is not None
+    ]
+    if optimizer is not None:
+        problems += [
+            f"{names.get(id(p), '<unnamed>')} is in the optimizer"
+            for group in optimizer.param_groups
+            for p in group["params"]
+            if not p.requires_grad
+        ]
+    if problems:
+        raise ValueError("Frozen parameters are not free: " + "; ".join(problems))
+
+
+def _frozen_modules(model: nn.Module) -> List[Tuple[str, nn.Module]]:
+    """
+    Largest submodules whose parameters are all frozen, and not shared with the rest of the
+    model.
+    """
+    candidates: List[Tuple[str, nn.Module]] = []
+    for name, module in model.named_modules():
+        if any(name.startswith(prefix + ".") for prefix, _ in candidates):
+            continue
+        params = list(module.parameters())
+        if params and not any(p.requires_grad for p in params):
+            candidates.append((name, module))
+
+    def inside(name: str) -> bool:
+        return any(
+            name == prefix or name.startswith(prefix + ".") or not prefix
+            for prefix, _ in candidates
+        )
+
+    outside: Set[int] = {
+        id(p)
+        for name, module in model.named_modules(remove_duplicate=False)
+        if not inside(name)
+        for p in module.parameters(recurse=False)
+    }
+    selected = []
+    for name, module in candidates:
+        if any(id(p) in outside for p in module.parameters()):
+            logger.info(f"Not moving {name or 'the model'}: it shares parameters")
+            continue
+        selected.append((name, module))
+    return selected
+
+
+def _cast_floating(obj: Any, dtype: torch.dtype) -> Any:
+    if isinstance(obj, torch.Tensor):
+        return obj.to(dtype) if obj.is_floating_point() else obj
+    if isinstance(obj, dict):
+        # in place, so that e.g. HF ModelOutputs keep their type
+        for key in list(obj):
+            obj[key] = _cast_floating(obj[key], dtype)
+        return obj
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, "_fields"):
+        return type(obj)(_cast_floating(v, dtype) for v in obj)
+    return obj
+
+
+def _nbytes(tensors: Iterable[torch.Tensor]) -> int:
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def cast_frozen_modules(model: nn.Module, dtype: torch.dtype = torch.bfloat16) -> int:
+    """
+    Cast the submodules whose parameters are all frozen to `dtype`. Their floating point inputs
+    are cast to `dtype` and their outputs back to the previous type of their parameters, so the
+    rest of the model is unaffected. A cast module run by another one (e.g. tied embeddings,
+    shared by the model and its encoder) keeps its output in `dtype` there. Returns the number
+    of bytes saved.
+    """
+    # before casting anything: cast modules may share submodules
+    modules = [
+        (name, module, next(module.parameters()).dtype)
+        for name, module in _frozen_modules(model)
+    ]
+    # number of cast modules being run
+    depth = [0]
+
+    def cast_inputs(module, args, kwargs):
+        depth[0] += 1
+        return _cast_floating(args, dtype), _cast_floating(kwargs, dtype)
+
+    def cast_output(module, args, output, previous):
+        depth[0] -= 1
+        return output if depth[0] else _cast_floating(output, previous)
+
+    saved = 0
+    for name, module, previous in modules:
+        if previous == dtype:
+            continue
+        before = _nbytes(module.parameters())
+        module.to(dtype)
+        saved += before - _nbytes(module.parameters())
+        module.register_forward_pre_hook(cast_inputs, with_kwargs=True)
+        module.register_forward_hook(
+            lambda module, args, output, previous=previous: cast_output(
+                module, args, output, previous
+            ),
+            always_call=True,
+        )
+        logger.debug(f"Cast the frozen module {name or 'model'} to {dtype}")
+    return saved
+
+
+def _move_module(module: nn.Module, device: torch.device) -> None:
+    pin = device.type == "cpu" and torch.cuda.is_available()
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        data = tensor.data.to(device, non_blocking=True)
+        tensor.data = data.pin_memory() if pin else data
+
+
+def offload_frozen_modules(model: nn.Module, offload_device: Any = "cpu") -> int:
+    """
+    Keep the submodules whose parameters are all frozen on `offload_device` (in pinned memory
+    for CUDA) and move them to the device of their inputs only for their forward. The backward
+    pass still holds the weights it needs. Returns the number of bytes offloaded from the
+    accelerator.
+    """
+    offload_device = torch.device(offload_device)
+    offloaded = 0
+    for name, module in _frozen_modules(model):
+        if next(module.parameters()).device.type != offload_device.type:
+            offloaded += _nbytes(module.parameters())
+        _move_module(module, offload_device)
+
+        def load(module, args, kwargs):
+            tensors: List[torch.Tensor] = []
+            for value in list(args) + list(kwargs.values()):
+                if isinstance(value, torch.Tensor):
+                    tensors.append(value)
+            if tensors and tensors[0].device != offload_device:
+                _move_module(module, tensors[0].device)
+
+        module.register_forward_pre_hook(load, with_kwargs=True)
+        module.register_forward_hook(
+            lambda module, args, output: _move_module(module, offload_device)
+        )
+        logger.debug(f"Offloaded the frozen module {name or 'model'} to {offload_device}")
+    return offloaded
+
+
+def frozen_memory_report(
+    model: nn.Module,
+    optimizer: Optional[torch.optim.Optimizer] = None,
+    states_per_param: int = 2,
+) -> Dict[str, int]:
+    """
+    Parameter counts and bytes of the trainable and frozen parameters, the bytes of the
+    gradients and optimizer states that exist, and the bytes that gradients and
+    `states_per_param` optimizer states (2 for Adam) of the frozen parameters would take in the
+    default dtype.
+    """
+    params = list(model.parameters())
+    trainable = [p for p in params if p.requires_grad]
+    frozen = [p for p in params if not p.requires_grad]
+    default_size = torch.empty((), dtype=torch.get_default_dtype()).element_size()
+    report = {
+        "trainable_params": sum(p.numel() for p in trainable),
+        "frozen_params": sum(p.numel() for p in frozen),
+        "trainable_bytes": _nbytes(trainable),
+        "frozen_bytes": _nbytes(frozen),
+        "frozen_bytes_on_accelerator": _nbytes(p for p in frozen if p.device.type != "cpu"),
+        "gradient_bytes": _nbytes(p.grad for p in params if p.grad is not None),
+        "saved_gradient_and_optimizer_bytes": sum(p.numel() for p in frozen)
+        * default_size
+        * (1 + states_per_param),
+    }
+    if optimizer is not None:
+        report["optimizer_state_bytes"] = _nbytes(
+            value
+            for state in optimizer.state.values()
+            for value in state.values()
+            if isinstance(value, torch.Tensor)
+        )
+    return report
+
+
+def format_memory_report(report: Dict[str, int]) -> str:
+    def mib(value: int) -> str:
+        return f"{value / 2**20:.1f} MiB"
+
+    total = report["trainable_params"] + report["frozen_params"]
+    lines = [
+        f"Trainable parameters: {report['trainable_params']:,} / {total:,} "
+        f"({mib(report['trainable_bytes'])})",
+        f"Frozen parameters: {report['frozen_params']:,} ({mib(report['frozen_bytes'])}, "
+        f"{mib(report['frozen_bytes_on_accelerator'])} on the accelerator)",
+        f"Gradients: {mib(report['gradient_bytes'])}",
+    ]
+    if "optimizer_state_bytes" in report:
+        lines.append(f"Optimizer states: {mib(report['optimizer_state_bytes'])}")
+    lines.append(
+        "Saved by freezing (gradients and optimizer states): "
+        f"{mib(report['saved_gradient_and_optimizer_bytes'])}"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,331 @@
+"""Chunked checksums of checkpoint files.
+
+A checkpoint file saved with `ChecksummedIO.save` gets a small manifest
+next to it (`<name>.sums.json`) with the digest of every chunk of the
+serialized bytes. The chunks are hashed in a thread pool (the hash
+functions release the GIL) while `torch.save` streams them to the file, so
+the checkpoint is never held in memory as a whole.
+
+`ChecksummedIO.load` hashes the file as `torch.load` reads it, from the
+same open file, and raises `ChecksumError` with the corrupted chunks on a
+mismatch, so the file is read once and what is loaded is what was verified.
+
+xxhash (`xxh3_128`) is used when installed, blake2b otherwise. The manifest
+records the algorithm, so files can be verified wherever it is available.
+"""
+import hashlib
+import json
+import logging
+import shutil
+import tempfile
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import torch
+
+from .storage import CheckpointStorage
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+MANIFEST_SUFFIX = ".sums.json"
+
+
+class ChecksumError(RuntimeError):
+    pass
+
+
+def default_algorithm() -> str:
+    return "xxh3_128" if xxhash is not None else "blake2b"
+
+
+def _digest(data: memoryview, algorithm: str) -> str:
+    if algorithm == "xxh3_128":
+        if xxhash is None:
+            raise ChecksumError("xxhash is required to verify xxh3_128 checksums")
+        return xxhash.xxh3_128_hexdigest(data)
+    if algorithm == "blake2b":
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    raise ChecksumError(f"Unknown checksum algorithm {algorithm}")
+
+
+def chunk_digests(
+    data: bytes,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    algorithm: Optional[str] = None,
+    executor: Optional[Executor] = None,
+) -> List[str]:
+    """Digests of the consecutive `chunk_size` chunks of `data`, computed in `executor`."""
+    algorithm = algorithm or default_algorithm()
+    if executor is None:
+        return [_digest(chunk, algorithm) for chunk in _chunks(data, chunk_size)]
+    return [f.result() for f in _submit_digests(data, chunk_size, algorithm, executor)]
+
+
+def _chunks(data: bytes, chunk_size: int) -> List[memoryview]:
+    view = memoryview(data)
+    return [view[i : i + chunk_size] for i in range(0, len(view), chunk_size)]
+
+
+def _submit_digests(
+    data: bytes, chunk_size: int, algorithm: str, executor: Executor
+) -> List[Future]:
+    return [
+        executor.submit(_digest, chunk, algorithm)
+        for chunk in _chunks(data, chunk_size)
+    ]
+
+
+def manifest_name(name: str) -> str:
+    return name + MANIFEST_SUFFIX
+
+
+class _ChunkHasher:
+    """
+    Digests of the consecutive `chunk_size` chunks of a stream of bytes, computed in `executor`.
+    At most `max_pending` chunks wait for their digest, which bounds the memory used.
+    """
+
+    def __init__(
+        self, chunk_size: int, algorithm: str, executor: Executor, max_pending: int
+    ) -> None:
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.size = 0
+        self._executor = executor
+        self._max_pending = max_pending
+        self._buffer = bytearray()
+        self._futures: List[Future] = []
+        self._num_done = 0
+
+    def _submit(self, chunk: bytes) -> None:
+        while len(self._futures) - self._num_done >= self._max_pending:
+            self._futures[self._num_done].result()
+            self._num_done += 1
+        self._futures.append(self._executor.submit(_digest, chunk, self.algorithm))
+
+    def update(self, data: bytes) -> None:
+        view = memoryview(data).cast("B")
+        self.size += len(view)
+        if self._buffer:
+            take = self.chunk_size - len(self._buffer)
+            self._buffer += view[:take]
+            view = view[take:]
+            if len(self._buffer) < self.chunk_size:
+                return
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while len(view) >= self.chunk_size:
+            self._submit(bytes(view[: self.chunk_size]))
+            view = view[self.chunk_size :]
+        self._buffer += view
+
+    def digests(self) -> List[str]:
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        return [f.result() for f in self._futures]
+
+
+class _HashingWriter:
+    """Writes through to `file`, hashing what is written. All `torch.save` needs of a file."""
+
+    def __init__(self, file: BinaryIO, hasher: _ChunkHasher) -> None:
+        self._file = file
+        self._hasher = hasher
+
+    def write(self, data: bytes) -> int:
+        self._hasher.update(data)
+        return self._file.write(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+
+class _HashingReader:
+    """
+    Reads `file` for `torch.load`, hashing its bytes in order as they are read. A read that
+    jumps ahead by at most `max_gap` bytes hashes the skipped bytes first; bigger jumps (to the
+    zip directory at the end of the file) are read without hashing, and `finish` hashes
+    whatever has not been read in order.
+    """
+
+    def __init__(self, file: BinaryIO, hasher: _ChunkHasher, max_gap: int = 1024 * 1024) -> None:
+        self._file = file
+        self._hasher = hasher
+        self._max_gap = max_gap
+
+    def _hash_read(self, start: int, data: memoryview) -> None:
+        end = start + len(data)
+        if start > self._hasher.size:
+            if start - self._hasher.size > self._max_gap:
+                return
+            self._file.seek(self._hasher.size)
+            self._hasher.update(self._file.read(start - self._hasher.size))
+            self._file.seek(end)
+        offset = self._hasher.size - start
+        if offset < len(data):
+            self._hasher.update(data[offset:])
+
+    def read(self, size: int = -1) -> bytes:
+        start = self._file.tell()
+        data = self._file.read(size)
+        self._hash_read(start, memoryview(data))
+        return data
+
+    def readinto(self, buffer: Any) -> int:
+        start = self._file.tell()
+        n = self._file.readinto(buffer)
+        self._hash_read(start, memoryview(buffer).cast("B")[:n])
+        return n
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def finish(self) -> None:
+        self._file.seek(self._hasher.size)
+        while True:
+            data = self._file.read(self._hasher.chunk_size)
+            if not data:
+                break
+            self._hasher.update(data)
+
+
+class ChecksummedIO:
+    """
+    Saves and loads objects with `torch.save`/`torch.load` through a `CheckpointStorage`,
+    writing and verifying chunk checksums. The hashing threads are started on first use and
+    stopped by `close`.
+
+    Parameters:
+    - storage: The storage backend.
+    - chunk_size: Size of the hashed chunks, in bytes.
+    - algorithm: Hash algorithm. Defaults to `default_algorithm()`.
+    - num_threads: Number of hashing threads.
+    """
+
+    def __init__(
+        self,
+        storage: CheckpointStorage,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        algorithm: Optional[str] = None,
+        num_threads: int = 4,
+    ) -> None:
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm or default_algorithm()
+        self.num_threads = num_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.num_threads, thread_name_prefix="checksum"
+            )
+        return self._executor
+
+    def _hasher(self, chunk_size: int, algorithm: str) -> _ChunkHasher:
+        return _ChunkHasher(chunk_size, algorithm, self.executor, 2 * self.num_threads)
+
+    def save(self, obj: Any, name: str) -> None:
+        hasher = self._hasher(self.chunk_size, self.algorithm)
+        with self.storage.open_write(name) as f:
+            torch.save(obj, _HashingWriter(f, hasher))
+            manifest = {
+                "algorithm": self.algorithm,
+                "chunk_size": self.chunk_size,
+                "size": hasher.size,
+                "chunks": hasher.digests(),
+            }
+        self.storage.put_bytes(json.dumps(manifest).encode(), manifest_name(name))
+
+    def load_manifest(self, name: str) -> Optional[Dict[str, Any]]:
+        if not self.storage.exists(manifest_name(name)):
+            return None
+        return json.loads(self.storage.get_bytes(manifest_name(name)))
+
+    def verify(self, name: str) -> Optional[bool]:
+        """Whether `name` matches its manifest. `None` if it has no manifest."""
+        manifest = self.load_manifest(name)
+        if manifest is None:
+            return None
+        hasher = self._hasher(manifest["chunk_size"], manifest["algorithm"])
+        with self.storage.open_read(name) as f:
+            while True:
+                data = f.read(manifest["chunk_size"])
+                if not data:
+                    break
+                hasher.update(data)
+        return self._check(name, manifest, hasher)
+
+    def _check(self, name: str, manifest: Dict[str, Any], hasher: _ChunkHasher) -> bool:
+        if hasher.size != manifest["size"]:
+            bad_chunks = list(range(len(manifest["chunks"])))
+        else:
+            bad_chunks = [
+                i
+                for i, (actual, expected) in enumerate(
+                    zip(hasher.digests(), manifest["chunks"])
+                )
+                if actual != expected
+            ]
+        if bad_chunks:
+            logger.error(
+                f"{self.storage.location(name)} is corrupted: chunks {bad_chunks} of "
+                f"{len(manifest['chunks'])} do not match their checksums"
+            )
+        return not bad_chunks
+
+    def load(self, name: str, map_location: Any = None) -> Any:
+        """
+        Load `name`, verifying it against its manifest (if any) as it is read. Raises
+        `ChecksumError` if it does not match.
+        """
+        manifest = self.load_manifest(name)
+        if manifest is None:
+            return self.storage.load(name, map_location=map_location)
+        hasher = self._hasher(manifest["chunk_size"], manifest["algorithm"])
+        error: Optional[Exception] = None
+        with self.storage.open_read(name) as f:
+            if f.seekable():
+                reader = _HashingReader(f, hasher)
+                try:
+                    obj = torch.load(reader, map_location=map_location)
+                except Exception as e:  # corrupted bytes may not even unpickle
+                    error = e
+                reader.finish()
+            else:
+                # e.g. an S3 body: hash it while copying it to a local file to load from
+                with tempfile.TemporaryFile() as tmp:
+                    shutil.copyfileobj(f, _HashingWriter(tmp, hasher), manifest["chunk_size"])
+                    tmp.seek(0)
+                    try:
+                        obj = torch.load(tmp, map_location=map_location)
+                    except Exception as e:
+                        error = e
+        if not self._check(name, manifest, hasher):
+            raise ChecksumError(f"{self.storage.location(name)} is corrupted") from error
+        if error is not None:
+            raise error
+        return obj
+
+    def close(self, wait: bool = True) -> None:
+        """Stop the hashing threads. They are started again if the object is used afterwards."""
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            executor.shutdown(wait=wait)
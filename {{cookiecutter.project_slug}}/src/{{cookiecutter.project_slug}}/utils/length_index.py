@@ -0,0 +1,170 @@
+"""Token counts of the examples of a dataset, for vectorized filtering and bucketing.
+
+A `LengthIndex` holds one compact array (`uint16`, or `uint32` for longer
+sequences) of token counts per field, e.g. `source` and `target`. It is
+saved as `lengths.npz` next to the dataset, so selecting the examples that
+fit a maximum length, or grouping examples of similar lengths into batches,
+are NumPy operations instead of a Python function called on every example.
+
+    index = LengthIndex.load(directory)
+    kept = index.select(max_lengths={"target": 50})
+    dataset = torch.utils.data.Subset(dataset, kept)
+"""
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+from torch.utils.data import Sampler
+
+INDEX_FILE = "lengths.npz"
+
+
+def compact(lengths: Iterable[int]) -> np.ndarray:
+    """`lengths` in the smallest of `uint16` and `uint32` that holds them."""
+    lengths = np.asarray(lengths if isinstance(lengths, np.ndarray) else list(lengths))
+    if lengths.size and lengths.min() < 0:
+        raise ValueError("Lengths cannot be negative")
+    dtype = np.uint16 if not lengths.size or lengths.max() < 2**16 else np.uint32
+    return lengths.astype(dtype)
+
+
+class LengthIndex:
+    """
+    Token counts of every example, per field.
+
+    Parameters:
+    - lengths: Token counts of each field. All the arrays have one entry per example.
+    """
+
+    def __init__(self, lengths: Dict[str, Iterable[int]]) -> None:
+        self.lengths = {field: compact(values) for field, values in lengths.items()}
+        sizes = {len(values) for values in self.lengths.values()}
+        if len(sizes) > 1:
+            raise ValueError(f"Fields have different numbers of examples: {sizes}")
+
+    def __len__(self) -> int:
+        return len(next(iter(self.lengths.values()))) if self.lengths else 0
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.lengths[field]
+
+    @classmethod
+    def from_offsets(cls, offsets: Dict[str, np.ndarray]) -> "LengthIndex":
+        return cls({field: np.diff(values) for field, values in offsets.items()})
+
+    def save(self, directory: Union[str, os.PathLike]) -> Path:
+        path = Path(directory) / INDEX_FILE
+        np.savez(path, **self.lengths)
+        return path
+
+    @classmethod
+    def load(cls, directory: Union[str, os.PathLike]) -> "LengthIndex":
+        with np.load(Path(directory) / INDEX_FILE) as data:
+            return cls({field: data[field] for field in data.files})
+
+    @staticmethod
+    def exists(directory: Union[str, os.PathLike]) -> bool:
+        return (Path(directory) / INDEX_FILE).is_file()
+
+    def mask(
+        self,
+        max_lengths: Optional[Dict[str, int]] = None,
+        min_lengths: Optional[Dict[str, int]] = None,
+    ) -> np.ndarray:
+        """Boolean mask of the examples within the bounds of every field."""
+        keep = np.ones(len(self), dtype=bool)
+        for field, bound in (max_lengths or {}).items():
+            keep &= self.lengths[field] <= bound
+        for field, bound in (min_lengths or {}).items():
+            keep &= self.lengths[field] >= bound
+        return keep
+
+    def select(
+        self,
+        max_lengths: Optional[Dict[str, int]] = None,
+        min_lengths: Optional[Dict[str, int]] = None,
+    ) -> np.ndarray:
+        """Indices of the examples within the bounds of every field."""
+        return np.flatnonzero(self.mask(max_lengths, min_lengths))
+
+    def buckets(
+        self, field: str, boundaries: Sequence[int], indices: Optional[np.ndarray] = None
+    ) -> List[np.ndarray]:
+        """
+        Indices of the examples in each bucket of lengths of `field`: bucket `i` holds the
+        lengths in `(boundaries[i - 1], boundaries[i]]`, the last one those above the last
+        boundary.
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        bucket_ids = np.digitize(self.lengths[field][indices], boundaries, right=True)
+        order = np.argsort(bucket_ids, kind="stable")
+        splits = np.searchsorted(bucket_ids[order], np.arange(1, len(boundaries) + 1))
+        return np.split(indices[order], splits)
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """
+    Batches of examples of similar lengths, to minimize padding.
+
+    The examples are shuffled, then sorted by length within windows of `batch_size *
+    window_batches` examples, cut into batches, and the batches are shuffled.
+
+    Parameters:
+    - lengths: Length of every example (e.g. `index["source"] + index["target"]`).
+    - batch_size: Examples per batch.
+    - indices: Examples to sample from, e.g. `LengthIndex.select(...)`. Defaults to all.
+    - window_batches: Number of batches in a sorting window.
+    - drop_last: Drop the incomplete batches.
+    - seed: Seed of the shuffling, combined with the epoch.
+    """
+
+    def __init__(
+        self,
+        lengths: np.ndarray,
+        batch_size: int,
+        indices: Optional[np.ndarray] = None,
+        window_batches: int = 100,
+        drop_last: bool = False,
+        seed: int = 0,
+    ) -> None:
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.indices = (
+            np.arange(len(self.lengths)) if indices is None else np.asarray(indices)
+        )
+        self.window_batches = window_batches
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _batches(self) -> List[np.ndarray]:
+        rng = np.random.default_rng([self.seed, self.epoch])
+        indices = rng.permutation(self.indices)
+        window = self.batch_size * self.window_batches
+        batches = []
+        for start in range(0, len(indices), window):
+            chunk = indices[start : start + window]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind="stable")]
+            batches.extend(
+                chunk[i : i + self.batch_size]
+                for i in range(0, len(chunk), self.batch_size)
+            )
+        if self.drop_last:
+            batches = [b for b in batches if len(b) == self.batch_size]
+        order = rng.permutation(len(batches))
+        return [batches[i] for i in order]
+
+    def __iter__(self) -> Iterator[List[int]]:
+        for batch in self._batches():
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            window = self.batch_size * self.window_batches
+            full, rest = divmod(len(self.indices), window)
+            return full * self.window_batches + rest // self.batch_size
+        return len(self._batches())
@@ -0,0 +1,234 @@
+"""Pre-tokenized datasets stored as flat memory-mapped token files.
+
+A dataset directory holds, for each field (e.g. `source` and `target`):
+
+- `<field>.tokens`: the token ids of all the examples, concatenated, as
+  `uint16` if the vocabulary fits in it, `uint32` otherwise;
+- `<field>.offsets.npy`: `int64` array of `num_examples + 1` offsets, the
+  tokens of example `i` being `tokens[offsets[i]:offsets[i + 1]]`;
+
+and `meta.json`, written last, which marks the dataset as complete. The
+token counts of the examples are also saved as a `LengthIndex`
+(`lengths.npz`), for vectorized filtering and bucketing. `meta.json` can
+also record a `fingerprint` of the settings the tokens were produced with
+(tokenizer, truncation, filtering...): `is_memmap_dataset` then only
+accepts a dataset built with the same settings.
+
+`MemmapTokenDataset` maps these files instead of reading them: opening a
+dataset is instantaneous and examples are read (zero-copy slices of the
+maps) from the page cache on demand, so the resident memory does not grow
+with the size of the corpus.
+
+    key = fingerprint({"tokenizer": tokenizer.name_or_path, "max_length": 50})
+    if not is_memmap_dataset("data/wmt19_tokenized/train", key):
+        build_memmap_dataset(
+            ({"source": ex["input_ids"], "target": ex["labels"]} for ex in tokenized),
+            "data/wmt19_tokenized/train",
+            vocab_size=len(tokenizer),
+            fingerprint=key,
+        )
+    dataset = MemmapTokenDataset(
+        "data/wmt19_tokenized/train", rename={"source": "input_ids", "target": "labels"}
+    )
+"""
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence, Union
+
+import numpy as np
+from torch.utils.data import Dataset
+
+from .length_index import LengthIndex
+
+META_FILE = "meta.json"
+FORMAT_VERSION = 1
+
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    return np.dtype(np.uint16) if vocab_size <= 2**16 else np.dtype(np.uint32)
+
+
+def fingerprint(settings: Dict[str, Any]) -> str:
+    """Hash of JSON serializable `settings`."""
+    data = json.dumps(settings, sort_keys=True, default=str).encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def is_memmap_dataset(
+    directory: Union[str, os.PathLike], fingerprint: Optional[str] = None
+) -> bool:
+    """Whether `directory` holds a complete dataset, built with `fingerprint` if given."""
+    meta_path = Path(directory) / META_FILE
+    if not meta_path.is_file():
+        return False
+    if fingerprint is None:
+        return True
+    with open(meta_path) as f:
+        return json.load(f).get("fingerprint") == fingerprint
+
+
+class MemmapDatasetBuilder:
+    """
+    Appends tokenized examples to the files of a dataset directory.
+
+    The files are written to `<directory>.tmp` and moved to `directory` by :meth:`finalize`,
+    so an interrupted build never leaves a dataset that looks complete.
+
+    Parameters:
+    - directory: Directory of the dataset.
+    - vocab_size: Size of the vocabulary, which determines the type of the tokens.
+    - fields: Names of the token fields of the examples.
+    - fingerprint: Settings the tokens were produced with, see `fingerprint`.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, os.PathLike],
+        vocab_size: int,
+        fields: Sequence[str] = ("source", "target"),
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        self.directory = Path(directory)
+        self.vocab_size = vocab_size
+        self.fields = list(fields)
+        self.fingerprint = fingerprint
+        self.dtype = token_dtype(vocab_size)
+        self._tmp_directory = self.directory.with_name(self.directory.name + ".tmp")
+        if self._tmp_directory.exists():
+            shutil.rmtree(self._tmp_directory)
+        self._tmp_directory.mkdir(parents=True)
+        self._files = {
+            field: open(self._tmp_directory / f"{field}.tokens", "wb")
+            for field in self.fields
+        }
+        self._offsets = {field: array("q", [0]) for field in self.fields}
+
+    def add(self, example: Dict[str, Sequence[int]]) -> None:
+        for field in self.fields:
+            tokens = np.asarray(example[field])
+            if tokens.size and (tokens.min() < 0 or tokens.max() >= self.vocab_size):
+                raise ValueError(
+                    f"Token ids of '{field}' are out of the vocabulary of size {self.vocab_size}"
+                )
+            self._files[field].write(tokens.astype(self.dtype, copy=False).tobytes())
+            offsets = self._offsets[field]
+            offsets.append(offsets[-1] + tokens.size)
+
+    def finalize(self) -> Path:
+        offsets = {}
+        for field in self.fields:
+            self._files[field].close()
+            offsets[field] = np.frombuffer(self._offsets[field], dtype=np.int64)
+            np.save(self._tmp_directory / f"{field}.offsets.npy", offsets[field])
+        LengthIndex.from_offsets(offsets).save(self._tmp_directory)
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "fields": self.fields,
+            "dtype": self.dtype.name,
+            "vocab_size": self.vocab_size,
+            "num_examples": len(self._offsets[self.fields[0]]) - 1,
+            "fingerprint": self.fingerprint,
+        }
+        with open(self._tmp_directory / META_FILE, "w") as f:
+            json.dump(meta, f, indent=2)
+        if self.directory.exists():
+            shutil.rmtree(self.directory)
+        os.replace(self._tmp_directory, self.directory)
+        return self.directory
+
+
+def build_memmap_dataset(
+    examples: Iterable[Dict[str, Sequence[int]]],
+    directory: Union[str, os.PathLike],
+    vocab_size: int,
+    fields: Sequence[str] = ("source", "target"),
+    fingerprint: Optional[str] = None,
+) -> Path:
+    """Write the tokenized `examples` to `directory`. See `MemmapDatasetBuilder`."""
+    builder = MemmapDatasetBuilder(directory, vocab_size, fields, fingerprint)
+    for example in examples:
+        builder.add(example)
+    return builder.finalize()
+
+
+class MemmapTokenDataset(Dataset):
+    """
+    Dataset of the examples of a directory written by `MemmapDatasetBuilder`.
+
+    Examples are dicts of 1-D numpy arrays, slices of the memory maps.
+
+    Parameters:
+    - directory: Directory of the dataset.
+    - fields: Fields to read. Defaults to all of them.
+    - rename: Keys of the fields in the examples, e.g. `{"source": "input_ids"}`.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, os.PathLike],
+        fields: Optional[Sequence[str]] = None,
+        rename: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.directory = Path(directory)
+        with open(self.directory / META_FILE) as f:
+            self.meta = json.load(f)
+        if self.meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported format version {self.meta['format_version']} in {self.directory}"
+            )
+        self.fields = list(fields) if fields is not None else self.meta["fields"]
+        self.rename = rename or {}
+        self._maps: Optional[Dict[str, Any]] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # workers map the files themselves instead of receiving a copy
+        state = self.__dict__.copy()
+        state["_maps"] = None
+        return state
+
+    def _open(self) -> Dict[str, Any]:
+        if self._maps is None:
+            maps = {}
+            for field in self.fields:
+                tokens_path = self.directory / f"{field}.tokens"
+                # np.memmap does not support empty files
+                tokens = (
+                    np.memmap(tokens_path, dtype=self.meta["dtype"], mode="r")
+                    if tokens_path.stat().st_size
+                    else np.empty(0, dtype=self.meta["dtype"])
+                )
+                offsets = np.load(
+                    self.directory / f"{field}.offsets.npy", mmap_mode="r"
+                )
+                maps[field] = (tokens, offsets)
+            self._maps = maps
+        return self._maps
+
+    def __len__(self) -> int:
+        return self.meta["num_examples"]
+
+    def __getitem__(self, index: int) -> Dict[str, np.ndarray]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} examples")
+        example = {}
+        for field, (tokens, offsets) in self._open().items():
+            example[self.rename.get(field, field)] = tokens[
+                offsets[index] : offsets[index + 1]
+            ]
+        return example
+
+    def lengths(self, field: str) -> np.ndarray:
+        """Number of tokens of `field` in every example."""
+        return np.diff(self._open()[field][1])
+
+    def length_index(self) -> LengthIndex:
+        """Token counts of all the fields, computed from the offsets for older directories."""
+        if LengthIndex.exists(self.directory):
+            return LengthIndex.load(self.directory)
+        return LengthIndex({field: self.lengths(field) for field in self.fields})
@@ -0,0 +1,358 @@
+"""Where the memory of a model goes.
+
+`module_memory` walks the submodules of a model down to `depth` and reports
+the bytes of their parameters, gradients and optimizer states (shared
+parameters are counted once, in the first module that has them).
+
+`ActivationProfiler` hooks the same submodules and measures, for each of
+their forward calls:
+
+- the activations they save for the backward pass, counted exactly with
+  `torch.autograd.graph.saved_tensors_hooks` on any device (parameters are
+  not counted);
+- the bytes of their inputs and outputs, and their duration;
+- their peak memory above what was allocated before the call: from the CUDA
+  allocator on CUDA, and from the growth of the resident set size on CPU.
+  The peak statistics of the CUDA allocator are not reset (other code, e.g.
+  the Trainer, reads them), so a call that stays below an earlier peak
+  reports what it still holds when it returns. `tracemalloc` does not see
+  the tensors, which are not allocated by Python; the RSS only grows when
+  the allocator asks the system for memory. Both kinds of peaks are lower
+  bounds when they are not exact.
+
+    profiler = ActivationProfiler(model, depth=2)
+    with profiler:
+        model(**batch).loss.backward()
+    report = memory_report(model, optimizer, profiler)
+    log_memory_report(report, Path(output_dir) / "memory.json")
+"""
+import io
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Union
+
+import torch
+from torch import nn
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+try:
+    import rich.console
+    import rich.table
+except ImportError:  # pragma: no cover
+    rich = None
+
+logger = logging.getLogger(__name__)
+
+OTHER = "(other)"
+
+
+def log_gpu_memory_metadata() -> None:
+    """Log the name, total and free memory of every visible CUDA device."""
+    if not torch.cuda.is_available():
+        logger.info("No CUDA device available")
+        return
+    for device in range(torch.cuda.device_count()):
+        free, total = torch.cuda.mem_get_info(device)
+        logger.info(
+            f"GPU {device} ({torch.cuda.get_device_name(device)}): "
+            f"{total / 2**30:.1f} GiB total, {free / 2**30:.1f} GiB free"
+        )
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):  # pragma: no cover
+        return 0
+
+
+def _nbytes(tensor: torch.Tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def _modules_at_depth(model: nn.Module, depth: int) -> Dict[str, nn.Module]:
+    """Submodules `depth` levels below `model`, and the leaves above that level."""
+    modules = {}
+    for name, module in model.named_modules():
+        level = 0 if not name else name.count(".") + 1
+        if level == depth or (0 < level < depth and not any(module.children())):
+            modules[name] = module
+    return modules or {"": model}
+
+
+def _owner(name: str, owners: Dict[str, nn.Module]) -> str:
+    for owner in owners:
+        if not owner or name == owner or name.startswith(owner + "."):
+            return owner
+    return OTHER
+
+
+def module_memory(
+    model: nn.Module,
+    optimizer: Optional[torch.optim.Optimizer] = None,
+    depth: int = 1,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Parameters, parameter bytes, gradient bytes and optimizer state bytes of the submodules of
+    `model` at `depth` (and of the parameters directly in the modules above them, as `(other)`).
+    """
+    owners = _modules_at_depth(model, depth)
+    optimizer_state = optimizer.state if optimizer is not None else {}
+    rows: Dict[str, Dict[str, int]] = {}
+    for name, param in model.named_parameters():
+        row = rows.setdefault(
+            _owner(name, owners),
+            {"params": 0, "param_bytes": 0, "grad_bytes": 0, "optimizer_bytes": 0},
+        )
+        row["params"] += param.numel()
+        row["param_bytes"] += _nbytes(param)
+        if param.grad is not None:
+            row["grad_bytes"] += _nbytes(param.grad)
+        row["optimizer_bytes"] += sum(
+            _nbytes(value)
+            for value in optimizer_state.get(param, {}).values()
+            if isinstance(value, torch.Tensor)
+        )
+    return rows
+
+
+class ActivationProfiler:
+    """
+    Context manager measuring the activation memory of the forward calls of the submodules of
+    `model` at `depth`.
+
+    Parameters:
+    - model: The model.
+    - depth: Depth of the profiled submodules, 1 for the children of `model`.
+    - modules: Profile these submodules, by name, instead. They must not be nested.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        depth: int = 1,
+        modules: Optional[Dict[str, nn.Module]] = None,
+    ) -> None:
+        self.model = model
+        self.modules = modules if modules is not None else _modules_at_depth(model, depth)
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._current: Optional[str] = None
+        self._start = 0
+        self._start_peak = 0
+        self._start_time = 0.0
+        self._seen: Set[int] = set()
+        self._param_storages: Set[int] = set()
+        self._handles: List[Any] = []
+        self._saved_tensors_hooks: Optional[Any] = None
+
+    def _memory(self, device: torch.device) -> int:
+        if device.type == "cuda":
+            return torch.cuda.memory_allocated(device)
+        return rss_bytes()
+
+    def _device(self, module: nn.Module) -> torch.device:
+        for tensor in module.parameters():
+            return tensor.device
+        for tensor in module.buffers():
+            return tensor.device
+        return torch.device("cpu")
+
+    def _stat(self, name: str) -> Dict[str, int]:
+        return self.stats.setdefault(
+            name,
+            {
+                "calls": 0,
+                "saved_bytes": 0,
+                "peak_bytes": 0,
+                "input_bytes": 0,
+                "output_bytes": 0,
+                "forward_seconds": 0.0,
+            },
+        )
+
+    def _pre_hook(
+        self, name: str, module: nn.Module, args: Any, kwargs: Dict[str, Any]
+    ) -> None:
+        self._current = name
+        device = self._device(module)
+        inputs: List[torch.Tensor] = []
+        # HF blocks get their masks and position biases as keyword arguments
+        _collect_tensors((args, kwargs), inputs)
+        self._stat(name)["input_bytes"] += sum(_nbytes(t) for t in inputs)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            self._start_peak = torch.cuda.max_memory_allocated(device)
+        self._start = self._memory(device)
+        self._start_time = time.perf_counter()
+
+    def _post_hook(self, name: str, module: nn.Module, output: Any) -> None:
+        device = self._device(module)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+            peak = torch.cuda.max_memory_allocated(device)
+            if peak <= self._start_peak:
+                # the peak of this call is below an earlier one
+                peak = torch.cuda.memory_allocated(device)
+            peak -= self._start
+        else:
+            peak = rss_bytes() - self._start
+        stat = self._stat(name)
+        stat["forward_seconds"] += time.perf_counter() - self._start_time
+        stat["calls"] += 1
+        stat["peak_bytes"] = max(stat["peak_bytes"], peak)
+        outputs: List[torch.Tensor] = []
+        _collect_tensors(output, outputs)
+        stat["output_bytes"] += sum(_nbytes(t) for t in outputs)
+        self._current = None
+
+    def _pack(self, tensor: torch.Tensor) -> torch.Tensor:
+        storage = tensor.untyped_storage()
+        key = storage.data_ptr()
+        if key not in self._seen and key not in self._param_storages:
+            self._seen.add(key)
+            self._stat(self._current or OTHER)["saved_bytes"] += storage.nbytes()
+        return tensor
+
+    def __enter__(self) -> "ActivationProfiler":
+        self._seen.clear()
+        self._param_storages = {
+            p.untyped_storage().data_ptr() for p in self.model.parameters()
+        }
+        for name, module in self.modules.items():
+            self._handles.append(
+                module.register_forward_pre_hook(
+                    lambda module, args, kwargs, name=name: self._pre_hook(
+                        name, module, args, kwargs
+                    ),
+                    with_kwargs=True,
+                )
+            )
+            self._handles.append(
+                module.register_forward_hook(
+                    lambda module, args, output, name=name: self._post_hook(
+                        name, module, output
+                    )
+                )
+            )
+        self._saved_tensors_hooks = torch.autograd.graph.saved_tensors_hooks(
+            self._pack, lambda tensor: tensor
+        )
+        self._saved_tensors_hooks.__enter__()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._saved_tensors_hooks.__exit__(*exc_info)
+        for handle in self._handles:
+            handle.remove()
+        self._handles.clear()
+
+
+def _collect_tensors(obj: Any, tensors: List[torch.Tensor]) -> None:
+    if isinstance(obj, torch.Tensor):
+        tensors.append(obj)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            _collect_tensors(value, tensors)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            _collect_tensors(value, tensors)
+
+
+def memory_report(
+    model: nn.Module,
+    optimizer: Optional[torch.optim.Optimizer] = None,
+    profiler: Optional[ActivationProfiler] = None,
+    depth: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Per-submodule memory of `model` (see `module_memory`) merged with the activation
+    statistics of `profiler`, whose depth is used by default, and their totals.
+    """
+    if depth is None:
+        depth = 1 if profiler is None else _depth_of(profiler)
+    rows = module_memory(model, optimizer, depth)
+    if profiler is not None:
+        for name, stat in profiler.stats.items():
+            rows.setdefault(name, {}).update(stat)
+    columns = sorted({key for row in rows.values() for key in row})
+    totals = {
+        column: sum(row.get(column, 0) for row in rows.values())
+        for column in columns
+        if column not in ("calls", "peak_bytes", "forward_seconds")
+    }
+    report: Dict[str, Any] = {"modules": rows, "total": totals}
+    if torch.cuda.is_available():
+        report["cuda_max_allocated_bytes"] = torch.cuda.max_memory_allocated()
+    report["rss_bytes"] = rss_bytes()
+    return report
+
+
+def _depth_of(profiler: ActivationProfiler) -> int:
+    return max(
+        (0 if not name else name.count(".") + 1 for name in profiler.modules), default=1
+    )
+
+
+def _format_bytes(value: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(value) < 1024 or unit == "GiB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return str(value)  # pragma: no cover
+
+
+def format_memory_table(report: Dict[str, Any]) -> str:
+    """The report as a rich table (plain text when rich is not installed)."""
+    columns = [
+        "params",
+        "param_bytes",
+        "grad_bytes",
+        "optimizer_bytes",
+        "saved_bytes",
+        "peak_bytes",
+    ]
+    rows = [(name or "(model)", row) for name, row in report["modules"].items()]
+    rows.append(("total", report["total"]))
+
+    def cell(column: str, row: Dict[str, int]) -> str:
+        if column not in row:
+            return "-"
+        if column == "params":
+            return f"{row[column]:,}"
+        return _format_bytes(row[column])
+
+    if rich is None:
+        lines = ["\t".join(["module"] + columns)]
+        lines += ["\t".join([name] + [cell(c, row) for c in columns]) for name, row in rows]
+        return "\n".join(lines)
+    table = rich.table.Table(title="Memory")
+    table.add_column("module")
+    for column in columns:
+        table.add_column(column, justify="right")
+    for name, row in rows:
+        table.add_row(name, *(cell(column, row) for column in columns))
+    console = rich.console.Console(file=io.StringIO(), record=True, width=140)
+    console.print(table)
+    return console.export_text()
+
+
+def log_memory_report(
+    report: Dict[str, Any], json_path: Optional[Union[str, os.PathLike]] = None
+) -> None:
+    """Log the report as a table, and write it to `json_path` as JSON."""
+    logger.info("\n" + format_memory_table(report))
+    if json_path is not None:
+        Path(json_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,197 @@
+import atexit
+import logging
+import os
+import queue
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional, Sequence, Tuple, Union
+
+# Same order as lightning's rank detection
+_RANK_ENV_VARS = ("RANK", "LOCAL_RANK", "SLURM_PROCID", "JSM_NAMESPACE_RANK")
+
+DEFAULT_FORMAT = "%(asctime)s - %(levelname)s - [rank: %(rank)s] %(name)s - %(message)s"
+
+
+def get_rank() -> int:
+    for key in _RANK_ENV_VARS:
+        rank = os.environ.get(key)
+        if rank is not None:
+            return int(rank)
+    return 0
+
+
+class RankZeroLoggerAdapter(logging.LoggerAdapter):
+    """Logs through `logger` on rank zero only. The logger itself is left untouched."""
+
+    def __init__(self, logger: logging.Logger) -> None:
+        super().__init__(logger, {})
+
+    def isEnabledFor(self, level: int) -> bool:
+        from .rank_zero import rank_zero_only
+
+        rank = getattr(rank_zero_only, "rank", None)
+        return (get_rank() if rank is None else rank) == 0 and super().isEnabledFor(level)
+
+
+def get_pylogger(
+    name: str = __name__, rank_zero_only: bool = False
+) -> Union[logging.Logger, logging.LoggerAdapter]:
+    """Returns a logger. With `rank_zero_only`, an adapter that only logs on rank zero."""
+    logger = logging.getLogger(name)
+    if rank_zero_only:
+        return RankZeroLoggerAdapter(logger)
+    return logger
+
+
+class RankFilter(logging.Filter):
+    """
+    Tags records with the rank of the process and thins out the logs of non-zero ranks.
+
+    Meant to be attached to the `QueueHandler`, so that dropped records cost nothing beyond
+    this check and are never enqueued.
+
+    Parameters:
+    - rank: Rank of the process.
+    - prefix_rank: Whether to prefix messages with the rank, for handlers whose format does not
+        use `%(rank)s`.
+    - debug_every: On non-zero ranks, keep one debug record out of `debug_every`. `None` drops
+        them all.
+    - aggregate_warnings: On non-zero ranks, only the first occurrence of each warning is
+        logged. The repeats are counted and reported by :meth:`summary`.
+    """
+
+    def __init__(
+        self,
+        rank: int,
+        prefix_rank: bool = False,
+        debug_every: Optional[int] = None,
+        aggregate_warnings: bool = True,
+    ) -> None:
+        super().__init__()
+        self.rank = rank
+        self.prefix_rank = prefix_rank
+        self.debug_every = debug_every
+        self.aggregate_warnings = aggregate_warnings
+        self._num_debug = 0
+        self.warning_counts: Counter = Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.rank = self.rank
+        if self.rank != 0:
+            if record.levelno <= logging.DEBUG:
+                self._num_debug += 1
+                if self.debug_every is None or (
+                    (self._num_debug - 1) % self.debug_every != 0
+                ):
+                    return False
+            elif record.levelno == logging.WARNING and self.aggregate_warnings:
+                # group by call site and template, not by the formatted message
+                key = (record.name, str(record.msg))
+                self.warning_counts[key] += 1
+                if self.warning_counts[key] > 1:
+                    return False
+        if self.prefix_rank:
+            record.msg = f"[rank: {self.rank}] {record.msg}"
+        return True
+
+    def summary(self) -> List[str]:
+        """One line per warning that was repeated on this rank."""
+        return [
+            f"[rank: {self.rank}] {name}: {count - 1} more warning(s) like {msg!r}"
+            for (name, msg), count in self.warning_counts.most_common()
+            if count > 1
+        ]
+
+
+_queue_logging: Optional[Tuple[QueueHandler, QueueListener, RankFilter]] = None
+# process that started the listener: forked processes inherit the state, not the thread
+_queue_logging_pid: Optional[int] = None
+
+
+def setup_queue_logging(
+    level: Optional[int] = None,
+    rank: Optional[int] = None,
+    handlers: Optional[Sequence[logging.Handler]] = None,
+    debug_every: Optional[int] = None,
+    aggregate_warnings: bool = True,
+) -> Tuple[QueueListener, RankFilter]:
+    """
+    Move the log I/O of the root logger off the calling thread.
+
+    The root logger gets a single `QueueHandler`; the actual handlers are run by a
+    `QueueListener` thread, so slow writes (e.g. to a shared filesystem) do not stall the
+    training loop. Call it after the logging configuration (e.g. `logging.basicConfig` or the
+    one done by hydra) to keep the configured handlers.
+
+    Calling it again returns the current listener, unless the root logger was reconfigured
+    since (or `handlers` are given): the previous listener is then stopped and replaced.
+
+    Args:
+        level: Level of the root logger. Unchanged if `None`.
+        rank: Rank of the process. Read from the environment if `None`.
+        handlers: Handlers to run in the listener thread. Defaults to the current handlers of
+            the root logger, or a stream handler using `DEFAULT_FORMAT` if there are none.
+        debug_every: See `RankFilter`.
+        aggregate_warnings: See `RankFilter`.
+
+    Returns:
+        The started listener and the filter. The listener is stopped, and the summary of the
+        aggregated warnings logged, at exit.
+    """
+    global _queue_logging, _queue_logging_pid
+    root = logging.getLogger()
+    if level is not None:
+        root.setLevel(level)
+    if _queue_logging is not None:
+        queue_handler, listener, rank_filter = _queue_logging
+        if handlers is None and all(h is queue_handler for h in root.handlers):
+            if not root.handlers:
+                root.addHandler(queue_handler)
+            return listener, rank_filter
+        # reconfigured since: run the new handlers instead
+        root.removeHandler(queue_handler)
+        if _queue_logging_pid == os.getpid():
+            listener.stop()
+    rank = get_rank() if rank is None else rank
+    own_handlers = handlers is None and not root.handlers
+    if handlers is None:
+        handlers = list(root.handlers)
+    if not handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(DEFAULT_FORMAT))
+        handlers = [handler]
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    rank_filter = RankFilter(
+        rank,
+        prefix_rank=not own_handlers and int(os.environ.get("WORLD_SIZE", 1)) > 1,
+        debug_every=debug_every,
+        aggregate_warnings=aggregate_warnings,
+    )
+    queue_handler.addFilter(rank_filter)
+    root.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if _queue_logging_pid is None:
+        atexit.register(stop_queue_logging)
+    _queue_logging = (queue_handler, listener, rank_filter)
+    _queue_logging_pid = os.getpid()
+    return listener, rank_filter
+
+
+def stop_queue_logging() -> None:
+    """
+    Log the summary of the aggregated warnings and stop the listener of `setup_queue_logging`,
+    if this process started one. Done at exit; call it before `os._exit`.
+    """
+    global _queue_logging
+    if _queue_logging is None or _queue_logging_pid != os.getpid():
+        return
+    _, listener, rank_filter = _queue_logging
+    for line in rank_filter.summary():
+        logging.getLogger(__name__).warning(line)
+    listener.stop()
+    _queue_logging = None
@@ -0,0 +1,171 @@
+"""Rate-limited and deduplicated emission of recurring messages.
+
+Hot loops tend to emit the same warning (or metric line) at every step,
+which floods the logs and, on shared filesystems, slows training down.
+`EmissionLimiter` decides cheaply whether an occurrence should be emitted
+and counts the ones that were suppressed, so that the next emitted message
+can report them.
+
+Example:
+
+    log_every_n_seconds(logger, logging.WARNING, 60, "Data loader is slow: %.2fs", wait)
+    warn_once(logger, "Metric %s is NaN", name, key=("nan", name))
+"""
+import logging
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class EmissionLimiter:
+    """
+    Decides whether an occurrence of a recurring message should be emitted.
+
+    Occurrences are grouped by `key`. An occurrence is emitted if any of the
+    enabled policies allows it; with no policy enabled everything is emitted.
+    The check is a dict lookup and a comparison, so it is cheap enough to be
+    called at every step. It is not locked: concurrent callers can at worst
+    miscount suppressed occurrences.
+
+    Parameters:
+    - once: Emit only the first occurrence of each key.
+    - every_n_seconds: Emit at most once every `every_n_seconds` seconds per key.
+    - every_n_steps: Emit at most once every `every_n_steps` steps per key. Requires `step`
+        to be passed to :meth:`should_emit`.
+    - clock: Time source, in seconds.
+    """
+
+    def __init__(
+        self,
+        once: bool = False,
+        every_n_seconds: Optional[float] = None,
+        every_n_steps: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if once and (every_n_seconds is not None or every_n_steps is not None):
+            raise ValueError(
+                "'once' cannot be combined with 'every_n_seconds' or 'every_n_steps'"
+            )
+        self.once = once
+        self.every_n_seconds = every_n_seconds
+        self.every_n_steps = every_n_steps
+        self._clock = clock
+        # key -> [last emission time, last emission step, suppressed since last emission]
+        self._state: Dict[Hashable, list] = {}
+
+    def should_emit(self, key: Hashable = None, step: Optional[int] = None) -> bool:
+        state = self._state.get(key)
+        if state is None:
+            self._state[key] = [self._clock(), step, 0]
+            return True
+        if self.once:
+            state[2] += 1
+            return False
+        emit = self.every_n_seconds is None and self.every_n_steps is None
+        now = None
+        if self.every_n_seconds is not None:
+            now = self._clock()
+            emit = emit or now - state[0] >= self.every_n_seconds
+        if self.every_n_steps is not None:
+            if step is None:
+                raise ValueError("'step' is required with 'every_n_steps'")
+            emit = emit or state[1] is None or step - state[1] >= self.every_n_steps
+        if not emit:
+            state[2] += 1
+            return False
+        state[0] = now if now is not None else self._clock()
+        state[1] = step
+        return True
+
+    def pop_suppressed(self, key: Hashable = None) -> int:
+        """Number of occurrences suppressed since the last emission of `key`, and reset it."""
+        state = self._state.get(key)
+        if state is None:
+            return 0
+        suppressed, state[2] = state[2], 0
+        return suppressed
+
+    def suppressed(self, key: Hashable = None) -> int:
+        state = self._state.get(key)
+        return 0 if state is None else state[2]
+
+    def reset(self) -> None:
+        self._state.clear()
+
+
+# One limiter per policy, shared by all the call sites of the helpers below
+_LIMITERS: Dict[Tuple, EmissionLimiter] = {}
+
+
+def _get_limiter(
+    once: bool = False,
+    every_n_seconds: Optional[float] = None,
+    every_n_steps: Optional[int] = None,
+) -> EmissionLimiter:
+    policy = (once, every_n_seconds, every_n_steps)
+    limiter = _LIMITERS.get(policy)
+    if limiter is None:
+        limiter = _LIMITERS[policy] = EmissionLimiter(*policy)
+    return limiter
+
+
+def log_limited(
+    logger: logging.Logger,
+    level: int,
+    msg: str,
+    *args: Any,
+    key: Hashable = None,
+    step: Optional[int] = None,
+    once: bool = False,
+    every_n_seconds: Optional[float] = None,
+    every_n_steps: Optional[int] = None,
+) -> bool:
+    """
+    Log `msg % args` if the policy allows it, mentioning how many occurrences were suppressed.
+
+    Occurrences are grouped by `key`, which defaults to the (unformatted) `msg`, so messages
+    are never formatted when suppressed. Returns whether the message was logged.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    if key is None:
+        key = msg
+    limiter = _get_limiter(once, every_n_seconds, every_n_steps)
+    key = (logger.name, key)
+    if not limiter.should_emit(key, step=step):
+        return False
+    suppressed = limiter.pop_suppressed(key)
+    if suppressed:
+        msg = f"{msg} (suppressed {suppressed} similar message(s))"
+    logger.log(level, msg, *args)
+    return True
+
+
+def warn_once(
+    logger: logging.Logger, msg: str, *args: Any, key: Hashable = None
+) -> bool:
+    return log_limited(logger, logging.WARNING, msg, *args, key=key, once=True)
+
+
+def log_every_n_seconds(
+    logger: logging.Logger,
+    level: int,
+    n: float,
+    msg: str,
+    *args: Any,
+    key: Hashable = None,
+) -> bool:
+    return log_limited(logger, level, msg, *args, key=key, every_n_seconds=n)
+
+
+def log_every_n_steps(
+    logger: logging.Logger,
+    level: int,
+    n: int,
+    step: int,
+    msg: str,
+    *args: Any,
+    key: Hashable = None,
+) -> bool:
+    return log_limited(
+        logger, level, msg, *args, key=key, step=step, every_n_steps=n
+    )
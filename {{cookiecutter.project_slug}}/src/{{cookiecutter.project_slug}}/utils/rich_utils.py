@@ -1,19 +1,66 @@
 {% if cookiecutter.command_line_interface == "hydra" %}
 import logging
+import textwrap
 from pathlib import Path
-from typing import Sequence
+from typing import Any, Optional, Sequence
 
 import rich
+import rich.console
 import rich.syntax
 import rich.tree
 from hydra.core.hydra_config import HydraConfig
-from omegaconf import DictConfig, OmegaConf, open_dict
+from omegaconf import DictConfig, ListConfig, OmegaConf, open_dict
 from .rank_zero import rank_zero_only
 from rich.prompt import Prompt
 
 logging= logging.getLogger(__name__)
 
 
+def _truncate(
+    value: Any, max_list_items: Optional[int], max_str_len: Optional[int]
+) -> Any:
+    """Collapse long lists and long strings (e.g. embedded data) in a config container."""
+    if isinstance(value, dict):
+        return {
+            k: _truncate(v, max_list_items, max_str_len)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        items = [
+            _truncate(v, max_list_items, max_str_len)
+            for v in value[:max_list_items]
+        ]
+        if max_list_items is not None and len(value) > max_list_items:
+            items.append(f"... ({len(value) - max_list_items} more items)")
+        return items
+    if (
+        isinstance(value, str)
+        and max_str_len is not None
+        and len(value) > max_str_len
+    ):
+        return f"{value[:max_str_len]}... ({len(value)} chars)"
+    return value
+
+
+def config_group_to_yaml(
+    config_group: Any,
+    resolve: bool = False,
+    max_list_items: Optional[int] = None,
+    max_str_len: Optional[int] = None,
+) -> str:
+    """YAML of one config group, with large leaves collapsed if limits are given."""
+    if not isinstance(config_group, (DictConfig, ListConfig)):
+        return str(config_group)
+    if max_list_items is None and max_str_len is None:
+        return OmegaConf.to_yaml(config_group, resolve=resolve)
+    container = _truncate(
+        OmegaConf.to_container(config_group, resolve=resolve),
+        max_list_items,
+        max_str_len,
+    )
+    return OmegaConf.to_yaml(OmegaConf.create(container))
+
+
 @rank_zero_only
 def print_config_tree(
     cfg: DictConfig,
@@ -28,9 +75,16 @@ def print_config_tree(
     ),
     resolve: bool = False,
     save_to_file: bool = False,
+    max_list_items: Optional[int] = None,
+    max_str_len: Optional[int] = None,
+    interactive_only: bool = False,
 ) -> None:
     """Prints content of DictConfig using Rich library and its tree structure.
 
+    The YAML of each config group is computed once and the tree is rendered
+    once; the same rendering is written to the file when `save_to_file` is
+    set.
+
     Args:
         cfg (DictConfig): Configuration composed by Hydra.
         print_order (Sequence[str], optional): Determines in what order config
@@ -39,10 +93,13 @@ def print_config_tree(
             DictConfig.
         save_to_file (bool, optional): Whether to export config to the hydra
             output folder.
+        max_list_items (int, optional): Lists longer than this are collapsed
+            to their first `max_list_items` items.
+        max_str_len (int, optional): Strings longer than this are truncated.
+        interactive_only (bool, optional): Skip the rich rendering when stdout
+            is not a terminal (e.g. batch jobs). The file, if requested, then
+            gets the plain YAML.
     """
-    style = "dim"
-    tree = rich.tree.Tree("CONFIG", style=style, guide_style=style)
-
     queue = []
 
     # add fields from `print_order` to queue
@@ -50,7 +107,7 @@ def print_config_tree(
         (
             queue.append(field)
             if field in cfg
-            else log.warning(
+            else logging.warning(
                 f"Field '{field}' not found in config. Skipping '{field}' config printing..."
             )
         )
@@ -60,25 +117,40 @@ def print_config_tree(
         if field not in queue:
             queue.append(field)
 
-    # generate config tree from queue
-    for field in queue:
+    # convert each config group to yaml only once
+    contents = [
+        (
+            field,
+            config_group_to_yaml(
+                cfg[field],
+                resolve=resolve,
+                max_list_items=max_list_items,
+                max_str_len=max_str_len,
+            ),
+        )
+        for field in queue
+    ]
+    console = rich.console.Console(record=save_to_file)
+    if interactive_only and not console.is_terminal:
+        if save_to_file:
+            with open(Path(cfg.paths.output_dir, "config_tree.log"), "w") as file:
+                for field, content in contents:
+                    file.write(f"{field}:\n{textwrap.indent(content, '  ')}\n")
+        return
+
+    # generate config tree
+    style = "dim"
+    tree = rich.tree.Tree("CONFIG", style=style, guide_style=style)
+    for field, content in contents:
         branch = tree.add(field, style=style, guide_style=style)
-
-        config_group = cfg[field]
-        if isinstance(config_group, DictConfig):
-            branch_content = OmegaConf.to_yaml(config_group, resolve=resolve)
-        else:
-            branch_content = str(config_group)
-
-        branch.add(rich.syntax.Syntax(branch_content, "yaml"))
+        branch.add(rich.syntax.Syntax(content, "yaml"))
 
     # print config tree
-    rich.print(tree)
+    console.print(tree)
 
-    # save config tree to file
+    # save the recorded rendering instead of rendering the tree again
     if save_to_file:
-        with open(Path(cfg.paths.output_dir, "config_tree.log"), "w") as file:
-            rich.print(tree, file=file)
+        console.save_text(str(Path(cfg.paths.output_dir, "config_tree.log")))
 
 
 @rank_zero_only
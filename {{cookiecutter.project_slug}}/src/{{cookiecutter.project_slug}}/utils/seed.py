@@ -3,7 +3,7 @@ import os
 import random
 from random import getstate as python_get_rng_state
 from random import setstate as python_set_rng_state
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence
 import numpy as np
 import torch
 
@@ -79,7 +79,7 @@ def reset_seed() -> None:
 
 
 def pl_worker_init_function(
-    worker_id: int, rank: Optional[int] = None
+    worker_id: int, rank: Optional[int] = None, base_seed: Optional[int] = None
 ) -> None:  # pragma: no cover
     r"""The worker_init_fn that Lightning automatically adds to your dataloader if you previously set the seed with
     ``seed_everything(seed, workers=True)``.
@@ -87,30 +87,93 @@ def pl_worker_init_function(
     See also the PyTorch documentation on
     `randomness in DataLoaders <https://pytorch.org/docs/stable/notes/randomness.html#dataloader>`_.
 
+    Args:
+        worker_id: Id of the DataLoader worker being initialized.
+        rank: Global rank of the process. Defaults to ``rank_zero_only.rank``.
+        base_seed: Base seed of the DataLoader iterator. If ``None``, it is backed out of
+            :func:`torch.initial_seed`. Pass the ``base_seed`` stored by
+            :func:`collect_worker_rng_states` (e.g. through :func:`functools.partial`) to
+            reproduce the worker-level randomness of a previous run.
+
     """
     # implementation notes: https://github.com/pytorch/pytorch/issues/5059#issuecomment-817392562
     global_rank = rank if rank is not None else rank_zero_only.rank
-    process_seed = torch.initial_seed()
-    # back out the base seed so we can use all the bits
-    base_seed = process_seed - worker_id
+    if base_seed is None:
+        process_seed = torch.initial_seed()
+        # back out the base seed so we can use all the bits
+        base_seed = process_seed - worker_id
     log.debug(
         f"Initializing random number generators of process {global_rank} worker {worker_id} with base seed {base_seed}"
     )
-    ss = np.random.SeedSequence([base_seed, worker_id, global_rank])
-    # use 128 bits (4 x 32-bit words)
-    np.random.seed(ss.generate_state(4))
-    # Spawn distinct SeedSequences for the PyTorch PRNG and the stdlib random module
-    torch_ss, stdlib_ss = ss.spawn(2)
-    torch.manual_seed(torch_ss.generate_state(1, dtype=np.uint64)[0])
+    seeds = _derive_worker_seeds(base_seed, [worker_id], global_rank)
+    np.random.seed(seeds["numpy"][0])
+    torch.manual_seed(int(seeds["torch"][0]))
     # use 128 bits expressed as an integer
-    stdlib_seed = (
-        stdlib_ss.generate_state(2, dtype=np.uint64).astype(object) * [1 << 64, 1]
-    ).sum()
-    random.seed(stdlib_seed)
+    high, low = (int(word) for word in seeds["python"][0])
+    random.seed((high << 64) + low)
+
+
+def _derive_worker_seeds(
+    base_seed: int, worker_ids: Sequence[int], rank: int
+) -> Dict[str, np.ndarray]:
+    r"""Derive the seeds that :func:`pl_worker_init_function` uses for a batch of workers.
+
+    The seeds of all the workers are returned together as arrays with a leading worker dimension:
+    ``numpy`` (128 bits as 4 ``uint32`` words), ``torch`` (one ``uint64``) and ``python``
+    (128 bits as 2 ``uint64`` words, most significant first).
+    """
+    num_workers = len(worker_ids)
+    seeds = {
+        "numpy": np.empty((num_workers, 4), dtype=np.uint32),
+        "torch": np.empty((num_workers,), dtype=np.uint64),
+        "python": np.empty((num_workers, 2), dtype=np.uint64),
+    }
+    for i, worker_id in enumerate(worker_ids):
+        ss = np.random.SeedSequence([base_seed, worker_id, rank])
+        # use 128 bits (4 x 32-bit words)
+        seeds["numpy"][i] = ss.generate_state(4)
+        # Spawn distinct SeedSequences for the PyTorch PRNG and the stdlib random module
+        torch_ss, stdlib_ss = ss.spawn(2)
+        seeds["torch"][i] = torch_ss.generate_state(1, dtype=np.uint64)[0]
+        seeds["python"][i] = stdlib_ss.generate_state(2, dtype=np.uint64)
+    return seeds
+
+
+def collect_worker_rng_states(
+    base_seed: int, num_workers: int, rank: Optional[int] = None
+) -> Dict[str, Any]:
+    r"""Collect the seeds of all the DataLoader workers of this process in one structure.
 
+    Workers are (re)seeded by :func:`pl_worker_init_function` every time a DataLoader iterator is
+    created, so their random state is fully determined by the ``base_seed`` of the iterator
+    (``iterator._base_seed`` for :class:`torch.utils.data.DataLoader`), the worker id and the rank.
+    Storing this structure in a checkpoint is enough to reproduce the worker-level randomness of
+    the run on resume.
 
-def _collect_rng_states(include_cuda: bool = True) -> Dict[str, Any]:
-    r"""Collect the global random state of :mod:`torch`, :mod:`torch.cuda`, :mod:`numpy` and Python."""
+    Args:
+        base_seed: Base seed of the DataLoader iterator.
+        num_workers: Number of DataLoader workers.
+        rank: Global rank of the process. Defaults to ``rank_zero_only.rank``.
+
+    Returns:
+        A dict with the ``base_seed``, the ``rank`` and the seeds of every worker, see
+        :func:`_derive_worker_seeds`.
+    """
+    global_rank = rank if rank is not None else rank_zero_only.rank
+    return {
+        "base_seed": base_seed,
+        "rank": global_rank,
+        **_derive_worker_seeds(base_seed, range(num_workers), global_rank),
+    }
+
+
+def _collect_rng_states(
+    include_cuda: bool = True, packed: bool = False
+) -> Dict[str, Any]:
+    r"""Collect the global random state of :mod:`torch`, :mod:`torch.cuda`, :mod:`numpy` and Python.
+
+    If ``packed`` is ``True``, the states are returned in the compact format of :func:`pack_rng_states`.
+    """
     states = {
         "torch": torch.get_rng_state(),
         "numpy": np.random.get_state(),
@@ -120,12 +183,20 @@ def _collect_rng_states(include_cuda: bool = True) -> Dict[str, Any]:
         states["torch.cuda"] = (
             torch.cuda.get_rng_state_all() if torch.cuda.is_available() else []
         )
+    if packed:
+        return pack_rng_states(states)
     return states
 
 
 def _set_rng_states(rng_state_dict: Dict[str, Any]) -> None:
     r"""Set the global random state of :mod:`torch`, :mod:`torch.cuda`, :mod:`numpy` and Python in the current
-    process."""
+    process.
+
+    Both the format returned by :func:`_collect_rng_states` and the packed format of
+    :func:`pack_rng_states` are accepted.
+    """
+    if "format_version" in rng_state_dict:
+        rng_state_dict = unpack_rng_states(rng_state_dict)
     torch.set_rng_state(rng_state_dict["torch"])
     # torch.cuda rng_state is only included since v1.8.
     if "torch.cuda" in rng_state_dict:
@@ -133,3 +204,71 @@ def _set_rng_states(rng_state_dict: Dict[str, Any]) -> None:
     np.random.set_state(rng_state_dict["numpy"])
     version, state, gauss = rng_state_dict["python"]
     python_set_rng_state((version, tuple(state), gauss))
+
+
+RNG_STATE_FORMAT_VERSION = 1
+
+
+def pack_rng_states(rng_state_dict: Dict[str, Any]) -> Dict[str, Any]:
+    r"""Pack the random states returned by :func:`_collect_rng_states` into flat arrays.
+
+    The Mersenne Twister states of Python and NumPy (624 words plus the position) are stored as
+    ``uint32`` arrays of 625 elements instead of tuples of Python ints, the cached gaussians are
+    stored together in one ``float64`` array and the per-device CUDA states are stacked into a
+    single tensor. Use :func:`unpack_rng_states` to get back the original format.
+    """
+    _, python_state, python_gauss = rng_state_dict["python"]
+    _, numpy_keys, numpy_pos, numpy_has_gauss, numpy_gauss = rng_state_dict[
+        "numpy"
+    ]
+    packed = {
+        "format_version": RNG_STATE_FORMAT_VERSION,
+        "torch": rng_state_dict["torch"],
+        "numpy": np.append(numpy_keys, numpy_pos).astype(np.uint32),
+        "python": np.asarray(python_state, dtype=np.uint32),
+        # python gauss_next (nan if unset), numpy has_gauss, numpy cached_gaussian
+        "gauss": np.array(
+            [
+                np.nan if python_gauss is None else python_gauss,
+                numpy_has_gauss,
+                numpy_gauss,
+            ],
+            dtype=np.float64,
+        ),
+    }
+    if "torch.cuda" in rng_state_dict:
+        cuda_states: List[torch.Tensor] = list(rng_state_dict["torch.cuda"])
+        packed["torch.cuda"] = (
+            torch.stack(cuda_states)
+            if cuda_states
+            else torch.empty((0, 0), dtype=torch.uint8)
+        )
+    return packed
+
+
+def unpack_rng_states(packed: Dict[str, Any]) -> Dict[str, Any]:
+    r"""Inverse of :func:`pack_rng_states`."""
+    if packed["format_version"] != RNG_STATE_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported RNG state format version {packed['format_version']}"
+        )
+    python_gauss, numpy_has_gauss, numpy_gauss = packed["gauss"].tolist()
+    numpy_state = packed["numpy"]
+    states = {
+        "torch": packed["torch"],
+        "numpy": (
+            "MT19937",
+            numpy_state[:-1],
+            int(numpy_state[-1]),
+            int(numpy_has_gauss),
+            numpy_gauss,
+        ),
+        "python": (
+            random.Random.VERSION,
+            tuple(packed["python"].tolist()),
+            None if np.isnan(python_gauss) else python_gauss,
+        ),
+    }
+    if "torch.cuda" in packed:
+        states["torch.cuda"] = list(packed["torch.cuda"].unbind(0))
+    return states
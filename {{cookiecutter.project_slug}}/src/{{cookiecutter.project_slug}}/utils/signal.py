@@ -1,8 +1,18 @@
-import signal
 import logging
+import os
+import signal
+import subprocess
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Sequence
+
+if TYPE_CHECKING:
+    from .training import CheckpointState, Checkpointer
 
 logger = logging.getLogger(__name__)
 
+# SLURM sends SIGTERM on preemption, and SIGUSR1 when asked to with `--signal=USR1@<seconds>`
+PREEMPTION_SIGNALS = (signal.SIGTERM, signal.SIGUSR1)
+
 
 def print_signal_handlers(prefix: str = ""):
     """Just print information about existing handlers for SIGTERM, SIGINT, SIGCONT, USR1 and USR2 signals."""
@@ -24,6 +34,149 @@ def remove_handlers(signals, prefix: str = ""):
         signal.signal(sig, signal.SIG_DFL)
 
 
+def was_requeued() -> bool:
+    """Whether this is a requeued run of a SLURM job, which should resume the previous run."""
+    return int(os.environ.get("SLURM_RESTART_COUNT", 0)) > 0
+
+
+def requeue_slurm_job() -> bool:
+    """Requeue the current SLURM job. Returns False if not running under SLURM or if it failed."""
+    job_id = os.environ.get("SLURM_ARRAY_JOB_ID")
+    if job_id is not None:
+        job_id = f"{job_id}_{os.environ['SLURM_ARRAY_TASK_ID']}"
+    else:
+        job_id = os.environ.get("SLURM_JOB_ID")
+    if job_id is None:
+        logger.warning("Not running under SLURM. Not requeuing.")
+        return False
+    try:
+        result = subprocess.run(
+            ["scontrol", "requeue", job_id], capture_output=True, text=True
+        )
+    except OSError as e:  # e.g. no scontrol on this node
+        logger.error(f"Requeuing job {job_id} failed: {e}")
+        return False
+    if result.returncode != 0:
+        logger.error(f"Requeuing job {job_id} failed: {result.stderr.strip()}")
+        return False
+    logger.warning(f"Requeued job {job_id}")
+    return True
+
+
+class PreemptionHandler:
+    """
+    Turns preemption signals into a flag that the training loop checks at step boundaries.
+
+    The signal handler itself only records the signal, which is safe to do at any point of
+    the step. The expensive work (saving, requeuing) is done by
+    :meth:`maybe_save_and_requeue` when the training loop reaches a consistent state, so a
+    preempted run loses at most the current step.
+
+    Example:
+
+        preemption = PreemptionHandler().install()
+        for batch in loader:
+            ...  # training step
+            if preemption.maybe_save_and_requeue(checkpointer, checkpoint_closure):
+                break
+
+    Parameters:
+    - signals: Signals to handle.
+    - requeue: Whether to requeue the SLURM job after the emergency save.
+    """
+
+    def __init__(
+        self,
+        signals: Sequence[signal.Signals] = PREEMPTION_SIGNALS,
+        requeue: bool = True,
+    ) -> None:
+        self.signals = tuple(signals)
+        self.requeue = requeue
+        self.received_signal: Optional[int] = None
+        self._event = threading.Event()
+        self._previous_handlers: Dict[int, Callable] = {}
+
+    def _handle(self, signum: int, frame) -> None:
+        self.received_signal = signum
+        self._event.set()
+
+    def install(self) -> "PreemptionHandler":
+        """Install the handlers. Must be called from the main thread."""
+        for sig in self.signals:
+            self._previous_handlers[sig] = signal.getsignal(sig)
+            signal.signal(sig, self._handle)
+        logger.info(f"Installed preemption handler for signals {list(self.signals)}")
+        return self
+
+    def uninstall(self) -> None:
+        for sig, handler in self._previous_handlers.items():
+            signal.signal(sig, handler)
+        self._previous_handlers = {}
+
+    def should_stop(self, sync: bool = True) -> bool:
+        """
+        Whether a preemption signal was received.
+
+        With `sync=True` and an initialized `torch.distributed` process group, the flag is
+        reduced across ranks so that all the ranks stop at the same step, even if the signal
+        was delivered to only some of them. Call it at the same point on every rank.
+        """
+        stop = self._event.is_set()
+        if not sync:
+            return stop
+        import torch
+        import torch.distributed as dist
+
+        if not (dist.is_available() and dist.is_initialized()):
+            return stop
+        device = (
+            torch.device("cuda", torch.cuda.current_device())
+            if dist.get_backend() == "nccl"
+            else torch.device("cpu")
+        )
+        flag = torch.tensor([int(stop)], device=device)
+        dist.all_reduce(flag, op=dist.ReduceOp.MAX)
+        if flag.item() and not stop:
+            # another rank received the signal
+            self._event.set()
+        return bool(flag.item())
+
+    def maybe_save_and_requeue(
+        self,
+        checkpointer: "Checkpointer",
+        checkpoint_closure: Callable[[], "CheckpointState"],
+        sync: bool = True,
+    ) -> bool:
+        """
+        Call at step boundaries. If a preemption signal was received, saves a checkpoint through
+        `checkpointer` and waits until it is durable, requeues the job (on the primary rank) and
+        returns True, in which case the training loop should exit.
+        """
+        if not self.should_stop(sync=sync):
+            return False
+        logger.warning(
+            f"Received signal {self.received_signal}. Saving emergency checkpoint."
+        )
+        checkpointer.save_checkpoint(checkpoint_closure)
+        # asynchronous saves and staged storage would be killed with the process
+        checkpointer.flush()
+        if self.requeue and checkpointer.is_primary:
+            requeue_slurm_job()
+        return True
+
+
+def ignore_preemption_signals_in_worker(worker_id: int) -> None:
+    """
+    `worker_init_fn` for DataLoader workers.
+
+    SLURM signals every process of the job, DataLoader workers included. Workers inherit the
+    handlers of the main process, so they ignore the preemption signals instead and are shut
+    down by the main process once it has saved.
+    """
+    for sig in PREEMPTION_SIGNALS:
+        signal.signal(sig, signal.SIG_IGN)
+
+
 # See: https://github.com/dhruvdcoder/relational_icl/wiki/submitit_slurm
 
 # Example init function for child processes
@@ -0,0 +1,112 @@
+"""Fast CPU snapshots of training state.
+
+`StateSnapshotter.snapshot` copies the tensors of a (nested) state, e.g.
+`{"model": model.state_dict(), "optimizer": optimizer.state_dict()}`, into
+CPU buffers that are allocated on the first snapshot and reused afterwards.
+With CUDA the buffers are pinned and the copies are issued with
+`non_blocking=True` on the current stream, so they are ordered after the
+pending optimizer step and `snapshot` returns without waiting for them;
+call `wait` before reading the snapshot (e.g. in the thread that
+serializes it).
+
+The buffers are rotated between `num_buffers` sets, so that a snapshot can
+be serialized while the next one is being taken. A snapshot is overwritten
+`num_buffers` snapshots later: with the default of 2, finish with a
+snapshot before taking the second one after it.
+"""
+import copy
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import torch
+
+
+class StateSnapshotter:
+    """
+    Copies the tensors of a state to reused (pinned) CPU buffers.
+
+    Parameters:
+    - num_buffers: Number of buffer sets to rotate between.
+    - pin_memory: Whether to pin the buffers. Defaults to whether CUDA is available.
+    """
+
+    def __init__(self, num_buffers: int = 2, pin_memory: Optional[bool] = None) -> None:
+        if num_buffers < 1:
+            raise ValueError("'num_buffers' should be at least 1")
+        self.pin_memory = (
+            torch.cuda.is_available() if pin_memory is None else pin_memory
+        )
+        self._buffers: List[Dict[Hashable, torch.Tensor]] = [
+            {} for _ in range(num_buffers)
+        ]
+        self._next = 0
+        self._event: Optional["torch.cuda.Event"] = None
+
+    def snapshot(self, state: Any) -> Any:
+        """A copy of `state` in which every tensor is a CPU buffer. Call :meth:`wait` before reading it."""
+        buffers = self._buffers[self._next]
+        self._next = (self._next + 1) % len(self._buffers)
+        # tensors sharing their data (e.g. tied weights) share their copy
+        copies: Dict[Tuple, torch.Tensor] = {}
+        has_cuda = [False]
+        snapshot = self._copy(state, (), buffers, copies, has_cuda)
+        if has_cuda[0]:
+            self._event = torch.cuda.Event()
+            self._event.record()
+        else:
+            self._event = None
+        return snapshot
+
+    def wait(self) -> None:
+        """Block until the copies of the last snapshot are done."""
+        if self._event is not None:
+            self._event.synchronize()
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the allocated buffers."""
+        return sum(
+            buffer.numel() * buffer.element_size()
+            for buffers in self._buffers
+            for buffer in buffers.values()
+        )
+
+    def _copy(
+        self,
+        obj: Any,
+        path: Tuple,
+        buffers: Dict[Hashable, torch.Tensor],
+        copies: Dict[Tuple, torch.Tensor],
+        has_cuda: List[bool],
+    ) -> Any:
+        if isinstance(obj, torch.Tensor):
+            key = (obj.device, obj.data_ptr(), obj.dtype, obj.shape, obj.stride())
+            if key in copies:
+                return copies[key]
+            buffer = buffers.get(path)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(
+                    obj.shape,
+                    dtype=obj.dtype,
+                    device="cpu",
+                    pin_memory=self.pin_memory,
+                )
+                buffers[path] = buffer
+            buffer.copy_(obj.detach(), non_blocking=obj.is_cuda and self.pin_memory)
+            has_cuda[0] = has_cuda[0] or obj.is_cuda
+            copies[key] = buffer
+            return buffer
+        if isinstance(obj, dict):
+            result = type(obj)(
+                (k, self._copy(v, path + (k,), buffers, copies, has_cuda))
+                for k, v in obj.items()
+            )
+            # state dicts carry the versions of the modules in `_metadata`
+            if hasattr(obj, "_metadata"):
+                result._metadata = copy.deepcopy(obj._metadata)
+            return result
+        if isinstance(obj, (list, tuple)) and not hasattr(obj, "_fields"):
+            return type(obj)(
+                self._copy(v, path + (i,), buffers, copies, has_cuda)
+                for i, v in enumerate(obj)
+            )
+        return copy.deepcopy(obj)
@@ -0,0 +1,569 @@
+"""Storage backends for :class:`~.training.Checkpointer`.
+
+A backend stores checkpoint files under flat names such as
+`model_state_e1_b0.pt`. Three backends are provided:
+
+- `LocalStorage`: a directory on a local or shared filesystem.
+- `StagedStorage`: writes to a fast directory (e.g. `/dev/shm` or a
+  node-local SSD) and drains to a durable backend in a background thread,
+  so the training loop only waits for the fast tier.
+- `S3Storage`: an S3-compatible object store, accessed through a client
+  with the boto3 interface. `LocalObjectStoreClient` implements that
+  interface on a local directory, for tests and workstations.
+"""
+import atexit
+import contextlib
+import datetime
+import fnmatch
+import glob
+import io
+import itertools
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CheckpointStorage:
+    """Interface of the storage backends. Names are file names without directories."""
+
+    def location(self, name: str) -> str:
+        """Human readable location of `name` (path or URL)."""
+        raise NotImplementedError
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def list(self, pattern: str = "*") -> List[str]:
+        """Names matching the glob `pattern`."""
+        raise NotImplementedError
+
+    def mtime(self, name: str) -> float:
+        """Last modification time, in seconds since the epoch."""
+        raise NotImplementedError
+
+    def remove(self, name: str) -> None:
+        raise NotImplementedError
+
+    def put_file(self, local_path: str, name: str) -> None:
+        """Store the content of the local file `local_path` as `name`."""
+        raise NotImplementedError
+
+    def get_file(self, name: str, local_path: str) -> None:
+        """Write the content of `name` to the local file `local_path`."""
+        raise NotImplementedError
+
+    def save(self, obj: Any, name: str) -> None:
+        """`torch.save` `obj` as `name`."""
+        buffer = io.BytesIO()
+        torch.save(obj, buffer)
+        self.put_bytes(buffer.getvalue(), name)
+
+    def put_bytes(self, data: bytes, name: str) -> None:
+        raise NotImplementedError
+
+    def get_bytes(self, name: str) -> bytes:
+        raise NotImplementedError
+
+    def load(self, name: str, map_location: Any = None) -> Any:
+        return torch.load(io.BytesIO(self.get_bytes(name)), map_location=map_location)
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        """Binary file to stream the content of `name` to. Stored when the context exits."""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            self.put_file(tmp_path, name)
+        finally:
+            os.remove(tmp_path)
+
+    @contextlib.contextmanager
+    def open_read(self, name: str) -> Iterator[BinaryIO]:
+        """Binary file to stream the content of `name` from."""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp")
+        os.close(fd)
+        try:
+            self.get_file(name, tmp_path)
+            with open(tmp_path, "rb") as f:
+                yield f
+        finally:
+            os.remove(tmp_path)
+
+    def link(self, src: str, dst: str) -> None:
+        """Make `dst` a copy of `src` that survives the removal of `src`. Replaces `dst`."""
+        self.put_bytes(self.get_bytes(src), dst)
+
+    def flush(self) -> None:
+        """Block until all the pending writes are durable."""
+
+
+class LocalStorage(CheckpointStorage):
+    def __init__(self, directory: Union[str, os.PathLike]) -> None:
+        self.directory = str(directory)
+
+    def location(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(self.location(name))
+
+    def list(self, pattern: str = "*") -> List[str]:
+        return [
+            os.path.basename(path)
+            for path in glob.iglob(os.path.join(self.directory, pattern))
+        ]
+
+    def mtime(self, name: str) -> float:
+        return os.path.getmtime(self.location(name))
+
+    def remove(self, name: str) -> None:
+        os.remove(self.location(name))
+
+    def _tmp_path(self, name: str) -> str:
+        return self.location(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def put_file(self, local_path: str, name: str) -> None:
+        # copy then rename so that readers never see a partial file
+        tmp_path = self._tmp_path(name)
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, self.location(name))
+
+    def get_file(self, name: str, local_path: str) -> None:
+        shutil.copyfile(self.location(name), local_path)
+
+    def put_bytes(self, data: bytes, name: str) -> None:
+        tmp_path = self._tmp_path(name)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.location(name))
+
+    def get_bytes(self, name: str) -> bytes:
+        with open(self.location(name), "rb") as f:
+            return f.read()
+
+    def save(self, obj: Any, name: str) -> None:
+        tmp_path = self._tmp_path(name)
+        torch.save(obj, tmp_path)
+        os.replace(tmp_path, self.location(name))
+
+    def load(self, name: str, map_location: Any = None) -> Any:
+        return torch.load(self.location(name), map_location=map_location)
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        tmp_path = self._tmp_path(name)
+        try:
+            with open(tmp_path, "wb") as f:
+                yield f
+            os.replace(tmp_path, self.location(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @contextlib.contextmanager
+    def open_read(self, name: str) -> Iterator[BinaryIO]:
+        with open(self.location(name), "rb") as f:
+            yield f
+
+    def link(self, src: str, dst: str) -> None:
+        # a hard link costs no space; copy where the filesystem does not support them
+        tmp_path = self._tmp_path(dst)
+        try:
+            os.link(self.location(src), tmp_path)
+        except OSError:
+            shutil.copyfile(self.location(src), tmp_path)
+        os.replace(tmp_path, self.location(dst))
+
+
+class StagedStorage(CheckpointStorage):
+    """
+    Saves to a fast local directory and drains to `durable` in a background thread.
+
+    `save` returns as soon as the file is in the staging directory. Reads are served from the
+    staging directory while a file is there. Staged files are deleted once drained, unless
+    `keep_staged` is set. The pending files are drained at interpreter exit (`close`), but not
+    when the process is killed: call `flush` before a planned exit.
+
+    Every write is staged under a file name of its own, so a name can be written again while
+    its previous version is being drained: the versions are drained in order, and each
+    drain only removes its own staged file.
+
+    Parameters:
+    - staging_dir: Fast directory, e.g. `/dev/shm/<job id>` or a node-local SSD.
+    - durable: Backend that files are drained to, e.g. `LocalStorage(serialization_dir)`.
+    - keep_staged: Keep the latest drained version of the files in the staging directory (as
+        a read cache).
+    """
+
+    def __init__(
+        self,
+        staging_dir: Union[str, os.PathLike],
+        durable: CheckpointStorage,
+        keep_staged: bool = False,
+    ) -> None:
+        self.staging = LocalStorage(staging_dir)
+        Path(staging_dir).mkdir(parents=True, exist_ok=True)
+        self.durable = durable
+        self.keep_staged = keep_staged
+        # name -> its latest staged file, and number of versions of a name not drained yet
+        self._staged: Dict[str, str] = {}
+        self._pending: Counter = Counter()
+        self._versions = itertools.count()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._errors: List[BaseException] = []
+        self._thread = threading.Thread(
+            target=self._drain, name="checkpoint-drain", daemon=True
+        )
+        self._thread.start()
+        self._closed = False
+        atexit.register(self._close_at_exit)
+
+    def _drain(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, staged = item
+                self.durable.put_file(self.staging.location(staged), name)
+                with self._lock:
+                    latest = self._staged.get(name) == staged
+                    if latest and not self.keep_staged:
+                        del self._staged[name]
+                if not (latest and self.keep_staged):
+                    self.staging.remove(staged)
+                logger.debug(f"Drained {name} to {self.durable.location(name)}")
+            except BaseException as e:  # reported by flush()
+                logger.exception(f"Failed to drain {item[0]}")
+                self._errors.append(e)
+            finally:
+                if item is not None:
+                    with self._lock:
+                        self._pending[item[0]] -= 1
+                        if self._pending[item[0]] <= 0:
+                            del self._pending[item[0]]
+                self._queue.task_done()
+
+    def location(self, name: str) -> str:
+        return self.durable.location(name)
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            if name in self._pending or name in self._staged:
+                return True
+        return self.durable.exists(name)
+
+    def list(self, pattern: str = "*") -> List[str]:
+        with self._lock:
+            staged = {n for n in self._staged if fnmatch.fnmatch(n, pattern)}
+        return sorted(staged | set(self.durable.list(pattern)))
+
+    def _read(self, name: str, read: Callable[[CheckpointStorage, str], T]) -> T:
+        with self._lock:
+            staged = self._staged.get(name)
+        if staged is not None:
+            # the drain thread may remove the staged file before it is read
+            try:
+                return read(self.staging, staged)
+            except FileNotFoundError:
+                pass
+        return read(self.durable, name)
+
+    def mtime(self, name: str) -> float:
+        return self._read(name, lambda storage, n: storage.mtime(n))
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            pending = name in self._pending
+        if pending:
+            self.flush()
+        with self._lock:
+            staged = self._staged.pop(name, None)
+        if staged is not None and self.staging.exists(staged):
+            self.staging.remove(staged)
+        if self.durable.exists(name):
+            self.durable.remove(name)
+
+    def _staged_name(self, name: str) -> str:
+        return f".{name}.{next(self._versions)}.staged"
+
+    def _stage(self, name: str, staged: str) -> None:
+        with self._lock:
+            self._staged[name] = staged
+            self._pending[name] += 1
+        self._queue.put((name, staged))
+
+    def save(self, obj: Any, name: str) -> None:
+        staged = self._staged_name(name)
+        self.staging.save(obj, staged)
+        self._stage(name, staged)
+
+    def put_file(self, local_path: str, name: str) -> None:
+        staged = self._staged_name(name)
+        self.staging.put_file(local_path, staged)
+        self._stage(name, staged)
+
+    def put_bytes(self, data: bytes, name: str) -> None:
+        staged = self._staged_name(name)
+        self.staging.put_bytes(data, staged)
+        self._stage(name, staged)
+
+    def get_file(self, name: str, local_path: str) -> None:
+        self._read(name, lambda storage, n: storage.get_file(n, local_path))
+
+    def get_bytes(self, name: str) -> bytes:
+        return self._read(name, lambda storage, n: storage.get_bytes(n))
+
+    def load(self, name: str, map_location: Any = None) -> Any:
+        return self._read(name, lambda storage, n: storage.load(n, map_location=map_location))
+
+    @contextlib.contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        staged = self._staged_name(name)
+        with self.staging.open_write(staged) as f:
+            yield f
+        self._stage(name, staged)
+
+    @contextlib.contextmanager
+    def open_read(self, name: str) -> Iterator[BinaryIO]:
+        # once open, the staged file can be drained and removed without affecting the reader
+        with self._lock:
+            staged = self._staged.get(name)
+        try:
+            if staged is None:
+                raise FileNotFoundError(name)
+            f = open(self.staging.location(staged), "rb")
+        except FileNotFoundError:
+            with self.durable.open_read(name) as f:
+                yield f
+            return
+        with f:
+            yield f
+
+    def link(self, src: str, dst: str) -> None:
+        with self._lock:
+            staged_src = self._staged.get(src)
+        if staged_src is not None:
+            staged = self._staged_name(dst)
+            try:
+                self.staging.link(staged_src, staged)
+            except FileNotFoundError:  # drained meanwhile
+                pass
+            else:
+                self._stage(dst, staged)
+                return
+        self.durable.link(src, dst)
+
+    def flush(self) -> None:
+        self._queue.join()
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise RuntimeError(
+                f"{len(errors)} checkpoint file(s) could not be drained"
+            ) from errors[0]
+        self.durable.flush()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self._close_at_exit)
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _close_at_exit(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            logger.exception("Checkpoint files were not drained before exiting")
+
+
+class S3Storage(CheckpointStorage):
+    """
+    Checkpoints in an S3-compatible object store.
+
+    Parameters:
+    - bucket: Name of the bucket.
+    - prefix: Key prefix, e.g. `runs/<run name>`.
+    - client: Client with the boto3 S3 interface (`boto3.client("s3", endpoint_url=...)`), or a
+        `LocalObjectStoreClient`.
+    """
+
+    def __init__(self, bucket: str, prefix: str, client: Any) -> None:
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = client
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def location(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self._key(name)}"
+
+    def _objects(self) -> List[Dict[str, Any]]:
+        objects = []
+        kwargs = {"Bucket": self.bucket, "Prefix": self._key("")}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            objects.extend(response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                return objects
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    def list(self, pattern: str = "*") -> List[str]:
+        start = len(self._key(""))
+        names = [obj["Key"][start:] for obj in self._objects()]
+        return [n for n in names if "/" not in n and fnmatch.fnmatch(n, pattern)]
+
+    def mtime(self, name: str) -> float:
+        response = self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        return response["LastModified"].timestamp()
+
+    def remove(self, name: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def put_file(self, local_path: str, name: str) -> None:
+        # upload_file does multipart uploads for large files
+        self.client.upload_file(local_path, self.bucket, self._key(name))
+
+    def get_file(self, name: str, local_path: str) -> None:
+        self.client.download_file(self.bucket, self._key(name), local_path)
+
+    def put_bytes(self, data: bytes, name: str) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data)
+
+    def get_bytes(self, name: str) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=self._key(name))
+        return response["Body"].read()
+
+    @contextlib.contextmanager
+    def open_read(self, name: str) -> Iterator[BinaryIO]:
+        response = self.client.get_object(Bucket=self.bucket, Key=self._key(name))
+        yield response["Body"]
+
+    def link(self, src: str, dst: str) -> None:
+        # server-side copy
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=self._key(dst),
+            CopySource={"Bucket": self.bucket, "Key": self._key(src)},
+        )
+
+
+def _is_not_found(error: Exception) -> bool:
+    # botocore's ClientError carries the HTTP status in `response`
+    if isinstance(error, FileNotFoundError):
+        return True
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class LocalObjectStoreClient:
+    """
+    Stand-in for a boto3 S3 client, storing objects as files under `root/<bucket>/<key>`.
+
+    Implements the subset of the client interface used by `S3Storage`.
+    """
+
+    def __init__(self, root: Union[str, os.PathLike]) -> None:
+        self.root = Path(root)
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_bytes(Body)
+        os.replace(tmp_path, path)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        return {"Body": io.BytesIO(self._path(Bucket, Key).read_bytes())}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str) -> None:
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        shutil.copyfile(Filename, tmp_path)
+        os.replace(tmp_path, path)
+
+    def download_file(self, Bucket: str, Key: str, Filename: str) -> None:
+        shutil.copyfile(self._path(Bucket, Key), Filename)
+
+    def copy_object(
+        self, Bucket: str, Key: str, CopySource: Dict[str, str]
+    ) -> Dict[str, Any]:
+        self.put_object(
+            Bucket, Key, self._path(CopySource["Bucket"], CopySource["Key"]).read_bytes()
+        )
+        return {}
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        mtime = self._path(Bucket, Key).stat().st_mtime
+        return {
+            "LastModified": datetime.datetime.fromtimestamp(
+                mtime, tz=datetime.timezone.utc
+            )
+        }
+
+    def delete_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        if path.exists():
+            path.unlink()
+        return {}
+
+    def list_objects_v2(
+        self, Bucket: str, Prefix: str = "", ContinuationToken: Optional[str] = None
+    ) -> Dict[str, Any]:
+        bucket_dir = self.root / Bucket
+        contents = []
+        if bucket_dir.is_dir():
+            for path in sorted(bucket_dir.rglob("*")):
+                key = path.relative_to(bucket_dir).as_posix()
+                if (
+                    path.is_file()
+                    and not path.name.startswith(".")
+                    and key.startswith(Prefix)
+                ):
+                    contents.append({"Key": key, "Size": path.stat().st_size})
+        return {"Contents": contents, "IsTruncated": False}
@@ -0,0 +1,222 @@
+"""Streaming datasets for corpora larger than memory.
+
+`StreamingDataset` chains generators: read the sources, keep the examples of
+this shard, filter, transform (e.g. tokenize), shuffle in a bounded buffer
+and optionally batch. Nothing is materialized beyond the shuffle buffer and
+the current batch.
+
+The stream is split into `world_size * num_workers` shards, one per
+DataLoader worker of every rank. When there are at least as many sources
+(files, HF dataset shards, ...) as shards, each shard reads its own
+sources; otherwise every shard reads all the sources and keeps one example
+out of `num_shards`.
+
+Shards do not have the same number of examples in general (sources of
+different sizes, filtering). With distributed data parallel training, the
+rank whose shard runs out first stops while its peers wait for it at their
+next collective, which hangs the job. Set `examples_per_shard` (e.g. a bit
+less than the number of examples over the number of shards) so that every
+shard yields exactly that many examples: shards that run out first start
+over their sources, and the others are truncated.
+
+The order only depends on `seed`, the epoch (see `set_epoch`) and the
+shard, so runs are reproducible as long as the number of ranks and workers
+does not change.
+
+    dataset = StreamingDataset(
+        sources=sorted(glob.glob("data/train-*.jsonl")),
+        open_source=read_jsonl,
+        filter_fn=lambda ex: len(ex["labels"]) <= max_length,
+        map_fn=tokenize,
+        shuffle_buffer_size=10_000,
+        batch_size=32,
+        collate_fn=collator,
+    )
+    loader = DataLoader(dataset, batch_size=None, num_workers=4)
+"""
+import itertools
+import logging
+import os
+import random
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+logger = logging.getLogger(__name__)
+
+
+def distributed_rank_and_world_size() -> Tuple[int, int]:
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return int(os.environ.get("RANK", 0)), int(os.environ.get("WORLD_SIZE", 1))
+
+
+def shuffle_buffer(
+    examples: Iterable[Any], buffer_size: int, rng: random.Random
+) -> Iterator[Any]:
+    """Approximate shuffling of a stream, holding at most `buffer_size` examples."""
+    buffer: List[Any] = []
+    for example in examples:
+        if len(buffer) < buffer_size:
+            buffer.append(example)
+            continue
+        index = rng.randrange(buffer_size)
+        yield buffer[index]
+        buffer[index] = example
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def batched(
+    examples: Iterable[Any], batch_size: int, drop_last: bool = False
+) -> Iterator[List[Any]]:
+    iterator = iter(examples)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch or (drop_last and len(batch) < batch_size):
+            return
+        yield batch
+
+
+class StreamingDataset(IterableDataset):
+    """
+    Iterable dataset streaming examples from `sources`.
+
+    Parameters:
+    - sources: Sources of examples, e.g. file paths. Sharded across ranks and workers.
+    - open_source: Returns the examples of a source.
+    - filter_fn: Keep the examples for which it returns `True`. Applied after `map_fn` if
+        `filter_after_map`, e.g. to filter on token counts.
+    - map_fn: Transforms an example, e.g. tokenizes it.
+    - filter_after_map: Apply `filter_fn` to the transformed examples.
+    - shuffle_buffer_size: Size of the shuffle buffer. `0` disables shuffling.
+    - seed: Seed of the shuffling.
+    - batch_size: Yield batches of this size instead of examples. Use the `DataLoader` with
+        `batch_size=None` then.
+    - collate_fn: Collates the batches.
+    - drop_last: Drop the last incomplete batch of each shard.
+    - shard_by_rank: Shard across distributed ranks too. Disable it when the trainer already
+        shards iterable datasets across ranks (e.g. the HF `Trainer`). The shards of the
+        ranks then generally differ in length, which hangs distributed data parallel training
+        at the end of the shortest one unless `examples_per_shard` is set.
+    - examples_per_shard: Yield exactly this many examples (before batching) from every
+        shard, starting over the sources of the shard (reshuffled) when they run out, and
+        dropping the remaining examples when they do not. `None` yields every example once.
+    - rank: Rank of the process. Defaults to the distributed rank (or `RANK`).
+    - world_size: Number of ranks. Defaults to the distributed world size (or `WORLD_SIZE`).
+    """
+
+    def __init__(
+        self,
+        sources: Sequence[Any],
+        open_source: Callable[[Any], Iterable[Any]],
+        filter_fn: Optional[Callable[[Any], bool]] = None,
+        map_fn: Optional[Callable[[Any], Any]] = None,
+        filter_after_map: bool = False,
+        shuffle_buffer_size: int = 0,
+        seed: int = 0,
+        batch_size: Optional[int] = None,
+        collate_fn: Optional[Callable[[List[Any]], Any]] = None,
+        drop_last: bool = False,
+        shard_by_rank: bool = True,
+        rank: Optional[int] = None,
+        world_size: Optional[int] = None,
+        examples_per_shard: Optional[int] = None,
+    ) -> None:
+        super().__init__()
+        self.sources = list(sources)
+        self.open_source = open_source
+        self.filter_fn = filter_fn
+        self.map_fn = map_fn
+        self.filter_after_map = filter_after_map
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.batch_size = batch_size
+        self.collate_fn = collate_fn
+        self.drop_last = drop_last
+        self.shard_by_rank = shard_by_rank
+        self.rank = rank
+        self.world_size = world_size
+        self.examples_per_shard = examples_per_shard
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """Change the shuffling order. Call it before iterating over each epoch."""
+        self.epoch = epoch
+
+    def shard(self) -> Tuple[int, int]:
+        """Index of the shard of this worker and number of shards."""
+        rank, world_size = 0, 1
+        if self.shard_by_rank:
+            default_rank, default_world_size = distributed_rank_and_world_size()
+            rank = self.rank if self.rank is not None else default_rank
+            world_size = (
+                self.world_size if self.world_size is not None else default_world_size
+            )
+        worker_info = get_worker_info()
+        worker_id, num_workers = (
+            (worker_info.id, worker_info.num_workers)
+            if worker_info is not None
+            else (0, 1)
+        )
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def _examples(self, shard_index: int, num_shards: int) -> Iterator[Any]:
+        if len(self.sources) >= num_shards:
+            for source in self.sources[shard_index::num_shards]:
+                yield from self.open_source(source)
+        else:
+            examples = itertools.chain.from_iterable(
+                self.open_source(source) for source in self.sources
+            )
+            yield from itertools.islice(examples, shard_index, None, num_shards)
+
+    def _pipeline(self, shard_index: int, num_shards: int, repeat: int) -> Iterator[Any]:
+        examples: Iterable[Any] = self._examples(shard_index, num_shards)
+        if self.filter_fn is not None and not self.filter_after_map:
+            examples = filter(self.filter_fn, examples)
+        if self.map_fn is not None:
+            examples = map(self.map_fn, examples)
+        if self.filter_fn is not None and self.filter_after_map:
+            examples = filter(self.filter_fn, examples)
+        if self.shuffle_buffer_size > 0:
+            # str seeds are hashed deterministically, unlike tuples
+            seed = f"{self.seed}-{self.epoch}-{shard_index}"
+            if repeat:
+                seed += f"-{repeat}"
+            rng = random.Random(seed)
+            examples = shuffle_buffer(examples, self.shuffle_buffer_size, rng)
+        yield from examples
+
+    def _repeated_pipeline(self, shard_index: int, num_shards: int) -> Iterator[Any]:
+        for repeat in itertools.count():
+            num_examples = 0
+            for example in self._pipeline(shard_index, num_shards, repeat):
+                num_examples += 1
+                yield example
+            if num_examples == 0:
+                raise ValueError(f"Shard {shard_index} of {num_shards} has no examples")
+            logger.debug(
+                f"Shard {shard_index} of {num_shards} ran out after {num_examples} "
+                "examples, starting over"
+            )
+
+    def __iter__(self) -> Iterator[Any]:
+        shard_index, num_shards = self.shard()
+        if len(self.sources) < num_shards:
+            logger.debug(
+                f"{len(self.sources)} source(s) for {num_shards} shards: every shard reads "
+                "all the sources"
+            )
+        if self.examples_per_shard is None:
+            examples: Iterable[Any] = self._pipeline(shard_index, num_shards, 0)
+        else:
+            examples = itertools.islice(
+                self._repeated_pipeline(shard_index, num_shards), self.examples_per_shard
+            )
+        if self.batch_size is None:
+            yield from examples
+            return
+        for batch in batched(examples, self.batch_size, self.drop_last):
+            yield self.collate_fn(batch) if self.collate_fn is not None else batch
@@ -1,6 +1,9 @@
-from typing import Any, Callable, Dict, Optional, Set, Tuple, TypedDict, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypedDict, Union
+import copy
+import heapq
+import json
 import logging
-import glob
 import os
 import re
 import time
@@ -8,6 +11,10 @@ import time
 import torch
 import torch.distributed as dist
 
+from .integrity import ChecksumError, ChecksummedIO, manifest_name
+from .rate_limit import warn_once
+from .snapshot import StateSnapshotter
+from .storage import CheckpointStorage, LocalStorage
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +44,49 @@ class CheckpointClosure:
         return self.checkpoint_state
 
 
+class SnapshotCheckpointClosure(CheckpointClosure):
+    """
+    Returns a snapshot of `model_state` taken by `snapshotter`, without waiting for the
+    device to host copies to complete. `Checkpointer` calls `wait` before serializing it.
+
+    Create one closure per save, with the same `snapshotter` so that its buffers are reused:
+
+        snapshotter = StateSnapshotter()
+        ...
+        closure = SnapshotCheckpointClosure(
+            snapshotter,
+            {"model": model.state_dict(), "optimizer": optimizer.state_dict()},
+            {"epochs_completed": epoch, "batches_in_epoch_completed": batch},
+        )
+        checkpointer.maybe_save_checkpoint(closure, epoch, batch)
+
+    Parameters:
+    - snapshotter: Copies the tensors to reused CPU buffers.
+    - model_state: State to snapshot. Tensors are copied to the buffers, other values are deep-copied.
+    - trainer_state: Saved as is (deep-copied).
+    """
+
+    def __init__(
+        self,
+        snapshotter: StateSnapshotter,
+        model_state: Dict[str, Any],
+        trainer_state: TrainerState,
+    ):
+        super().__init__()
+        self.snapshotter = snapshotter
+        self.model_state = model_state
+        self.trainer_state = trainer_state
+
+    def call(self) -> CheckpointState:
+        return {
+            "model_state": self.snapshotter.snapshot(self.model_state),
+            "trainer_state": copy.deepcopy(self.trainer_state),
+        }
+
+    def wait(self) -> None:
+        self.snapshotter.wait()
+
+
 def device_mapping(cuda_device: int):
     """
     In order to `torch.load()` a GPU-trained model onto a CPU (or specific GPU),
@@ -53,19 +103,13 @@ def device_mapping(cuda_device: int):
     return inner_device_mapping
 
 
-class HasBeenWarned:
-    tqdm_ignores_underscores = False
-
-
 def description_from_metrics(metrics: Dict[str, float]) -> str:
-    if not HasBeenWarned.tqdm_ignores_underscores and any(
-        metric_name.startswith("_") for metric_name in metrics
-    ):
-        logger.warning(
+    if any(metric_name.startswith("_") for metric_name in metrics):
+        warn_once(
+            logger,
             'Metrics with names beginning with "_" will '
-            "not be logged to the tqdm progress bar."
+            "not be logged to the tqdm progress bar.",
         )
-        HasBeenWarned.tqdm_ignores_underscores = True
     return (
         ", ".join(
             [
@@ -93,8 +137,30 @@ class Checkpointer:
     - save_every_num_batches: If set, makes sure we never go longer than this number of batches between saving a model.
     - keep_most_recent_by_count: Number of model checkpoints to keep on disk.
     - keep_most_recent_by_age: Number of seconds we'll keep a checkpoint before deleting it.
+    - storage: Where the checkpoint files are stored (see `utils.storage`). Defaults to
+        `LocalStorage(serialization_dir)`.
+    - checksums: Write chunk checksums next to the checkpoint files (see `utils.integrity`).
+        Files that have checksums are verified when loaded, and a corrupted checkpoint is
+        skipped in favor of the previous one.
+    - async_save: Serialize the checkpoints in a background thread. `save_checkpoint` returns once
+        the closure has been called, and at most one save is in flight, which is what
+        `SnapshotCheckpointClosure` with two buffer sets requires. Call `wait_until_saved` before
+        exiting.
+    - metric_name: Validation metric used to rank the checkpoints, looked up in the `metrics`
+        passed to `save_checkpoint`. Without it (or without `metrics`) no ranking is done.
+    - greater_is_better: Whether a larger `metric_name` is better.
+    - keep_best_k: Number of best checkpoints that are never removed by the retention policy. The
+        best one is also available as `best_model_state.pt`/`best_training_state.pt`, hard links
+        to its files (copies where the storage does not support links).
+    - patience: Number of consecutive evaluations without improvement after which `should_stop`
+        becomes `True`. `None` disables early stopping.
+
+    The ranking and the early stopping counters are persisted in `checkpointer_state.json`, and
+    restored when a `Checkpointer` is created on the same storage.
     """
 
+    _state_name = "checkpointer_state.json"
+
     def __init__(
         self,
         serialization_dir: Union[str, os.PathLike],
@@ -103,8 +169,26 @@ class Checkpointer:
         save_every_num_batches: Optional[int] = None,
         keep_most_recent_by_count: Optional[int] = 2,
         keep_most_recent_by_age: Optional[int] = None,
+        storage: Optional[CheckpointStorage] = None,
+        checksums: bool = False,
+        async_save: bool = False,
+        metric_name: Optional[str] = None,
+        greater_is_better: bool = True,
+        keep_best_k: int = 1,
+        patience: Optional[int] = None,
     ) -> None:
         self._serialization_dir = str(serialization_dir)
+        self._storage = (
+            storage if storage is not None else LocalStorage(serialization_dir)
+        )
+        self._checksums = checksums
+        self._checksummed_io: Optional[ChecksummedIO] = None
+        self._executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpointer")
+            if async_save
+            else None
+        )
+        self._pending_save: Optional[Future] = None
         self._save_completed_epochs = save_completed_epochs
         self._save_every_num_seconds = save_every_num_seconds
         self._save_every_num_batches = save_every_num_batches
@@ -119,6 +203,18 @@ class Checkpointer:
             else dist.get_rank()
         )
         self.state_is_sharded = False
+        if keep_best_k < 1:
+            raise ValueError("Checkpointer parameter 'keep_best_k' should be at least 1")
+        self._metric_name = metric_name
+        self._greater_is_better = greater_is_better
+        self._keep_best_k = keep_best_k
+        self._patience = patience
+        # min-heap of (score, epochs_completed, batches_in_epoch_completed), the worst of the
+        # best checkpoints on top. The score is the metric, negated if smaller is better.
+        self._best: List[Tuple[float, int, int]] = []
+        self._num_evals_without_improvement = 0
+        if metric_name is not None and self._storage.exists(self._state_name):
+            self._load_state()
 
         if (
             dist.is_available()
@@ -130,32 +226,94 @@ class Checkpointer:
             )
 
     @property
-    def _is_primary(self) -> bool:
+    def is_primary(self) -> bool:
+        """Whether this process writes the files shared by all ranks."""
         return self._rank == 0
 
-    def _model_state_path(
+    @property
+    def should_stop(self) -> bool:
+        """Whether training should stop early, see `patience`."""
+        return (
+            self._patience is not None
+            and self._num_evals_without_improvement >= self._patience
+        )
+
+    @property
+    def best_checkpoint(self) -> Optional[Tuple[float, int, int]]:
+        """`(metric, epochs_completed, batches_in_epoch_completed)` of the best checkpoint."""
+        if not self._best:
+            return None
+        score, epochs_completed, batches_in_epoch_completed = max(self._best)
+        metric = score if self._greater_is_better else -score
+        return metric, epochs_completed, batches_in_epoch_completed
+
+    def _load_state(self) -> None:
+        state = json.loads(self._storage.get_bytes(self._state_name))
+        self._best = [tuple(entry) for entry in state["best"]]
+        heapq.heapify(self._best)
+        self._num_evals_without_improvement = state["num_evals_without_improvement"]
+
+    def _save_state(self, best: List[Tuple[float, int, int]], num_evals: int) -> None:
+        state = {"best": best, "num_evals_without_improvement": num_evals}
+        self._storage.put_bytes(json.dumps(state).encode(), self._state_name)
+
+    def _update_best(
+        self, metrics: Dict[str, float], checkpoint: Tuple[int, int]
+    ) -> bool:
+        """Record the metric of `checkpoint`. Returns whether it is the new best checkpoint."""
+        if self._metric_name not in metrics:
+            raise ValueError(
+                f"Metric '{self._metric_name}' is missing from the metrics: {list(metrics)}"
+            )
+        metric = float(metrics[self._metric_name])
+        score = metric if self._greater_is_better else -metric
+        # a checkpoint saved again replaces its previous entry
+        if any(tuple(entry[1:]) == checkpoint for entry in self._best):
+            self._best = [entry for entry in self._best if tuple(entry[1:]) != checkpoint]
+            heapq.heapify(self._best)
+        is_best = not self._best or score > max(self._best)[0]
+        if is_best:
+            self._num_evals_without_improvement = 0
+        else:
+            self._num_evals_without_improvement += 1
+        entry = (score, *checkpoint)
+        if len(self._best) < self._keep_best_k:
+            heapq.heappush(self._best, entry)
+        elif self._best and entry > self._best[0]:
+            heapq.heapreplace(self._best, entry)
+        return is_best
+
+    def _model_state_name(
         self, epochs_completed: int, batches_in_epoch_completed: int
     ) -> str:
-        path = os.path.join(
-            self._serialization_dir,
-            f"model_state_e{epochs_completed}_b{batches_in_epoch_completed}",
-        )
+        name = f"model_state_e{epochs_completed}_b{batches_in_epoch_completed}"
         if self.state_is_sharded:
-            return path + f"_w{self._rank}.pt"
+            return name + f"_w{self._rank}.pt"
         else:
-            return path + ".pt"
+            return name + ".pt"
 
-    def _training_state_path(
+    def _training_state_name(
         self, epochs_completed: int, batches_in_epoch_completed: int
     ) -> str:
-        path = os.path.join(
-            self._serialization_dir,
-            f"training_state_e{epochs_completed}_b{batches_in_epoch_completed}",
-        )
+        name = f"training_state_e{epochs_completed}_b{batches_in_epoch_completed}"
         if self.state_is_sharded:
-            return path + f"_w{self._rank}.pt"
+            return name + f"_w{self._rank}.pt"
         else:
-            return path + ".pt"
+            return name + ".pt"
+
+    def _model_state_path(
+        self, epochs_completed: int, batches_in_epoch_completed: int
+    ) -> str:
+        return self._storage.location(
+            self._model_state_name(epochs_completed, batches_in_epoch_completed)
+        )
+
+    def _training_state_path(
+        self, epochs_completed: int, batches_in_epoch_completed: int
+    ) -> str:
+        return self._storage.location(
+            self._training_state_name(epochs_completed, batches_in_epoch_completed)
+        )
 
     _model_state_file_re = re.compile(
         r"(.*[/\\])?model_state_e(\d+)_b(\d+)(_w\d+)?\.pt$"
@@ -198,9 +356,7 @@ class Checkpointer:
             if self.state_is_sharded
             else "model_state_e*_b*.pt"
         )
-        for model_state_file in glob.iglob(
-            os.path.join(self._serialization_dir, pattern)
-        ):
+        for model_state_file in self._storage.list(pattern):
             point_in_time = self._parse_model_state_path(model_state_file)
             if point_in_time is None:
                 continue
@@ -215,8 +371,10 @@ class Checkpointer:
             pattern = (
                 f"{state_name}_e{epochs_completed}_b{batches_in_epoch_completed}*.pt"
             )
-            for fname in glob.iglob(os.path.join(self._serialization_dir, pattern)):
-                os.remove(fname)
+            for name in self._storage.list(pattern):
+                self._storage.remove(name)
+                if self._storage.exists(manifest_name(name)):
+                    self._storage.remove(manifest_name(name))
 
     def maybe_save_checkpoint(
         self,
@@ -224,9 +382,11 @@ class Checkpointer:
         num_epochs_completed: int,
         num_batches_in_epoch_completed: int,
         end_of_epoch: bool = False,
+        metrics: Optional[Dict[str, float]] = None,
     ) -> bool:
         """
         Figures out whether we need to save a checkpoint, and does so if necessary.
+        `metrics` are only used if a checkpoint is saved, see `save_checkpoint`.
         """
         if num_epochs_completed == self._last_save_num_epochs_completed:
             last_save_num_batches_in_epoch_completed = (
@@ -252,46 +412,136 @@ class Checkpointer:
         )
 
         if should_save:
-            self.save_checkpoint(checkpoint_closure)
+            self.save_checkpoint(checkpoint_closure, metrics=metrics)
             return True
         return False
 
+    @property
+    def _io(self) -> ChecksummedIO:
+        if self._checksummed_io is None:
+            self._checksummed_io = ChecksummedIO(self._storage)
+        return self._checksummed_io
+
+    def _save(self, obj: Any, name: str) -> None:
+        if self._checksums:
+            self._io.save(obj, name)
+        else:
+            self._storage.save(obj, name)
+
     def save_checkpoint(
         self,
         checkpoint_closure: Callable[[], CheckpointState],
+        metrics: Optional[Dict[str, float]] = None,
     ) -> None:
+        """
+        Save the state returned by `checkpoint_closure`. Pass the validation `metrics` of that
+        state to rank the checkpoint (see `metric_name`) and update the early stopping counter.
+        """
         if self._serialization_dir is None:
             return
 
         tcps = checkpoint_closure()  # get the CheckpointState
         if tcps is None:
-            assert not self._is_primary and not self.state_is_sharded
+            assert not self.is_primary and not self.state_is_sharded
             return
 
         epochs_completed = tcps["trainer_state"]["epochs_completed"]
         batches_in_epoch_completed = tcps["trainer_state"]["batches_in_epoch_completed"]
+        self._last_save_time = time.time()
+        self._last_save_num_epochs_completed = epochs_completed
+        self._last_save_num_batches_in_epoch_completed = batches_in_epoch_completed
+
+        # rank synchronously, so that `should_stop` is up to date when this returns
+        is_best = None
+        if self._metric_name is not None and metrics is not None:
+            is_best = self._update_best(
+                metrics, (epochs_completed, batches_in_epoch_completed)
+            )
+        best = list(self._best)
+        num_evals = self._num_evals_without_improvement
+
+        wait = getattr(checkpoint_closure, "wait", None)
+        if self._executor is None:
+            self._write_checkpoint(tcps, wait, is_best, best, num_evals)
+        else:
+            self.wait_until_saved()
+            self._pending_save = self._executor.submit(
+                self._write_checkpoint, tcps, wait, is_best, best, num_evals
+            )
+
+    def wait_until_saved(self) -> None:
+        """Wait for the pending asynchronous save, if any, and raise its error."""
+        if self._pending_save is not None:
+            pending, self._pending_save = self._pending_save, None
+            pending.result()
+
+    def close(self) -> None:
+        """Wait for the pending asynchronous save, if any, and stop the saving and hashing threads."""
+        self.wait_until_saved()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._checksummed_io is not None:
+            self._checksummed_io.close()
+
+    def __del__(self) -> None:
+        checksummed_io = getattr(self, "_checksummed_io", None)
+        if checksummed_io is not None:
+            checksummed_io.close(wait=False)
+
+    def flush(self) -> None:
+        """Wait for the pending asynchronous save, if any, and until the storage made it durable."""
+        self.wait_until_saved()
+        self._storage.flush()
+
+    def _link_best(self, checkpoint: Tuple[int, int]) -> None:
+        suffix = f"_w{self._rank}.pt" if self.state_is_sharded else ".pt"
+        for src, dst in (
+            (self._model_state_name(*checkpoint), "best_model_state" + suffix),
+            (self._training_state_name(*checkpoint), "best_training_state" + suffix),
+        ):
+            self._storage.link(src, dst)
+            if self._storage.exists(manifest_name(src)):
+                self._storage.link(manifest_name(src), manifest_name(dst))
+
+    def _write_checkpoint(
+        self,
+        tcps: CheckpointState,
+        wait: Optional[Callable[[], None]],
+        is_best: Optional[bool] = None,
+        best: Optional[List[Tuple[float, int, int]]] = None,
+        num_evals: int = 0,
+    ) -> None:
+        if wait is not None:
+            wait()
+        epochs_completed = tcps["trainer_state"]["epochs_completed"]
+        batches_in_epoch_completed = tcps["trainer_state"]["batches_in_epoch_completed"]
 
-        model_state_path = self._model_state_path(
+        model_state_name = self._model_state_name(
             epochs_completed,
             batches_in_epoch_completed,
         )
-        if not os.path.isfile(model_state_path):
-            logger.info(f"Saving model state to {model_state_path}")
-            torch.save(tcps["model_state"], model_state_path)
+        if not self._storage.exists(model_state_name):
+            logger.info(
+                f"Saving model state to {self._storage.location(model_state_name)}"
+            )
+            self._save(tcps["model_state"], model_state_name)
 
-        trainer_state_path = self._training_state_path(
+        trainer_state_name = self._training_state_name(
             epochs_completed,
             batches_in_epoch_completed,
         )
-        if not os.path.isfile(trainer_state_path):
-            logger.info(f"Saving training state to {trainer_state_path}")
-            torch.save(tcps["trainer_state"], trainer_state_path)
+        if not self._storage.exists(trainer_state_name):
+            logger.info(
+                f"Saving training state to {self._storage.location(trainer_state_name)}"
+            )
+            self._save(tcps["trainer_state"], trainer_state_name)
 
-        self._last_save_time = time.time()
-        self._last_save_num_epochs_completed = epochs_completed
-        self._last_save_num_batches_in_epoch_completed = batches_in_epoch_completed
+        if is_best:
+            self._link_best((epochs_completed, batches_in_epoch_completed))
+        if is_best is not None and self.is_primary:
+            self._save_state(best, num_evals)
 
-        if self._is_primary and (
+        if self.is_primary and (
             self._keep_most_recent_by_age is not None
             or self._keep_most_recent_by_count is not None
         ):
@@ -305,16 +555,17 @@ class Checkpointer:
                 )
             else:
                 checkpoints_to_keep = set()
+            checkpoints_to_keep.update((e, b) for _, e, b in best or [])
 
             # Keep the youngest checkpoints by age
             now = time.time()
             if self._keep_most_recent_by_age is not None:
                 for checkpoint in checkpoints:
                     checkpoint_mtime = max(
-                        os.path.getmtime(n)
+                        self._storage.mtime(n)
                         for n in [
-                            self._model_state_path(*checkpoint),
-                            self._training_state_path(*checkpoint),
+                            self._model_state_name(*checkpoint),
+                            self._training_state_name(*checkpoint),
                         ]
                     )
                     if now - checkpoint_mtime <= self._keep_most_recent_by_age:
@@ -330,14 +581,19 @@ class Checkpointer:
         Return the location of the latest model and training state files.
         If there isn't a valid checkpoint then return None.
         """
-        checkpoints = self._find_all_checkpoints()
-        if len(checkpoints) <= 0:
+        last_checkpoint = self._find_latest_checkpoint()
+        if last_checkpoint is None:
             return None
-        last_checkpoint = max(checkpoints)
         return self._model_state_path(*last_checkpoint), self._training_state_path(
             *last_checkpoint
         )
 
+    def _find_latest_checkpoint(self) -> Optional[Tuple[int, int]]:
+        checkpoints = self._find_all_checkpoints()
+        if len(checkpoints) <= 0:
+            return None
+        return max(checkpoints)
+
     def load_checkpoint(self) -> Optional[Dict[str, Dict[str, Any]]]:
         """
         Loads model state from a `serialization_dir` corresponding to the last saved checkpoint.
@@ -352,18 +608,23 @@ class Checkpointer:
         Returns:
         - states: The model state and the training state.
         """
-        latest_checkpoint = self.find_latest_checkpoint()
-        if latest_checkpoint is None:
-            return None
-
-        model_path, training_state_path = latest_checkpoint
-
+        self.wait_until_saved()
         # Load the parameters onto CPU, then transfer to GPU.
         # This avoids potential OOM on GPU for large models that
         # load parameters onto GPU then make a new GPU copy into the parameter
         # buffer. The GPU transfer happens implicitly in load_state_dict.
-        model_state = torch.load(model_path, map_location=torch.device("cpu"))
-        training_state = torch.load(
-            training_state_path, map_location=torch.device("cpu")
-        )
-        return {"model_state": model_state, "trainer_state": training_state}
+        for checkpoint in sorted(self._find_all_checkpoints(), reverse=True):
+            try:
+                model_state = self._io.load(
+                    self._model_state_name(*checkpoint),
+                    map_location=torch.device("cpu"),
+                )
+                training_state = self._io.load(
+                    self._training_state_name(*checkpoint),
+                    map_location=torch.device("cpu"),
+                )
+            except ChecksumError as e:
+                logger.error(f"{e}, falling back to the previous checkpoint")
+                continue
+            return {"model_state": model_state, "trainer_state": training_state}
+        return None
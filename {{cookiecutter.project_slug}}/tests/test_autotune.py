@@ -0,0 +1,74 @@
+import json
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from {{cookiecutter.project_slug}}.utils import autotune
+from {{cookiecutter.project_slug}}.utils.autotune import autotune_threads_and_workers
+
+
+def test_autotune_picks_a_candidate_and_persists_it(tmp_path):
+    dataset = TensorDataset(torch.randn(64, 16))
+    weight = torch.randn(16, 16)
+    calls = []
+
+    def make_loader(num_workers):
+        calls.append(num_workers)
+        return DataLoader(dataset, batch_size=4, num_workers=num_workers)
+
+    def step(batch):
+        return batch[0] @ weight
+
+    initial_threads = torch.get_num_threads()
+    tuned = autotune_threads_and_workers(
+        make_loader,
+        step,
+        thread_candidates=[1],
+        worker_candidates=[0, 1],
+        warmup_steps=1,
+        measure_steps=2,
+        output_dir=tmp_path,
+        apply=False,
+    )
+    assert tuned["num_workers"] in (0, 1)
+    assert torch.get_num_threads() == initial_threads
+    assert json.loads((tmp_path / "autotune.json").read_text()) == tuned
+
+    calls.clear()
+    assert autotune_threads_and_workers(make_loader, step, output_dir=tmp_path, apply=False) == tuned
+    assert calls == []
+
+
+def test_autotune_restores_the_model_and_optimizer(tmp_path, monkeypatch):
+    dataset = TensorDataset(torch.randn(64, 16))
+    model = torch.nn.Linear(16, 1)
+    optimizer = torch.optim.Adam(model.parameters())
+    weight = model.weight.detach().clone()
+
+    def step(batch):
+        optimizer.zero_grad()
+        model(batch[0]).sum().backward()
+        optimizer.step()
+
+    def tune():
+        return autotune_threads_and_workers(
+            lambda num_workers: DataLoader(dataset, batch_size=4),
+            step,
+            thread_candidates=[1],
+            worker_candidates=[0],
+            warmup_steps=1,
+            measure_steps=2,
+            output_dir=tmp_path,
+            apply=False,
+            model=model,
+            optimizer=optimizer,
+        )
+
+    tuned = tune()
+    assert torch.equal(model.weight, weight)
+    assert model.weight.grad is None
+    assert optimizer.state_dict()["state"] == {}
+
+    # tuned again on a different number of CPUs
+    monkeypatch.setattr(autotune, "available_cpus", lambda: tuned["num_cpus"] + 1)
+    assert tune()["num_cpus"] == tuned["num_cpus"] + 1
@@ -0,0 +1,131 @@
+import json
+import os
+
+import pytest
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from {{cookiecutter.project_slug}}.utils.batch_size import (
+    MemoryLimitExceeded,
+    accumulation_plan,
+    auto_batch_size,
+    find_max_batch_size,
+)
+
+
+def _trial(limit, calls):
+    def trial(batch_size):
+        calls.append(batch_size)
+        if batch_size > limit:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+    return trial
+
+
+@pytest.mark.parametrize("limit", [1, 5, 37, 64])
+def test_find_max_batch_size(limit):
+    calls = []
+    assert find_max_batch_size(_trial(limit, calls), 64, rss_limit=2**50) == limit
+    assert len(calls) <= 2 * 7
+
+
+def test_other_errors_propagate_and_nothing_fits():
+    def broken(batch_size):
+        raise ValueError("bug")
+
+    with pytest.raises(ValueError):
+        find_max_batch_size(broken, 8)
+    with pytest.raises(MemoryError):
+        find_max_batch_size(_trial(0, []), 8)
+
+
+def test_rss_limit():
+    calls = []
+
+    def trial(batch_size):
+        calls.append(batch_size)
+        bytearray(batch_size * 2**20)  # touch batch_size MiB
+
+    # every step exceeds a limit of 1 byte
+    with pytest.raises(MemoryError):
+        find_max_batch_size(trial, 4, rss_limit=1)
+    assert issubclass(MemoryLimitExceeded, MemoryError)
+
+
+def test_accumulation_plan():
+    assert accumulation_plan(64, 24) == {"micro_batch_size": 16, "accumulation_steps": 4}
+    assert accumulation_plan(64, 100, world_size=2) == {
+        "micro_batch_size": 32,
+        "accumulation_steps": 1,
+    }
+    with pytest.raises(ValueError):
+        accumulation_plan(63, 8, world_size=2)
+
+
+def test_accumulation_plan_of_a_prime_target(caplog):
+    assert accumulation_plan(257, 64) == {"micro_batch_size": 1, "accumulation_steps": 257}
+    assert "much smaller" in caplog.text
+    caplog.clear()
+    # 64 x 4 = 256 is within 1% of 257
+    assert accumulation_plan(257, 64, tolerance=0.01) == {
+        "micro_batch_size": 64,
+        "accumulation_steps": 4,
+    }
+    assert "much smaller" not in caplog.text
+
+
+def test_auto_batch_size_is_cached(tmp_path):
+    cache_path = tmp_path / "batch_size.json"
+    key = {"model": "tiny", "max_length": 8}
+    calls = []
+    sizes = auto_batch_size(_trial(12, calls), 48, key, cache_path, rss_limit=2**50)
+    assert sizes == {
+        "micro_batch_size": 12,
+        "accumulation_steps": 4,
+        "max_micro_batch_size": 12,
+    }
+    assert len(json.loads(cache_path.read_text())) == 1
+
+    calls.clear()
+    assert auto_batch_size(_trial(12, calls), 24, key, cache_path) == dict(
+        sizes, accumulation_steps=2
+    )
+    assert calls == []
+    # a different key searches again
+    auto_batch_size(_trial(12, calls), 24, dict(key, max_length=16), cache_path, rss_limit=2**50)
+    assert calls
+
+
+def _distributed_search(rank, init_file, cache_path, results_dir):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{init_file}", rank=rank, world_size=2
+    )
+    try:
+        calls = []
+        sizes = auto_batch_size(
+            _trial(5 + rank, calls),
+            32,
+            {"model": "tiny"},
+            cache_path,
+            world_size=2,
+            rss_limit=2**50,
+        )
+        with open(os.path.join(results_dir, str(rank)), "w") as f:
+            json.dump({"sizes": sizes, "calls": calls}, f)
+    finally:
+        dist.destroy_process_group()
+
+
+def test_only_the_first_process_searches(tmp_path):
+    mp.spawn(
+        _distributed_search,
+        args=(str(tmp_path / "init"), str(tmp_path / "batch_size.json"), str(tmp_path)),
+        nprocs=2,
+    )
+    first, second = (json.loads((tmp_path / str(rank)).read_text()) for rank in range(2))
+    assert first["calls"] and not second["calls"]
+    assert first["sizes"] == second["sizes"] == {
+        "micro_batch_size": 4,
+        "accumulation_steps": 4,
+        "max_micro_batch_size": 5,
+    }
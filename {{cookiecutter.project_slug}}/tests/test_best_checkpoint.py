@@ -0,0 +1,64 @@
+import os
+
+import torch
+
+from {{cookiecutter.project_slug}}.utils.training import (
+    CheckpointClosure,
+    Checkpointer,
+)
+
+
+class _Closure(CheckpointClosure):
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+
+    def call(self):
+        return {
+            "model_state": {"w": torch.full((2,), float(self.batches))},
+            "trainer_state": {
+                "epochs_completed": 0,
+                "batches_in_epoch_completed": self.batches,
+            },
+        }
+
+
+def _checkpointer(tmp_path):
+    return Checkpointer(
+        tmp_path,
+        keep_most_recent_by_count=1,
+        metric_name="loss",
+        greater_is_better=False,
+        keep_best_k=2,
+        patience=3,
+    )
+
+
+def test_best_checkpoints_are_kept_and_linked(tmp_path):
+    checkpointer = _checkpointer(tmp_path)
+    losses = {1: 3.0, 2: 1.0, 3: 2.0, 4: 1.5, 5: 2.5}
+    for batches, loss in losses.items():
+        checkpointer.save_checkpoint(_Closure(batches), metrics={"loss": loss})
+        assert checkpointer.should_stop == (batches == 5)
+
+    # the 2 best and the most recent one
+    assert checkpointer._find_all_checkpoints() == {(0, 2), (0, 4), (0, 5)}
+    assert checkpointer.best_checkpoint == (1.0, 0, 2)
+    best = tmp_path / "best_model_state.pt"
+    assert torch.equal(torch.load(best)["w"], torch.full((2,), 2.0))
+    assert os.path.samefile(best, tmp_path / "model_state_e0_b2.pt")
+
+    # the ranking survives a restart
+    restarted = _checkpointer(tmp_path)
+    assert restarted.should_stop
+    assert restarted.best_checkpoint == (1.0, 0, 2)
+
+
+def test_checkpoint_saved_again_replaces_its_entry(tmp_path):
+    checkpointer = _checkpointer(tmp_path)
+    checkpointer.save_checkpoint(_Closure(1), metrics={"loss": 2.0})
+    checkpointer.save_checkpoint(_Closure(2), metrics={"loss": 1.0})
+    checkpointer.save_checkpoint(_Closure(2), metrics={"loss": 3.0})
+    assert sorted(checkpointer._best) == [(-3.0, 0, 2), (-2.0, 0, 1)]
+    assert checkpointer.best_checkpoint == (2.0, 0, 1)
+    assert sorted(_checkpointer(tmp_path)._best) == sorted(checkpointer._best)
@@ -0,0 +1,175 @@
+import copy
+import types
+
+import pytest
+import torch
+from torch import nn
+
+from {{cookiecutter.project_slug}}.utils.checkpointing import (
+    apply_activation_checkpointing,
+    auto_activation_checkpointing,
+    choose_blocks,
+    is_checkpointed,
+    matching_modules,
+    profile_checkpointing,
+    remove_activation_checkpointing,
+)
+from {{cookiecutter.project_slug}}.utils.memory import ActivationProfiler
+
+
+class Block(nn.Module):
+    def __init__(self, width):
+        super().__init__()
+        self.up = nn.Linear(16, width)
+        self.down = nn.Linear(width, 16)
+
+    def forward(self, x):
+        return x + self.down(torch.relu(self.up(x)))
+
+
+def _model():
+    torch.manual_seed(0)
+    return nn.Sequential(Block(64), Block(256), nn.Linear(16, 1))
+
+
+def _step(model, x):
+    return lambda: model(x).sum().backward()
+
+
+def test_matching_modules():
+    model = _model()
+    assert list(matching_modules(model, ["Block"])) == ["0", "1"]
+    # not the submodules of a match
+    assert list(matching_modules(model, [r"1(\.up)?"])) == ["1"]
+
+
+def test_checkpointing_keeps_gradients_and_saves_memory():
+    model = _model()
+    x = torch.randn(32, 16)
+    model(x).sum().backward()
+    expected = [p.grad.clone() for p in model.parameters()]
+    model.zero_grad()
+
+    with ActivationProfiler(model, modules=dict(model.named_children())) as eager:
+        model(x).sum().backward()
+    model.zero_grad()
+    assert apply_activation_checkpointing(model, ["Block"]) == ["0", "1"]
+    assert is_checkpointed(model[0])
+    with ActivationProfiler(model, modules=dict(model.named_children())) as profiler:
+        model(x).sum().backward()
+    for param, grad in zip(model.parameters(), expected):
+        assert torch.allclose(param.grad, grad)
+    assert profiler.stats["1"]["saved_bytes"] < eager.stats["1"]["saved_bytes"]
+    assert set(model.state_dict()) == set(_model().state_dict())
+
+    # copies call their own forward
+    model_copy = copy.deepcopy(model)
+    with torch.no_grad():
+        model_copy[2].bias.add_(1.0)
+    assert not torch.allclose(model_copy(x), model(x))
+
+    remove_activation_checkpointing(model)
+    assert not is_checkpointed(model[0])
+
+
+def test_auto_policy_prefers_memory_per_recomputed_second():
+    model = _model()
+    x = torch.randn(32, 16)
+    profile = profile_checkpointing(model, ["Block"], _step(model, x))
+    blocks = profile["blocks"]
+    assert blocks["1"]["saved_by_checkpointing"] > blocks["0"]["saved_by_checkpointing"]
+
+    fake = {
+        "step_seconds": 1.0,
+        "blocks": {
+            "a": {"saved_by_checkpointing": 100, "forward_seconds": 0.1},
+            "b": {"saved_by_checkpointing": 100, "forward_seconds": 0.2},
+            "c": {"saved_by_checkpointing": 0, "forward_seconds": 0.01},
+        },
+    }
+    assert choose_blocks(fake, max_recompute_fraction=0.25) == ["a"]
+    assert choose_blocks(fake, max_recompute_fraction=1.0) == ["a", "b"]
+    assert choose_blocks(fake, bytes_to_save=50, max_recompute_fraction=1.0) == ["a"]
+
+    report = auto_activation_checkpointing(
+        model, ["Block"], _step(model, x), max_recompute_fraction=1.0
+    )
+    assert set(report["chosen"]) == {"0", "1"}
+    assert all(is_checkpointed(model[int(name)]) for name in report["chosen"])
+
+
+class MaskedBlock(Block):
+    def forward(self, x, mask=None):
+        return super().forward(x) * mask
+
+
+def test_profile_counts_keyword_inputs_and_scales():
+    torch.manual_seed(0)
+    model = nn.ModuleDict({"block": MaskedBlock(64)})
+    x, mask = torch.randn(8, 16), torch.ones(8, 16)
+
+    def step():
+        model["block"](x, mask=mask).sum().backward()
+
+    profile = profile_checkpointing(model, ["MaskedBlock"], step)
+    block = profile["blocks"]["block"]
+    assert block["input_bytes"] == x.nbytes + mask.nbytes
+    scaled = profile_checkpointing(model, ["MaskedBlock"], step, scale=4)["blocks"]["block"]
+    assert scaled["saved_bytes"] == 4 * block["saved_bytes"]
+    assert scaled["input_bytes"] == 4 * block["input_bytes"]
+
+
+class CachingBlock(Block):
+    """Appends its input to a cache when `config.use_cache`, like a decoder block."""
+
+    def __init__(self, width, config):
+        super().__init__(width)
+        self.config = config
+
+    def forward(self, x, cache):
+        if self.config.use_cache:
+            cache.append(x)
+            # saved for the backward pass: a recomputed forward would save one entry more
+            x = (torch.stack(cache) * self.down.bias).sum(0)
+        return super().forward(x)
+
+
+class CachingModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.config = types.SimpleNamespace(use_cache=True)
+        # a copy of the config, like the decoder of T5
+        self.block = CachingBlock(64, copy.copy(self.config))
+
+    def forward(self, x):
+        return self.block(x, cache=[])
+
+
+def test_checkpointing_disables_the_cache():
+    torch.manual_seed(0)
+    model = CachingModel()
+    x = torch.randn(8, 16)
+    assert apply_activation_checkpointing(model, ["CachingBlock"]) == ["block"]
+    assert model.config.use_cache is False
+    assert model.block.config.use_cache is False
+    model(x).sum().backward()
+    assert model.block.up.weight.grad is not None
+
+
+def test_checkpointing_t5_blocks():
+    transformers = pytest.importorskip("transformers")
+    torch.manual_seed(0)
+    config = transformers.T5Config(
+        vocab_size=32,
+        d_model=16,
+        d_kv=8,
+        d_ff=32,
+        num_layers=2,
+        num_heads=2,
+        decoder_start_token_id=0,
+    )
+    model = transformers.T5ForConditionalGeneration(config).train()
+    apply_activation_checkpointing(model, ["T5Block"])
+    input_ids, labels = torch.randint(32, (2, 5)), torch.randint(32, (2, 4))
+    model(input_ids=input_ids, labels=labels).loss.backward()
+    assert model.shared.weight.grad is not None
@@ -0,0 +1,54 @@
+import torch
+from torch.utils.data import DataLoader
+
+from {{cookiecutter.project_slug}}.utils.collate import Prefetcher, SharedMemoryPadCollator
+
+
+def _examples(n):
+    return [
+        {"input_ids": list(range(1, i % 5 + 2)), "labels": [7] * (i % 3 + 1), "id": i}
+        for i in range(n)
+    ]
+
+
+def _collator(**kwargs):
+    return SharedMemoryPadCollator(
+        {"input_ids": 0, "labels": -100}, max_batch_size=4, max_length=8, **kwargs
+    )
+
+
+def test_pads_into_reused_buffers():
+    collator = _collator(num_slots=2, pad_to_multiple_of=4)
+    examples = _examples(3)
+    batch = collator(examples)
+    assert batch["input_ids"].tolist() == [
+        [1, 0, 0, 0],
+        [1, 2, 0, 0],
+        [1, 2, 3, 0],
+    ]
+    assert batch["labels"].tolist() == [[7, -100, -100, -100], [7, 7, -100, -100], [7, 7, 7, -100]]
+    assert batch["id"].tolist() == [0, 1, 2]
+    assert batch["input_ids"].is_contiguous()
+    assert "attention_mask" not in batch
+
+    with_mask = _collator(attention_mask_of="input_ids")(examples)
+    assert torch.equal(with_mask["attention_mask"], (with_mask["input_ids"] != 0).long())
+
+    second = collator(examples)
+    third = collator(examples)
+    assert second["input_ids"].data_ptr() != batch["input_ids"].data_ptr()
+    assert third["input_ids"].data_ptr() == batch["input_ids"].data_ptr()
+
+
+def test_in_workers_with_prefetcher():
+    examples = _examples(20)
+    loader = DataLoader(examples, batch_size=4, num_workers=1, collate_fn=_collator())
+    expected = [_collator()(examples[i : i + 4]) for i in range(0, 20, 4)]
+    num_batches = 0
+    # the batches are only valid until their buffers are reused
+    for batch, reference in zip(Prefetcher(loader, "cpu"), expected):
+        assert torch.equal(batch["input_ids"], reference["input_ids"])
+        assert torch.equal(batch["labels"], reference["labels"])
+        assert batch["input_ids"].is_shared()
+        num_batches += 1
+    assert num_batches == len(expected)
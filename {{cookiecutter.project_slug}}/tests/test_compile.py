@@ -0,0 +1,83 @@
+import pytest
+import torch
+from torch import nn
+
+from {{cookiecutter.project_slug}}.utils import nn as nn_utils
+from {{cookiecutter.project_slug}}.utils.compile import (
+    CompileMonitor,
+    compile_supported,
+    compiled_masked_ops,
+    maybe_compile,
+    set_compile_cache_dir,
+)
+
+
+@pytest.fixture(autouse=True)
+def _reset_dynamo():
+    torch._dynamo.reset()
+    yield
+    torch._dynamo.reset()
+
+
+def test_disabled_and_unsupported_return_the_model():
+    model = nn.Linear(4, 2)
+    assert maybe_compile(model, enabled=False) is model
+    assert maybe_compile(model, enabled=False).forward == model.forward
+    supported, reason = compile_supported("cuda")
+    if not torch.cuda.is_available():
+        assert not supported and reason
+
+
+def test_compiled_module_keeps_state_dict():
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Linear(4, 8), nn.ReLU(), nn.Linear(8, 2))
+    keys = set(model.state_dict())
+    x = torch.randn(3, 4)
+    expected = model(x)
+    assert maybe_compile(model, backend="eager") is model
+    assert torch.allclose(model(x), expected)
+    assert set(model.state_dict()) == keys
+
+
+def test_monitor_reports_graph_breaks_and_recompiles():
+    def fn(x):
+        x = x * 2
+        print("", end="")  # graph break
+        return x + 1
+
+    compiled = maybe_compile(fn, backend="eager")
+    with CompileMonitor() as monitor:
+        compiled(torch.ones(3))
+        compiled(torch.ones(3, dtype=torch.float64))  # dtype guard fails
+    report = monitor.report()
+    assert sum(report["graph_breaks"].values()) >= 1
+    assert report["recompiles"]
+    assert any("dtype" in message for message in report["recompiles"])
+    monitor.log()
+
+
+def test_monitor_restores_only_the_recompiles_setting():
+    from torch._logging._internal import log_state
+
+    torch._logging.set_logs(graph_breaks=True)
+    try:
+        with CompileMonitor():
+            assert log_state.is_artifact_enabled("recompiles")
+        assert log_state.is_artifact_enabled("graph_breaks")
+        assert not log_state.is_artifact_enabled("recompiles")
+    finally:
+        torch._logging.set_logs()
+
+
+@pytest.mark.skipif(not compile_supported("cpu")[0], reason="no C++ compiler")
+def test_compiled_masked_ops(tmp_path):
+    set_compile_cache_dir(tmp_path)
+    ops = compiled_masked_ops()
+    torch.manual_seed(0)
+    lengths = torch.tensor([3, 5, 1])
+    mask = nn_utils.get_mask_from_sequence_lengths(lengths, 5)
+    assert torch.equal(ops["get_mask_from_sequence_lengths"](lengths, 5), mask)
+    vector = torch.randn(3, 5, 4)
+    expected = nn_utils.masked_mean(vector, mask.unsqueeze(-1), dim=1)
+    assert torch.allclose(ops["masked_mean"](vector, mask.unsqueeze(-1), dim=1), expected)
+    assert any((tmp_path / "inductor").iterdir())
@@ -0,0 +1,55 @@
+{% if cookiecutter.command_line_interface == "hydra" %}
+import types
+
+import pytest
+
+from {{cookiecutter.project_slug}} import __main__ as cli
+from {{cookiecutter.project_slug}}.utils import config_cache
+from {{cookiecutter.project_slug}}.utils.config_cache import compose_config
+
+
+def test_compose_config_is_cached_until_yaml_changes(tmp_path):
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    (config_dir / "train.yaml").write_text("seed: 1\nout: ${now:%H}\n")
+
+    def compose(overrides):
+        return compose_config(
+            str(config_dir),
+            "train",
+            overrides,
+            task_name="train",
+            cache_dir=tmp_path / "cache",
+            version_base="1.3",
+        )
+
+    cfg, hit = compose(["seed=2"])
+    assert not hit and cfg.seed == 2
+    cfg, hit = compose(["seed=2"])
+    assert hit and cfg.seed == 2
+    assert cfg.hydra.job.name == "train"
+    _, hit = compose(["seed=3"])
+    assert not hit
+
+    (config_dir / "train.yaml").write_text("seed: 1\nlr: 0.1\n")
+    cfg, hit = compose(["seed=2"])
+    assert not hit and cfg.lr == 0.1
+
+
+def test_falls_back_to_hydra_main(monkeypatch):
+    assert config_cache._can_use_cache(["seed=2"])
+    assert not config_cache._can_use_cache(["--multirun", "seed=2,3"])
+    monkeypatch.setattr(config_cache.hydra, "__version__", "9.0.0")
+    assert not config_cache._can_use_cache(["seed=2"])
+
+
+@pytest.mark.parametrize("ret, status", [(None, 0), (3, 3), (0.5, 0), ({"loss": 1.0}, 0)])
+def test_only_int_results_are_exit_statuses(monkeypatch, ret, status):
+    monkeypatch.setattr(cli, "available_commands", lambda: ["train"])
+    monkeypatch.setattr(cli, "_configure_logging", lambda: None)
+    monkeypatch.setattr(
+        cli.importlib, "import_module", lambda name: types.SimpleNamespace(main=lambda: ret)
+    )
+    monkeypatch.setattr(cli.sys, "argv", ["prog", "train"])
+    assert cli.main() == status
+{% endif %}
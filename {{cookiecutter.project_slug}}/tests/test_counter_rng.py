@@ -0,0 +1,43 @@
+import numpy as np
+
+from {{cookiecutter.project_slug}}.utils.counter_rng import CounterRNG, philox4x32
+
+
+def test_philox4x32_known_answers():
+    # Known answer tests from Random123
+    counters = np.array(
+        [
+            [0, 0, 0, 0],
+            [0xFFFFFFFF] * 4,
+            [0x243F6A88, 0x85A308D3, 0x13198A2E, 0x03707344],
+        ],
+        dtype=np.uint32,
+    )
+    keys = np.array(
+        [[0, 0], [0xFFFFFFFF] * 2, [0xA4093822, 0x299F31D0]], dtype=np.uint32
+    )
+    expected = np.array(
+        [
+            [0x6627E8D5, 0xE169C58D, 0xBC57AC4C, 0x9B00DBD8],
+            [0x408F276D, 0x41C83B0E, 0xA20BC7C6, 0x6D5451FD],
+            [0xD16CFE09, 0x94FDCCEB, 0x5001E420, 0x24126EA1],
+        ],
+        dtype=np.uint32,
+    )
+    np.testing.assert_array_equal(philox4x32(counters, keys), expected)
+
+
+def test_draws_are_independent_of_batching():
+    rng = CounterRNG(seed=7, epoch=3)
+    batch = rng.uniform(np.arange(10), size=5)
+    assert batch.shape == (10, 5)
+    assert ((batch >= 0) & (batch < 1)).all()
+    np.testing.assert_array_equal(rng.uniform([4], size=5)[0], batch[4])
+    assert not np.array_equal(rng.with_epoch(4).uniform([4], size=5)[0], batch[4])
+
+
+def test_permutation():
+    rng = CounterRNG(seed=7)
+    perm = rng.permutation(100)
+    np.testing.assert_array_equal(np.sort(perm), np.arange(100))
+    np.testing.assert_array_equal(perm, CounterRNG(seed=7).permutation(100))
@@ -0,0 +1,42 @@
+import logging
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from {{cookiecutter.project_slug}}.utils.data_monitor import MonitoredLoader
+from {{cookiecutter.project_slug}}.utils.rate_limit import _LIMITERS
+
+
+class _SlowDataset(Dataset):
+    def __len__(self):
+        return 16
+
+    def __getitem__(self, index):
+        time.sleep(0.01)
+        return torch.tensor(index)
+
+
+def test_starved_loader_is_reported(caplog):
+    _LIMITERS.clear()
+    loader = MonitoredLoader(
+        DataLoader(_SlowDataset(), batch_size=2), warmup_steps=2, sample_every=1
+    )
+    with caplog.at_level(logging.WARNING):
+        batches = [batch for batch in loader]
+    assert torch.equal(torch.cat(batches), torch.arange(16))
+    assert loader.num_steps == 8
+    assert loader.data_fraction > 0.9
+    assert "Data-starved" in caplog.text
+    assert loader.postfix()["data"].endswith("%")
+
+
+def test_queue_is_sampled_with_workers():
+    loader = MonitoredLoader(
+        DataLoader(_SlowDataset(), batch_size=2, num_workers=1), sample_every=1
+    )
+    for _ in loader:
+        time.sleep(0.02)
+    assert len(loader.ready) > 0
+    assert set(loader.postfix()) == {"data", "ready", "busy"}
+    assert loader.summary()["data_fraction"] < 1
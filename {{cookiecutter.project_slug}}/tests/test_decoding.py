@@ -0,0 +1,98 @@
+from collections import Counter
+
+import pytest
+import torch
+
+from {{cookiecutter.project_slug}}.commands.benchmark_decoding import (
+    TinySeq2Seq,
+    TinySeq2SeqAdapter,
+)
+from {{cookiecutter.project_slug}}.utils.decoding import BatchDecoder, pad_to
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return TinySeq2Seq(d_model=16, num_heads=2, max_positions=32).double().eval()
+
+
+def _decode(model, inputs, eos_token_id, **kwargs):
+    decoder = BatchDecoder(
+        TinySeq2SeqAdapter(model),
+        max_new_tokens=12,
+        eos_token_id=eos_token_id,
+        **kwargs,
+    )
+    return decoder.generate(inputs), decoder.stats
+
+
+def test_pad_to():
+    x = torch.ones(2, 3, dtype=torch.bool)
+    assert pad_to(x, 5, dim=1, left=True)[:, :2].sum() == 0
+    assert pad_to(x, 2, dim=1) is x
+
+
+def test_continuous_batching_matches_one_by_one_decoding(model):
+    generator = torch.Generator().manual_seed(0)
+    inputs = [
+        torch.randint(3, 32, (int(n),), generator=generator).tolist()
+        for n in torch.randint(1, 20, (23,), generator=generator)
+    ]
+    # an EOS the model actually produces, so that sequences finish at different steps
+    free_running, _ = _decode(model, inputs, None, batch_size=1)
+    eos = Counter(t for output in free_running for t in output).most_common(1)[0][0]
+
+    expected, _ = _decode(model, inputs, eos, batch_size=1)
+    assert any(len(output) < 12 for output in expected)
+    fixed, fixed_stats = _decode(
+        model, inputs, eos, batch_size=8, continuous=False, sort_by_length=False
+    )
+    continuous, stats = _decode(model, inputs, eos, batch_size=8, refill_fraction=0.1)
+    assert fixed == expected
+    assert continuous == expected
+    assert stats["tokens"] == sum(len(output) for output in expected)
+    assert stats["efficiency"] == 1.0
+    assert fixed_stats["efficiency"] < 1.0
+
+
+def test_hf_seq2seq_adapter_matches_generate():
+    transformers = pytest.importorskip("transformers")
+    from {{cookiecutter.project_slug}}.utils.decoding import HFSeq2SeqAdapter
+
+    torch.manual_seed(0)
+    # larger initial weights than T5's, so that the outputs differ and end at different steps
+    config = transformers.T5Config(
+        vocab_size=16,
+        d_model=16,
+        d_kv=8,
+        d_ff=32,
+        num_layers=2,
+        num_heads=2,
+        decoder_start_token_id=0,
+        pad_token_id=0,
+        eos_token_id=1,
+        initializer_factor=3.0,
+    )
+    model = transformers.T5ForConditionalGeneration(config).double().eval()
+    generator = torch.Generator().manual_seed(0)
+    inputs = [
+        torch.randint(2, 16, (int(n),), generator=generator).tolist()
+        for n in torch.randint(1, 12, (9,), generator=generator)
+    ]
+    decoder = BatchDecoder(
+        HFSeq2SeqAdapter(model),
+        batch_size=4,
+        max_new_tokens=10,
+        eos_token_id=1,
+        refill_fraction=0.25,
+    )
+    outputs = decoder.generate(inputs)
+    with torch.no_grad():
+        expected = [
+            model.generate(
+                torch.tensor([ids]), do_sample=False, num_beams=1, max_new_tokens=10
+            )[0, 1:].tolist()
+            for ids in inputs
+        ]
+    assert len({len(output) for output in outputs}) > 1
+    assert outputs == expected
@@ -0,0 +1,130 @@
+import pytest
+import torch
+from torch import nn
+
+from {{cookiecutter.project_slug}}.utils.frozen import (
+    cast_frozen_modules,
+    check_frozen,
+    format_memory_report,
+    freeze,
+    frozen_memory_report,
+    offload_frozen_modules,
+    trainable_param_groups,
+)
+
+
+class Model(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.encoder = nn.Sequential(nn.Linear(8, 16), nn.LayerNorm(16))
+        self.head = nn.Linear(16, 4)
+
+    def forward(self, x):
+        return self.head(self.encoder(x))
+
+
+def test_param_groups_hold_only_trainable_params():
+    model = Model()
+    assert freeze(model, [r"^encoder\."]) == [
+        "encoder.0.weight",
+        "encoder.0.bias",
+        "encoder.1.weight",
+        "encoder.1.bias",
+    ]
+    groups = trainable_param_groups(model, weight_decay=0.1)
+    assert [len(g["params"]) for g in groups] == [1, 1]
+    assert groups[0]["params"][0] is model.head.weight
+    assert groups[1]["weight_decay"] == 0.0
+
+    optimizer = torch.optim.AdamW(groups)
+    model(torch.randn(2, 8)).sum().backward()
+    optimizer.step()
+    check_frozen(model, optimizer)
+    report = frozen_memory_report(model, optimizer)
+    assert report["trainable_params"] == 16 * 4 + 4
+    assert report["gradient_bytes"] == report["trainable_bytes"]
+    assert report["optimizer_state_bytes"] >= 2 * report["trainable_bytes"]
+    assert "Frozen parameters: 176" in format_memory_report(report)
+
+    with pytest.raises(ValueError, match="encoder.0.weight is in the optimizer"):
+        check_frozen(model, torch.optim.SGD(model.parameters(), lr=0.1))
+
+
+def test_cast_frozen_modules():
+    torch.manual_seed(0)
+    model = Model()
+    x = torch.randn(2, 8)
+    expected = model(x)
+    freeze(model, [r"^encoder\."])
+    saved = cast_frozen_modules(model, torch.bfloat16)
+    assert saved == frozen_memory_report(model)["frozen_bytes"]
+    assert model.encoder[0].weight.dtype == torch.bfloat16
+    assert model.head.weight.dtype == torch.float32
+    output = model(x)
+    assert output.dtype == torch.float32
+    assert torch.allclose(output, expected, atol=0.1)
+    output.sum().backward()
+    assert model.head.weight.grad is not None
+
+
+class _Stack(nn.Module):
+    def __init__(self, embed_tokens):
+        super().__init__()
+        self.embed_tokens = embed_tokens
+        self.layer = nn.Linear(8, 8)
+
+    def forward(self, input_ids):
+        return self.layer(self.embed_tokens(input_ids))
+
+
+class TiedModel(nn.Module):
+    """Embeddings shared by the model, its encoder and its decoder, like T5."""
+
+    def __init__(self):
+        super().__init__()
+        self.shared = nn.Embedding(10, 8)
+        self.encoder = _Stack(self.shared)
+        self.decoder = _Stack(self.shared)
+        self.head = nn.Linear(8, 10)
+
+    def forward(self, input_ids):
+        hidden = self.encoder(input_ids) + self.decoder(input_ids) + self.shared(input_ids)
+        return self.head(hidden)
+
+
+def test_cast_frozen_modules_with_tied_embeddings():
+    torch.manual_seed(0)
+    model = TiedModel()
+    input_ids = torch.randint(10, (2, 5))
+    expected = model(input_ids)
+    freeze(model, [r"^encoder\.", r"^decoder\."])
+    assert not model.shared.weight.requires_grad
+    cast_frozen_modules(model, torch.bfloat16)
+    assert model.encoder.layer.weight.dtype == torch.bfloat16
+    assert model.decoder.layer.weight.dtype == torch.bfloat16
+    assert model.shared.weight.dtype == torch.bfloat16
+    output = model(input_ids)
+    assert output.dtype == torch.float32
+    assert torch.allclose(output, expected, atol=0.1)
+    output.sum().backward()
+    assert model.head.weight.grad is not None
+
+
+def test_shared_frozen_parameters_are_not_cast():
+    model = Model()
+    model.head.weight = model.encoder[0].weight  # type: ignore[assignment]
+    model.encoder[0].weight.requires_grad_(False)
+    model.encoder[0].bias.requires_grad_(False)
+    assert cast_frozen_modules(model, torch.bfloat16) == 0
+
+
+def test_offload_frozen_modules():
+    torch.manual_seed(0)
+    model = Model()
+    x = torch.randn(2, 8)
+    expected = model(x)
+    freeze(model, [r"^encoder\."])
+    # nothing to offload from the CPU, but the weights go through the hooks
+    assert offload_frozen_modules(model, "cpu") == 0
+    assert torch.equal(model(x), expected)
+    assert model.encoder[0].weight.device.type == "cpu"
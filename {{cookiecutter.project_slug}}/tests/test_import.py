@@ -1,2 +1,38 @@
+import subprocess
+import sys
+
+# Heavy dependencies that must not be imported by `import {{cookiecutter.project_slug}}`
+HEAVY_MODULES = ("torch", "numpy", "rich", "omegaconf", "hydra")
+IMPORT_TIME_BUDGET_US = 500_000
+
+
+def _import_times(statement):
+    """Cumulative import time (in us) of every module imported by `statement`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
 def test_import():
     import {{cookiecutter.project_slug}}
+
+
+def test_import_time_budget():
+    times = _import_times(
+        "import {{cookiecutter.project_slug}}.utils, {{cookiecutter.project_slug}}.__main__"
+    )
+    heavy = sorted(
+        name for name in times if name.split(".")[0] in HEAVY_MODULES
+    )
+    assert not heavy
+    assert times["{{cookiecutter.project_slug}}"] < IMPORT_TIME_BUDGET_US
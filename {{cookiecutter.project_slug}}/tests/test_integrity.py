@@ -0,0 +1,150 @@
+import contextlib
+import io
+
+import pytest
+import torch
+
+from {{cookiecutter.project_slug}}.commands.verify import main as verify_main
+from {{cookiecutter.project_slug}}.utils.integrity import (
+    ChecksumError,
+    ChecksummedIO,
+    _ChunkHasher,
+    chunk_digests,
+    manifest_name,
+)
+from {{cookiecutter.project_slug}}.utils.storage import LocalStorage
+from {{cookiecutter.project_slug}}.utils.training import (
+    CheckpointClosure,
+    Checkpointer,
+)
+
+
+class _Closure(CheckpointClosure):
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+
+    def call(self):
+        return {
+            "model_state": {"w": torch.full((1000,), float(self.batches))},
+            "trainer_state": {
+                "epochs_completed": 0,
+                "batches_in_epoch_completed": self.batches,
+            },
+        }
+
+
+def test_chunk_digests_threaded_matches_serial():
+    data = bytes(range(256)) * 1000
+    io = ChecksummedIO(LocalStorage("."), chunk_size=4096)
+    try:
+        assert chunk_digests(data, 4096, "blake2b", io.executor) == chunk_digests(
+            data, 4096, "blake2b"
+        )
+        # streamed in pieces that do not line up with the chunks
+        hasher = _ChunkHasher(4096, "blake2b", io.executor, max_pending=2)
+        for start in range(0, len(data), 3000):
+            hasher.update(data[start : start + 3000])
+        assert hasher.size == len(data)
+        assert hasher.digests() == chunk_digests(data, 4096, "blake2b")
+    finally:
+        io.close()
+
+
+def test_checksum_threads_are_started_on_demand(tmp_path):
+    checkpointer = Checkpointer(tmp_path, checksums=False)
+    checkpointer.save_checkpoint(_Closure(1))
+    assert checkpointer._checksummed_io is None
+
+    checkpointer = Checkpointer(tmp_path, checksums=True)
+    checkpointer.save_checkpoint(_Closure(2))
+    assert checkpointer._io._executor is not None
+    checkpointer.wait_until_saved()
+    assert checkpointer._io._executor is not None
+    checkpointer.close()
+    assert checkpointer._checksummed_io._executor is None
+
+
+def test_corrupted_checkpoint_is_skipped(tmp_path, capsys):
+    checkpointer = Checkpointer(tmp_path, keep_most_recent_by_count=None, checksums=True)
+    for batches in (1, 2):
+        checkpointer.save_checkpoint(_Closure(batches))
+    assert (tmp_path / manifest_name("model_state_e0_b2.pt")).exists()
+
+    assert verify_main([str(tmp_path)]) == 0
+    path = tmp_path / "model_state_e0_b2.pt"
+    data = bytearray(path.read_bytes())
+    data[-100] ^= 0xFF
+    path.write_bytes(bytes(data))
+    assert verify_main([str(tmp_path)]) == 1
+    assert "CORRUPTED" in capsys.readouterr().out
+
+    states = checkpointer.load_checkpoint()
+    assert states["trainer_state"]["batches_in_epoch_completed"] == 1
+    assert torch.equal(states["model_state"]["w"], torch.full((1000,), 1.0))
+
+
+def test_verify_without_files_fails(tmp_path, capsys):
+    assert verify_main([str(tmp_path / "missing")]) == 2
+    assert "not a directory" in capsys.readouterr().err
+    (tmp_path / "model_state_e0_b1.pt").write_bytes(b"")
+    assert verify_main([str(tmp_path), "--pattern", "*.bin"]) == 2
+    assert "No files match" in capsys.readouterr().err
+
+
+class _CountingStorage(LocalStorage):
+    def __init__(self, root, seekable=True):
+        super().__init__(root)
+        self.seekable = seekable
+        self.bytes_read = 0
+
+    @contextlib.contextmanager
+    def open_read(self, name):
+        with super().open_read(name) as f:
+            storage = self
+
+            class Reader(io.RawIOBase):
+                def readinto(self, buffer):
+                    n = f.readinto(buffer)
+                    storage.bytes_read += n
+                    return n
+
+                def seek(self, offset, whence=0):
+                    return f.seek(offset, whence)
+
+                def tell(self):
+                    return f.tell()
+
+                def readable(self):
+                    return True
+
+                def seekable(self):
+                    return storage.seekable
+
+            yield Reader()
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+@pytest.mark.parametrize("corrupt_at", [None, "tensor", "zip directory"])
+def test_load_reads_once_and_verifies(tmp_path, seekable, corrupt_at):
+    storage = _CountingStorage(tmp_path, seekable)
+    checksummed_io = ChecksummedIO(storage, chunk_size=4096)
+    # bigger than the gaps `_HashingReader` fills, so the zip directory is read out of order
+    obj = {"a": torch.arange(300000), "b": torch.ones(3000)}
+    checksummed_io.save(obj, "x.pt")
+    path = tmp_path / "x.pt"
+    size = path.stat().st_size
+    if corrupt_at is not None:
+        data = bytearray(path.read_bytes())
+        data[size // 2 if corrupt_at == "tensor" else size - 10] ^= 0xFF
+        path.write_bytes(bytes(data))
+    try:
+        if corrupt_at is None:
+            loaded = checksummed_io.load("x.pt")
+            assert torch.equal(loaded["a"], obj["a"]) and torch.equal(loaded["b"], obj["b"])
+            assert storage.bytes_read < 1.2 * size
+        else:
+            with pytest.raises(ChecksumError):
+                checksummed_io.load("x.pt")
+    finally:
+        checksummed_io.close()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from {{cookiecutter.project_slug}}.utils.length_index import (
+    LengthGroupedBatchSampler,
+    LengthIndex,
+)
+from {{cookiecutter.project_slug}}.utils.memmap_dataset import (
+    MemmapTokenDataset,
+    build_memmap_dataset,
+)
+
+
+def test_compact_storage_and_roundtrip(tmp_path):
+    index = LengthIndex({"source": [3, 70000], "target": [1, 2]})
+    assert index["source"].dtype == np.uint32
+    assert index["target"].dtype == np.uint16
+    index.save(tmp_path)
+    loaded = LengthIndex.load(tmp_path)
+    assert loaded["source"].tolist() == [3, 70000]
+    assert loaded["target"].dtype == np.uint16
+    with pytest.raises(ValueError):
+        LengthIndex({"source": [1], "target": [1, 2]})
+
+
+def test_select_and_buckets():
+    index = LengthIndex({"source": [5, 1, 9, 3], "target": [2, 8, 4, 6]})
+    assert index.select(max_lengths={"target": 5}).tolist() == [0, 2]
+    assert index.select(
+        max_lengths={"target": 6}, min_lengths={"source": 4}
+    ).tolist() == [0, 2]
+    buckets = index.buckets("target", boundaries=[2, 5])
+    assert [b.tolist() for b in buckets] == [[0], [2], [1, 3]]
+
+
+def test_memmap_dataset_writes_the_index(tmp_path):
+    examples = [{"source": [1, 2], "target": [3]}, {"source": [], "target": [4, 5, 6]}]
+    dataset = MemmapTokenDataset(build_memmap_dataset(examples, tmp_path / "train", 10))
+    assert LengthIndex.exists(dataset.directory)
+    index = dataset.length_index()
+    assert index["source"].tolist() == [2, 0]
+    assert index["target"].tolist() == [1, 3]
+
+
+def test_length_grouped_batches():
+    lengths = np.random.default_rng(0).integers(1, 100, size=103)
+    sampler = LengthGroupedBatchSampler(lengths, batch_size=8, window_batches=4)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted(i for batch in batches for i in batch) == list(range(103))
+    # batches are sorted by length within a window
+    assert all(np.all(np.diff(lengths[batch]) >= 0) for batch in batches)
+    sampler.set_epoch(1)
+    assert list(sampler) != batches
+    dropped = LengthGroupedBatchSampler(lengths, 8, window_batches=4, drop_last=True)
+    assert len(list(dropped)) == len(dropped)
+    assert all(len(batch) == 8 for batch in dropped)
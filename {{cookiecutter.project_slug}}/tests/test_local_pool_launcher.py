@@ -0,0 +1,74 @@
+{% if cookiecutter.command_line_interface == "hydra" %}
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+APP = """
+import logging
+import os
+
+import hydra
+
+
+@hydra.main(version_base="1.3", config_path=None, config_name=None)
+def main(cfg):
+    logging.getLogger(__name__).info(f"job {cfg.x}")
+    if cfg.get("fail") == cfg.x:
+        raise ValueError(f"job {cfg.x} failed")
+    with open("result.txt", "w") as f:
+        f.write(f"{cfg.x} {os.environ['OMP_NUM_THREADS']} {len(os.sched_getaffinity(0))}")
+    return {"num_samples": 10}
+
+
+if __name__ == "__main__":
+    main()
+"""
+
+
+def _multirun(tmp_path, *overrides, check=True):
+    (tmp_path / "app.py").write_text(APP)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(SRC), os.environ.get("PYTHONPATH", "")]))
+    return subprocess.run(
+        [
+            sys.executable,
+            "app.py",
+            "-m",
+            "hydra/launcher=local_pool",
+            "hydra.launcher.n_jobs=2",
+            "hydra.launcher.cpus_per_job=1",
+            "hydra.sweep.dir=sweep",
+            "hydra.job.chdir=true",
+            "+x=1,2,3",
+            *overrides,
+        ],
+        cwd=tmp_path,
+        env=env,
+        check=check,
+        capture_output=not check,
+    )
+
+
+def test_multirun_in_local_pool(tmp_path):
+    _multirun(tmp_path)
+    results = sorted((tmp_path / "sweep").glob("*/result.txt"))
+    assert [r.read_text() for r in results] == ["1 1 1", "2 1 1", "3 1 1"]
+    report = json.loads((tmp_path / "sweep" / "launcher_report.json").read_text())
+    assert [job["status"] for job in report["jobs"]] == ["COMPLETED"] * 3
+    assert all(job["throughput"] > 0 for job in report["jobs"])
+    # the logs of every job are flushed to its log file before the process exits
+    assert all(
+        f"job {x}" in (tmp_path / "sweep" / str(x - 1) / "app.log").read_text()
+        for x in (1, 2, 3)
+    )
+
+
+def test_failed_job_is_reported(tmp_path):
+    _multirun(tmp_path, "+fail=2", check=False)
+    report = json.loads((tmp_path / "sweep" / "launcher_report.json").read_text())
+    assert [job["status"] for job in report["jobs"]] == ["COMPLETED", "FAILED", "COMPLETED"]
+    assert "throughput" not in report["jobs"][1]
+{% endif %}
@@ -0,0 +1,53 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from {{cookiecutter.project_slug}}.utils.memmap_dataset import (
+    MemmapTokenDataset,
+    build_memmap_dataset,
+    fingerprint,
+    is_memmap_dataset,
+)
+
+
+def _examples():
+    return [
+        {"source": [1, 2, 3], "target": [4]},
+        {"source": [], "target": [5, 6]},
+        {"source": [70000], "target": [7, 8, 9]},
+    ]
+
+
+@pytest.mark.parametrize("vocab_size,dtype", [(100, np.uint16), (80000, np.uint32)])
+def test_roundtrip(tmp_path, vocab_size, dtype):
+    examples = _examples() if vocab_size > 70000 else _examples()[:2]
+    directory = build_memmap_dataset(examples, tmp_path / "train", vocab_size)
+    assert is_memmap_dataset(directory)
+    assert not (tmp_path / "train.tmp").exists()
+
+    dataset = MemmapTokenDataset(directory, rename={"source": "input_ids"})
+    assert len(dataset) == len(examples)
+    for i, example in enumerate(examples):
+        item = dataset[i]
+        assert item["input_ids"].dtype == dtype
+        assert item["input_ids"].tolist() == example["source"]
+        assert item["target"].tolist() == example["target"]
+    assert dataset.lengths("target").tolist() == [len(e["target"]) for e in examples]
+    # workers re-open the maps
+    assert pickle.loads(pickle.dumps(dataset))[-1]["target"].tolist() == examples[-1]["target"]
+
+
+def test_out_of_vocabulary_tokens_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        build_memmap_dataset(_examples(), tmp_path / "train", vocab_size=100)
+    assert not is_memmap_dataset(tmp_path / "train")
+
+
+def test_fingerprint_mismatch_is_not_reused(tmp_path):
+    key = fingerprint({"tokenizer": "t5-small", "max_length": 50})
+    assert key == fingerprint({"max_length": 50, "tokenizer": "t5-small"})
+    directory = build_memmap_dataset(_examples()[:2], tmp_path / "train", 100, fingerprint=key)
+    assert is_memmap_dataset(directory)
+    assert is_memmap_dataset(directory, key)
+    assert not is_memmap_dataset(directory, fingerprint({"tokenizer": "t5-small", "max_length": 64}))
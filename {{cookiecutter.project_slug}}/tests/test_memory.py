@@ -0,0 +1,69 @@
+import json
+
+import pytest
+import torch
+from torch import nn
+
+from {{cookiecutter.project_slug}}.utils.memory import (
+    ActivationProfiler,
+    format_memory_table,
+    log_memory_report,
+    memory_report,
+    module_memory,
+)
+
+
+def _model():
+    return nn.Sequential(
+        nn.Linear(8, 32),
+        nn.Sequential(nn.ReLU(), nn.Linear(32, 4)),
+    )
+
+
+def test_module_memory_counts_params_grads_and_optimizer_states():
+    model = _model()
+    optimizer = torch.optim.Adam(model.parameters())
+    model(torch.randn(2, 8)).sum().backward()
+    optimizer.step()
+    rows = module_memory(model, optimizer)
+    assert rows["0"]["params"] == 8 * 32 + 32
+    assert rows["0"]["param_bytes"] == 4 * rows["0"]["params"]
+    assert rows["1"]["grad_bytes"] == 4 * (32 * 4 + 4)
+    # exp_avg and exp_avg_sq
+    assert rows["1"]["optimizer_bytes"] >= 2 * rows["1"]["param_bytes"]
+    assert set(module_memory(model, depth=2)) == {"0", "1.1"}
+
+
+def test_activation_profiler(tmp_path):
+    model = _model()
+    x = torch.randn(16, 8)
+    with ActivationProfiler(model, depth=2) as profiler:
+        model(x).sum().backward()
+    # the input of the first layer is saved for the backward pass, and so is the output of
+    # the ReLU, which is counted once although the last layer saves it too
+    assert profiler.stats["0"]["saved_bytes"] == x.numel() * 4
+    assert profiler.stats["1.0"]["saved_bytes"] == 16 * 32 * 4
+    assert profiler.stats["1.1"]["saved_bytes"] == 0
+    assert profiler.stats["1.0"]["output_bytes"] == 16 * 32 * 4
+    assert all(stat["calls"] == 1 for stat in profiler.stats.values())
+    # the hooks are removed
+    model(x)
+    assert profiler.stats["0"]["calls"] == 1
+
+    report = memory_report(model, profiler=profiler)
+    assert report["total"]["params"] == sum(p.numel() for p in model.parameters())
+    assert "1.1" in format_memory_table(report)
+    log_memory_report(report, tmp_path / "memory.json")
+    assert json.loads((tmp_path / "memory.json").read_text())["modules"]["0"]["calls"] == 1
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="needs CUDA")
+def test_profiler_keeps_the_global_cuda_peak():
+    model = _model().cuda()
+    big = torch.empty(2**26, device="cuda")
+    del big
+    peak = torch.cuda.max_memory_allocated()
+    with ActivationProfiler(model) as profiler:
+        model(torch.randn(2, 8, device="cuda")).sum().backward()
+    assert torch.cuda.max_memory_allocated() >= peak
+    assert all(stat["peak_bytes"] >= 0 for stat in profiler.stats.values())
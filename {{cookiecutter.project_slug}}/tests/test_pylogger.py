@@ -0,0 +1,90 @@
+import logging
+
+import pytest
+
+from {{cookiecutter.project_slug}}.utils import pylogger
+from {{cookiecutter.project_slug}}.utils.pylogger import (
+    RankFilter,
+    get_pylogger,
+    setup_queue_logging,
+    stop_queue_logging,
+)
+from {{cookiecutter.project_slug}}.utils.rank_zero import rank_zero_only
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@pytest.fixture
+def root_logger(monkeypatch):
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    monkeypatch.setattr(pylogger, "_queue_logging", None)
+    monkeypatch.setattr(pylogger, "_queue_logging_pid", None)
+    yield root
+    stop_queue_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def _record(level, msg, *args):
+    return logging.LogRecord("test", level, __file__, 1, msg, args, None)
+
+
+def test_rank_filter_samples_debug_and_aggregates_warnings():
+    rank_filter = RankFilter(rank=1, debug_every=2)
+    kept_debug = [rank_filter.filter(_record(logging.DEBUG, "d")) for _ in range(4)]
+    assert kept_debug == [True, False, True, False]
+    kept_warnings = [
+        rank_filter.filter(_record(logging.WARNING, "slow step %d", i))
+        for i in range(3)
+    ]
+    assert kept_warnings == [True, False, False]
+    assert rank_filter.summary() == [
+        "[rank: 1] test: 2 more warning(s) like 'slow step %d'"
+    ]
+
+
+def test_rank_filter_keeps_everything_on_rank_zero():
+    rank_filter = RankFilter(rank=0)
+    record = _record(logging.WARNING, "w")
+    assert rank_filter.filter(record) and rank_filter.filter(record)
+    assert record.rank == 0
+
+
+def test_rank_zero_logger_leaves_the_logger_alone(monkeypatch):
+    handler = _ListHandler()
+    logger = logging.getLogger("test_rank_zero_logger")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    monkeypatch.setattr(rank_zero_only, "rank", 1, raising=False)
+    get_pylogger("test_rank_zero_logger", rank_zero_only=True).info("dropped")
+    get_pylogger("test_rank_zero_logger", rank_zero_only=True).info("dropped")
+    logger.info("kept")
+    monkeypatch.setattr(rank_zero_only, "rank", 0, raising=False)
+    get_pylogger("test_rank_zero_logger", rank_zero_only=True).info("rank zero")
+    assert handler.messages == ["kept", "rank zero"]
+    logger.removeHandler(handler)
+
+
+def test_setup_queue_logging_is_idempotent(root_logger):
+    first = _ListHandler()
+    listener, rank_filter = setup_queue_logging(logging.INFO, rank=0, handlers=[first])
+    assert setup_queue_logging() == (listener, rank_filter)
+    assert len(root_logger.handlers) == 1
+
+    # reconfigured, e.g. by hydra
+    second = _ListHandler()
+    root_logger.handlers[:] = [second]
+    new_listener, _ = setup_queue_logging()
+    assert new_listener is not listener
+    assert new_listener.handlers == (second,)
+    logging.getLogger("test_queue").info("message")
+    stop_queue_logging()
+    assert second.messages == ["message"] and not first.messages
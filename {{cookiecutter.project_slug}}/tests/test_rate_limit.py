@@ -0,0 +1,40 @@
+from {{cookiecutter.project_slug}}.utils.rate_limit import EmissionLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_once():
+    limiter = EmissionLimiter(once=True)
+    assert [limiter.should_emit("a") for _ in range(3)] == [True, False, False]
+    assert limiter.should_emit("b")
+    assert limiter.pop_suppressed("a") == 2
+
+
+def test_every_n_seconds():
+    clock = _Clock()
+    limiter = EmissionLimiter(every_n_seconds=10, clock=clock)
+    assert limiter.should_emit()
+    clock.now = 5
+    assert not limiter.should_emit()
+    clock.now = 10
+    assert limiter.should_emit()
+    assert limiter.suppressed() == 1
+
+
+def test_every_n_steps():
+    limiter = EmissionLimiter(every_n_steps=3)
+    assert [limiter.should_emit(step=s) for s in range(7)] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+        True,
+    ]
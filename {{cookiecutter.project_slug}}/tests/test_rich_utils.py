@@ -0,0 +1,41 @@
+{% if cookiecutter.command_line_interface == "hydra" %}
+import pytest
+import rich.console
+from omegaconf import OmegaConf
+
+from {{cookiecutter.project_slug}}.utils.rank_zero import rank_zero_only
+from {{cookiecutter.project_slug}}.utils.rich_utils import print_config_tree
+
+
+@pytest.fixture(autouse=True)
+def _rank_zero(monkeypatch):
+    monkeypatch.setattr(rank_zero_only, "rank", 0, raising=False)
+
+
+def test_print_config_tree_truncates_and_renders_once(tmp_path, monkeypatch):
+    cfg = OmegaConf.create(
+        {
+            "data": {"ids": list(range(100)), "text": "x" * 1000},
+            "paths": {"output_dir": str(tmp_path)},
+        }
+    )
+    renders = []
+    print_ = rich.console.Console.print
+    monkeypatch.setattr(
+        rich.console.Console,
+        "print",
+        lambda self, *args, **kwargs: renders.append(args) or print_(self, *args, **kwargs),
+    )
+    print_config_tree(
+        cfg, print_order=(), save_to_file=True, max_list_items=3, max_str_len=10
+    )
+    assert len(renders) == 1
+    saved = (tmp_path / "config_tree.log").read_text()
+    assert "... (97 more items)" in saved
+    assert "xxxxxxxxxx... (1000 chars)" in saved
+    assert "99" not in saved
+
+
+def test_print_config_tree_without_output_dir():
+    print_config_tree(OmegaConf.create({"model": {"width": 8}}), print_order=())
+{% endif %}
@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+import torch
+
+from {{cookiecutter.project_slug}}.utils.seed import (
+    _collect_rng_states,
+    _set_rng_states,
+    collect_worker_rng_states,
+    pl_worker_init_function,
+)
+
+
+def _draw():
+    return random.random(), np.random.rand(), torch.rand(1).item()
+
+
+def test_packed_rng_states_roundtrip():
+    random.gauss(0, 1)  # populate the cached gaussian of python
+    packed = _collect_rng_states(packed=True)
+    assert packed["python"].dtype == np.uint32
+    assert packed["numpy"].shape == (625,)
+    expected = _draw()
+    _set_rng_states(packed)
+    assert _draw() == expected
+
+
+def test_worker_rng_states_reproduce_worker_seeding():
+    states = collect_worker_rng_states(base_seed=1234, num_workers=3, rank=0)
+    assert states["numpy"].shape == (3, 4)
+    pl_worker_init_function(2, rank=0, base_seed=1234)
+    expected = _draw()
+    np.random.seed(states["numpy"][2])
+    torch.manual_seed(int(states["torch"][2]))
+    high, low = (int(word) for word in states["python"][2])
+    random.seed((high << 64) + low)
+    assert _draw() == expected
@@ -0,0 +1,81 @@
+import os
+import signal
+import time
+
+import torch
+
+from {{cookiecutter.project_slug}}.utils.signal import (
+    PreemptionHandler,
+    requeue_slurm_job,
+    was_requeued,
+)
+from {{cookiecutter.project_slug}}.utils.storage import LocalStorage, StagedStorage
+from {{cookiecutter.project_slug}}.utils.training import (
+    CheckpointClosure,
+    Checkpointer,
+)
+
+
+class _Closure(CheckpointClosure):
+    def call(self):
+        return {
+            "model_state": {"w": torch.ones(2)},
+            "trainer_state": {
+                "epochs_completed": 0,
+                "batches_in_epoch_completed": 3,
+            },
+        }
+
+
+def test_preemption_signal_triggers_emergency_save(tmp_path):
+    checkpointer = Checkpointer(tmp_path, save_completed_epochs=False)
+    preemption = PreemptionHandler(signals=[signal.SIGUSR1], requeue=False)
+    preemption.install()
+    try:
+        assert not preemption.maybe_save_and_requeue(checkpointer, _Closure())
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert preemption.maybe_save_and_requeue(checkpointer, _Closure())
+    finally:
+        preemption.uninstall()
+    assert preemption.received_signal == signal.SIGUSR1
+    assert checkpointer.find_latest_checkpoint() is not None
+
+
+def test_requeue_without_scontrol(monkeypatch):
+    monkeypatch.setenv("SLURM_JOB_ID", "123")
+    monkeypatch.delenv("SLURM_ARRAY_JOB_ID", raising=False)
+    monkeypatch.setenv("PATH", "")
+    assert not requeue_slurm_job()
+
+
+class _SlowStorage(LocalStorage):
+    def put_file(self, local_path, name):
+        time.sleep(0.05)
+        super().put_file(local_path, name)
+
+
+def test_emergency_save_is_durable_before_returning(tmp_path):
+    durable = _SlowStorage(tmp_path / "durable")
+    (tmp_path / "durable").mkdir()
+    storage = StagedStorage(tmp_path / "staging", durable)
+    checkpointer = Checkpointer(
+        tmp_path, save_completed_epochs=False, storage=storage, async_save=True
+    )
+    preemption = PreemptionHandler(signals=[signal.SIGUSR1], requeue=False)
+    preemption.install()
+    try:
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert preemption.maybe_save_and_requeue(checkpointer, _Closure())
+    finally:
+        preemption.uninstall()
+    assert durable.list("model_state_*.pt") and durable.list("training_state_*.pt")
+    storage.close()
+
+
+def test_was_requeued(monkeypatch):
+    monkeypatch.delenv("SLURM_RESTART_COUNT", raising=False)
+    assert not was_requeued()
+    monkeypatch.setenv("SLURM_RESTART_COUNT", "0")
+    assert not was_requeued()
+    monkeypatch.setenv("SLURM_RESTART_COUNT", "1")
+    assert was_requeued()
@@ -0,0 +1,64 @@
+import torch
+
+from {{cookiecutter.project_slug}}.utils.snapshot import StateSnapshotter
+from {{cookiecutter.project_slug}}.utils.training import (
+    Checkpointer,
+    SnapshotCheckpointClosure,
+)
+
+
+def _state(model, optimizer):
+    return {"model": model.state_dict(), "optimizer": optimizer.state_dict()}
+
+
+def test_snapshot_reuses_buffers_and_is_consistent():
+    model = torch.nn.Linear(4, 3)
+    optimizer = torch.optim.Adam(model.parameters())
+    model(torch.randn(2, 4)).sum().backward()
+    optimizer.step()
+    snapshotter = StateSnapshotter(num_buffers=2)
+
+    first = snapshotter.snapshot(_state(model, optimizer))
+    snapshotter.wait()
+    expected = model.weight.detach().clone()
+    with torch.no_grad():
+        model.weight.add_(1.0)
+    assert torch.equal(first["model"]["weight"], expected)
+    assert first["optimizer"]["state"][0]["exp_avg"].shape == (3, 4)
+    assert hasattr(first["model"], "_metadata")
+
+    second = snapshotter.snapshot(_state(model, optimizer))
+    third = snapshotter.snapshot(_state(model, optimizer))
+    snapshotter.wait()
+    assert second["model"]["weight"].data_ptr() != first["model"]["weight"].data_ptr()
+    assert third["model"]["weight"].data_ptr() == first["model"]["weight"].data_ptr()
+    assert torch.equal(third["model"]["weight"], expected + 1.0)
+
+
+def test_tied_tensors_share_their_copy():
+    weight = torch.randn(5, 2)
+    snapshot = StateSnapshotter().snapshot({"a": weight, "b": weight.detach()})
+    assert snapshot["a"] is snapshot["b"]
+
+
+def test_async_checkpointer_with_snapshots(tmp_path):
+    model = torch.nn.Linear(4, 3)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    snapshotter = StateSnapshotter()
+    checkpointer = Checkpointer(
+        tmp_path, keep_most_recent_by_count=2, async_save=True
+    )
+    for batch in range(1, 5):
+        with torch.no_grad():
+            model.weight.fill_(batch)
+        closure = SnapshotCheckpointClosure(
+            snapshotter,
+            _state(model, optimizer),
+            {"epochs_completed": 0, "batches_in_epoch_completed": batch},
+        )
+        checkpointer.save_checkpoint(closure)
+    checkpointer.wait_until_saved()
+
+    assert checkpointer._find_all_checkpoints() == {(0, 3), (0, 4)}
+    states = checkpointer.load_checkpoint()
+    assert torch.equal(states["model_state"]["model"]["weight"], torch.full((3, 4), 4.0))
@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+import torch
+
+from {{cookiecutter.project_slug}}.utils.storage import (
+    LocalObjectStoreClient,
+    LocalStorage,
+    S3Storage,
+    StagedStorage,
+)
+from {{cookiecutter.project_slug}}.utils.training import (
+    CheckpointClosure,
+    Checkpointer,
+)
+
+
+class _Closure(CheckpointClosure):
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+
+    def call(self):
+        return {
+            "model_state": {"w": torch.full((2,), float(self.batches))},
+            "trainer_state": {
+                "epochs_completed": 0,
+                "batches_in_epoch_completed": self.batches,
+            },
+        }
+
+
+@pytest.fixture(params=["local", "staged", "s3"])
+def storage(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(tmp_path)
+    if request.param == "staged":
+        return StagedStorage(tmp_path / "shm", LocalStorage(tmp_path))
+    return S3Storage("bucket", "run", LocalObjectStoreClient(tmp_path))
+
+
+def test_checkpointer_with_storage(tmp_path, storage):
+    checkpointer = Checkpointer(tmp_path, storage=storage)
+    for batches in range(1, 4):
+        checkpointer.save_checkpoint(_Closure(batches))
+    storage.flush()
+    assert sorted(storage.list("model_state_*")) == [
+        "model_state_e0_b2.pt",
+        "model_state_e0_b3.pt",
+    ]
+    states = checkpointer.load_checkpoint()
+    assert states["trainer_state"]["batches_in_epoch_completed"] == 3
+    assert torch.equal(states["model_state"]["w"], torch.full((2,), 3.0))
+
+
+def test_checksummed_checkpoints_with_storage(tmp_path, storage):
+    checkpointer = Checkpointer(tmp_path, storage=storage, checksums=True)
+    checkpointer.save_checkpoint(_Closure(1))
+    storage.flush()
+    assert storage.exists("model_state_e0_b1.pt.sums.json")
+    states = checkpointer.load_checkpoint()
+    assert states["trainer_state"]["batches_in_epoch_completed"] == 1
+
+
+def test_staged_reads_fall_back_when_drained_meanwhile(tmp_path):
+    storage = StagedStorage(tmp_path / "shm", LocalStorage(tmp_path))
+    storage.put_bytes(b"data", "a.bin")
+    storage.flush()
+    # the staged file was there when checked, and drained before being read
+    storage._staged["a.bin"] = ".a.bin.0.staged"
+    assert storage.get_bytes("a.bin") == b"data"
+    storage.link("a.bin", "b.bin")
+    assert (tmp_path / "b.bin").read_bytes() == b"data"
+    storage.close()
+    storage.close()
+
+
+class _BlockingStorage(LocalStorage):
+    """Blocks the first `put_file` before or after the copy, until `release` is set."""
+
+    def __init__(self, directory, block_after_copy):
+        super().__init__(directory)
+        self.block_after_copy = block_after_copy
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def put_file(self, local_path, name):
+        first = not self.entered.is_set()
+        if first and not self.block_after_copy:
+            self.entered.set()
+            self.release.wait()
+        super().put_file(local_path, name)
+        if first and self.block_after_copy:
+            self.entered.set()
+            self.release.wait()
+
+
+@pytest.mark.parametrize("block_after_copy", [False, True])
+def test_staged_name_written_again_while_draining(tmp_path, block_after_copy):
+    durable = _BlockingStorage(tmp_path / "durable", block_after_copy)
+    (tmp_path / "durable").mkdir()
+    storage = StagedStorage(tmp_path / "shm", durable)
+    storage.put_bytes(b"v1", "state.json")
+    assert durable.entered.wait(10)
+    storage.put_bytes(b"v2", "state.json")
+    assert storage.get_bytes("state.json") == b"v2"
+    durable.release.set()
+    storage.flush()
+    assert (tmp_path / "durable" / "state.json").read_bytes() == b"v2"
+    assert storage.get_bytes("state.json") == b"v2"
+    assert not list((tmp_path / "shm").iterdir())
+    storage.close()
+
+
+def test_s3_exists(tmp_path):
+    storage = S3Storage("bucket", "run", LocalObjectStoreClient(tmp_path))
+    assert not storage.exists("a.bin")
+    storage.put_bytes(b"data", "a.bin")
+    assert storage.exists("a.bin")
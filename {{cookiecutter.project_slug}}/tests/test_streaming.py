@@ -0,0 +1,59 @@
+import pytest
+from torch.utils.data import DataLoader
+
+from {{cookiecutter.project_slug}}.utils.streaming import StreamingDataset
+
+
+def _open(source):
+    return ({"source": source, "value": i} for i in range(source * 10, source * 10 + 10))
+
+
+def _dataset(**kwargs):
+    return StreamingDataset(
+        sources=[0, 1, 2],
+        open_source=_open,
+        filter_fn=lambda ex: ex["value"] % 3 != 0,
+        map_fn=lambda ex: ex["value"],
+        shuffle_buffer_size=4,
+        seed=1,
+        **kwargs,
+    )
+
+
+EXPECTED = sorted(v for v in range(30) if v % 3 != 0)
+
+
+@pytest.mark.filterwarnings("ignore:This DataLoader will create")
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_workers_and_ranks_cover_the_stream_once(num_workers):
+    values = []
+    for rank in range(2):
+        dataset = _dataset(rank=rank, world_size=2)
+        values += list(DataLoader(dataset, batch_size=None, num_workers=num_workers))
+    assert sorted(int(v) for v in values) == EXPECTED
+
+
+def test_shuffling_is_deterministic_per_epoch():
+    dataset = _dataset()
+    first = list(dataset)
+    assert sorted(first) == EXPECTED
+    assert first != EXPECTED
+    assert list(dataset) == first
+    dataset.set_epoch(1)
+    assert list(dataset) != first
+
+
+def test_batching():
+    batches = list(_dataset(batch_size=6, collate_fn=sum, drop_last=True))
+    assert len(batches) == len(EXPECTED) // 6
+
+
+def test_examples_per_shard_equalizes_the_ranks():
+    lengths = [len(list(_dataset(rank=rank, world_size=2))) for rank in range(2)]
+    assert lengths[0] != lengths[1]
+    for rank in range(2):
+        values = list(_dataset(rank=rank, world_size=2, examples_per_shard=10))
+        assert len(values) == 10
+        assert set(values) <= set(EXPECTED)
+    batches = list(_dataset(world_size=1, examples_per_shard=5, batch_size=2))
+    assert [len(b) for b in batches] == [2, 2, 1]